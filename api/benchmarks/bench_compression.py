@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from fastapi import FastAPI
+from benchmarks.harness import LOCATIONS
+from constants.emotion_enum import Emotions
+from endpoints.readings import render_json
+from services.compact_encoding import encode_emotion_counts, encode_readings
+from services.compression import CompressionMiddleware, ENCODING_MODULES, get_available_encodings
+from services.executors import run_cpu_bound
+
+# Bytes on the wire and server cpu per request of the readings history and the chart series,
+# as plain json and the compact encoding, uncompressed and with each encoding that's installed (pip install brotli zstandard for all of them)
+# the app is called directly over asgi, so the cpu time is the json rendering, the compact encoding and the compression with no client in it
+# run from the api directory: python -m benchmarks.bench_compression [--readings 1000 10000] [--json]
+
+# GET /readings for a user with `size` readings, a few a day as the app sends them
+def make_history(size: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    labels = [str(emotion) for emotion in Emotions]
+    now = datetime(2024, 9, 1, 12, 0)
+    readings = [{
+        'id': size - i,
+        'emotion': rng.choice(labels),
+        'location': rng.choice([None, *LOCATIONS]),
+        'datetime': (now - timedelta(hours=8 * i, minutes=rng.randint(0, 59))).strftime('%Y-%m-%dT%H:%M'),
+        'note': rng.choice([None, None, None, 'Benchmark note']),
+    } for i in range(size)]
+    counts = {label: 0 for label in labels}
+    for reading in readings:
+        counts[reading['emotion']] += 1
+    return {'readings': readings, 'counts': counts}
+
+# GET /readings/emotion-counts for every emotion, daily for 30d and weekly for 1yr
+def make_emotion_counts(points: int, step: timedelta, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    start_date = datetime(2024, 1, 1)
+    dates = [(start_date + step * i).strftime('%Y-%m-%d') for i in range(points)]
+    return {str(emotion): [{'date': date, 'count': rng.randint(0, 5)} for date in dates] for emotion in Emotions}
+
+def make_app(payload: dict, encode) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/payload')
+    async def get_payload():
+        return await run_cpu_bound(render_json, payload, encode)
+
+    return app
+
+async def request(app, accept_encoding: str) -> int:
+    headers = [(b'accept-encoding', accept_encoding.encode())] if accept_encoding else []
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': '/payload', 'raw_path': b'/payload',
+             'root_path': '', 'query_string': b'', 'headers': headers, 'server': ('bench', 80), 'client': ('bench', 1234)}
+    sent = 0
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal sent
+        if message['type'] == 'http.response.body':
+            sent += len(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return sent
+
+# process time covers the cpu pool's threads as well as the event loop's
+async def measure(app, accept_encoding: str, repeat: int) -> dict:
+    sent = await request(app, accept_encoding)
+    cpu_started_at = time.process_time()
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        await request(app, accept_encoding)
+    return {
+        'bytes': sent,
+        'cpu_ms': (time.process_time() - cpu_started_at) * 1000 / repeat,
+        'latency_ms': (time.perf_counter() - started_at) * 1000 / repeat,
+    }
+
+async def main(args) -> dict:
+    encodings = get_available_encodings(','.join(ENCODING_MODULES))
+    payloads = {f'history {size}': (make_history(size, args.seed), encode_readings) for size in args.readings}
+    payloads['counts 30d'] = (make_emotion_counts(31, timedelta(days=1), args.seed), encode_emotion_counts)
+    payloads['counts 1yr'] = (make_emotion_counts(52, timedelta(weeks=1), args.seed), encode_emotion_counts)
+
+    results = {}
+    for name, (payload, encode) in payloads.items():
+        results[name] = {}
+        for format, encoder in (('json', None), ('compact', encode)):
+            app = CompressionMiddleware(make_app(payload, encoder), encodings=','.join(encodings), minimum_size=args.minimum_size)
+            for encoding in ['identity', *encodings]:
+                results[name][f'{format} {encoding}'] = await measure(app, encoding, args.repeat)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare response size and server cpu of the readings as json and compact, with each compression")
+    parser.add_argument('--readings', type=int, nargs='+', default=[1000, 10000], help="history sizes")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--minimum-size', type=int, default=1024)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the report as json")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, scenarios in results.items():
+            baseline = scenarios['json identity']['bytes']
+            print(name)
+            print(f"  {'response':<18}{'bytes':>12}{'of json':>10}{'cpu ms':>10}{'latency ms':>12}")
+            for scenario, report in scenarios.items():
+                print(f"  {scenario:<18}{report['bytes']:>12}{report['bytes'] / baseline * 100:>9.1f}%{report['cpu_ms']:>10.2f}{report['latency_ms']:>12.2f}")
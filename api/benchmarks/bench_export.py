@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+from benchmarks.harness import LOCATIONS
+from constants.emotion_enum import Emotions
+from services.export_readings import EXPORT_BATCH_SIZE, create_writer, get_available_formats, stream_export
+
+# Throughput and memory of the readings export for each format, on millions of generated rows
+# one generated batch is yielded over and over in place of the database cursor, so this times the encoding and the
+# memory the export holds at once, which should stay flat as the row count grows
+# with BENCH_DATABASE_URL set --database seeds one user with the rows and exports them through the server side cursor
+# run from the api directory: python -m benchmarks.bench_export [--rows 1000000 5000000] [--database] [--json]
+
+ROW_COUNTS = [1_000_000]
+
+def make_batch(batch_size: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    labels = [str(emotion) for emotion in Emotions]
+    started_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    batch = []
+    for i in range(batch_size):
+        probabilities = [rng.random() for _ in labels]
+        total = sum(probabilities)
+        probabilities = [probability / total for probability in probabilities]
+        batch.append(SimpleNamespace(
+            reading_id=i,
+            clerk_id=f'user_{i % 1000}',
+            datetime=started_at + timedelta(minutes=7 * i),
+            emotion=rng.choice(labels),
+            location=rng.choice([None, *LOCATIONS]),
+            note=rng.choice([None, 'Benchmark note']),
+            confidence=max(probabilities),
+            probabilities=probabilities,
+        ))
+    return batch
+
+# samples the resident memory while exporting, reports how far it rose above where it started
+class PeakMemory:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = self.start = 0
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def get_rss() -> int:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.get_rss())
+
+    def __enter__(self):
+        self.start = self.peak = self.get_rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.get_rss())
+
+    @property
+    def growth_mb(self) -> float:
+        return (self.peak - self.start) / 1e6
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+async def export(name: str, session_factory, clerk_id: str = None, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    size = chunks = 0
+    started_at = time.perf_counter()
+    async for chunk in stream_export(session_factory, create_writer(name), clerk_id, batch_size):
+        size += len(chunk)
+        chunks += 1
+    return {'seconds': time.perf_counter() - started_at, 'bytes': size, 'chunks': chunks}
+
+def bench_format(name: str, rows: int, batch_size: int) -> dict:
+    batch = make_batch(batch_size)
+
+    async def stream_readings_for_export(session, clerk_id, batch_size):
+        for start in range(0, rows, batch_size):
+            yield batch[:rows - start]
+
+    with patch('db.queries.stream_readings_for_export', stream_readings_for_export), PeakMemory() as memory:
+        result = asyncio.run(export(name, FakeSession, batch_size=batch_size))
+    return summarise(result, rows, memory)
+
+def summarise(result: dict, rows: int, memory: PeakMemory) -> dict:
+    return {
+        'rows': rows,
+        'rows_per_second': rows / result['seconds'],
+        'mb_per_second': result['bytes'] / 1e6 / result['seconds'],
+        'bytes_per_row': result['bytes'] / rows if rows else 0,
+        'output_mb': result['bytes'] / 1e6,
+        'chunks': result['chunks'],
+        'rss_growth_mb': memory.growth_mb,
+    }
+
+# the same export read from the benchmark database through the server side cursor
+def bench_database(rows: int, batch_size: int) -> dict:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from benchmarks.harness import seed_database
+
+    engine = create_async_engine(os.environ['BENCH_DATABASE_URL'])
+    results = {}
+
+    async def run():
+        users = await seed_database(engine, [rows])
+        session_factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+        for name in get_available_formats():
+            with PeakMemory() as memory:
+                result = await export(name, session_factory, users[rows], batch_size)
+            results[name] = summarise(result, rows, memory)
+        await engine.dispose()
+
+    asyncio.run(run())
+    return results
+
+def run(row_counts: list[int] = ROW_COUNTS, batch_size: int = EXPORT_BATCH_SIZE, database: bool = False) -> dict:
+    results = {
+        f'{name}_{rows}': bench_format(name, rows, batch_size)
+        for rows in row_counts
+        for name in get_available_formats()
+    }
+    if database:
+        results.update({f'database_{name}_{row_counts[0]}': result for name, result in bench_database(row_counts[0], batch_size).items()})
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the readings export")
+    parser.add_argument('--rows', type=int, nargs='+', default=ROW_COUNTS)
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument('--database', action='store_true', help="also export from BENCH_DATABASE_URL, which is dropped and reseeded")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.batch_size, args.database)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'export':<28}{'rows/s':>12}{'MB/s':>8}{'B/row':>8}{'MB':>9}{'rss growth MB':>15}")
+        for name, result in results.items():
+            print(f"{name:<28}{result['rows_per_second']:>12,.0f}{result['mb_per_second']:>8.1f}{result['bytes_per_row']:>8.1f}"
+                  f"{result['output_mb']:>9.1f}{result['rss_growth_mb']:>15.1f}")
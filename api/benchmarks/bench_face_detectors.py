@@ -0,0 +1,120 @@
+import argparse
+import csv
+import json
+import os
+import time
+import cv2
+import numpy as np
+from benchmarks.harness import make_face_image, summarise
+from preprocessing.faceDetectors import HaarCascadeDetector, YuNetDetector
+from preprocessing.preprocessImage import find_largest_face
+
+# Compares the face detectors' accuracy and latency side by side on a labelled sample
+# the sample is a directory of images with a labels.csv of file,x,y,w,h (x..h left empty for images without a face),
+# without one a synthetic sample is generated, which only shows latency and that detection works - use real photos for accuracy
+# yunet is included when YUNET_MODEL_PATH is set
+# run from the api directory: python -m benchmarks.bench_face_detectors [--sample <dir>] [--json]
+
+# a detection is correct when the largest box found overlaps the labelled face by at least this much
+IOU_THRESHOLD = 0.5
+
+SYNTHETIC_RESOLUTIONS = [(480, 640), (960, 1280), (1440, 1920), (3024, 4032)]
+
+def intersection_over_union(box_a: tuple, box_b: tuple) -> float:
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    width = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    height = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = width * height
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union else 0.0
+
+# [(name, greyscale image, labelled box or None)]
+def load_sample(sample_dir: str) -> list[tuple]:
+    sample = []
+    with open(os.path.join(sample_dir, 'labels.csv')) as file:
+        for row in csv.DictReader(file):
+            image = cv2.imread(os.path.join(sample_dir, row['file']), cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                raise ValueError(f"Could not read {row['file']}")
+            box = tuple(int(row[key]) for key in ('x', 'y', 'w', 'h')) if row['w'] else None
+            sample.append((row['file'], image, box))
+    return sample
+
+# faces drawn by the harness, labelled with the ellipse's bounding box, plus noise images without a face
+def make_synthetic_sample() -> list[tuple]:
+    sample = []
+    for width, height in SYNTHETIC_RESOLUTIONS:
+        for seed, face_ratio in enumerate((0.3, 0.5, 0.7)):
+            image = cv2.cvtColor(make_face_image(width, height, face_ratio=face_ratio, seed=seed), cv2.COLOR_BGR2GRAY)
+            radius = int(min(width, height) * face_ratio / 2)
+            box = (width // 2 - int(radius * 0.8), height // 2 - radius, int(radius * 1.6), radius * 2)
+            sample.append((f'face_{width}x{height}_{face_ratio}', image, box))
+        noise = np.random.default_rng(0).integers(0, 255, size=(height, width), dtype=np.uint8)
+        sample.append((f'noise_{width}x{height}', cv2.GaussianBlur(noise, (0, 0), 3), None))
+    return sample
+
+# haar_full_search is the cascade searching every face size from 60px up, as it did before the search was sized to the image
+def get_detectors() -> dict:
+    detectors = {'haar': HaarCascadeDetector(), 'haar_full_search': HaarCascadeDetector(min_face_ratio=0)}
+    if os.getenv('YUNET_MODEL_PATH'):
+        detectors['yunet'] = YuNetDetector(os.getenv('YUNET_MODEL_PATH'))
+    return detectors
+
+def bench_detector(detector, sample: list[tuple], repeat: int) -> dict:
+    detector.load()
+    timings, ious = [], []
+    correct = missed = false_positives = multiple = 0
+    started_at = time.perf_counter()
+    for _, image, box in sample:
+        for _ in range(repeat):
+            call_started_at = time.perf_counter()
+            faces = detector.detect(image)
+            timings.append((time.perf_counter() - call_started_at) * 1000)
+        if box is None:
+            false_positives += len(faces) > 0
+            continue
+        if len(faces) == 0:
+            missed += 1
+            continue
+        multiple += len(faces) > 1
+        iou = intersection_over_union(find_largest_face(faces), box)
+        ious.append(iou)
+        correct += iou >= IOU_THRESHOLD
+
+    faces_labelled = sum(1 for _, _, box in sample if box is not None)
+    return {
+        'latency': summarise(timings, time.perf_counter() - started_at),
+        'accuracy': correct / faces_labelled if faces_labelled else None,
+        'missed': missed,
+        'multiple_faces': multiple,
+        'false_positives': false_positives,
+        'mean_iou': float(np.mean(ious)) if ious else None,
+    }
+
+def run(sample_dir: str = None, repeat: int = 5) -> dict:
+    sample = load_sample(sample_dir) if sample_dir else make_synthetic_sample()
+    return {
+        'sample': sample_dir or 'synthetic',
+        'images': len(sample),
+        'detectors': {name: bench_detector(detector, sample, repeat) for name, detector in get_detectors().items()},
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare face detector accuracy and latency")
+    parser.add_argument('--sample', help="directory of images with a labels.csv, defaults to a synthetic sample")
+    parser.add_argument('--repeat', type=int, default=5, help="timed detections per image")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.sample, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{results['images']} images from {results['sample']}")
+        print(f"{'detector':<18}{'accuracy':>10}{'mean iou':>10}{'missed':>8}{'multiple':>10}{'false +':>9}{'p50 ms':>9}{'p95 ms':>9}")
+        for name, result in results['detectors'].items():
+            accuracy = f"{result['accuracy'] * 100:.1f}%" if result['accuracy'] is not None else '-'
+            mean_iou = f"{result['mean_iou']:.2f}" if result['mean_iou'] is not None else '-'
+            print(f"{name:<18}{accuracy:>10}{mean_iou:>10}{result['missed']:>8}{result['multiple_faces']:>10}"
+                  f"{result['false_positives']:>9}{result['latency']['p50_ms']:>9.1f}{result['latency']['p95_ms']:>9.1f}")
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from contextlib import ExitStack
+from unittest.mock import patch
+import httpx
+from benchmarks.harness import FakeServingServer, make_face_image, summarise, to_base64_jpeg, use_test_token
+from services.admission import AdmissionController
+
+# Overload test for /api/predict, sends predictions at a fixed rate above what the api and serving can keep up with
+# and compares tail latency with admission control off, with a fixed limit and with the adaptive limit
+# the app runs in process against a fake TensorFlow Serving that only serves --serving-capacity requests at once
+# run from the api directory:
+#   python -m benchmarks.bench_overload --rate 80 --duration 10
+
+# each scenario's admission settings, a limit of 0 turns admission control off
+def get_scenarios(args) -> dict[str, dict]:
+    queue = {'queue_size': args.queue_size, 'queue_timeout': args.queue_timeout}
+    return {
+        'off': {'limit': 0, **queue},
+        'fixed': {'limit': args.limit, **queue},
+        'adaptive': {'limit': args.limit, 'adaptive': True, 'target_latency': args.target_latency, 'max_limit': args.limit * 4, **queue},
+    }
+
+class OverloadStats:
+    def __init__(self):
+        self.served = []
+        self.rejected = []
+        self.failed = []
+
+    def record(self, status_code: int, latency_ms: float):
+        if status_code == 200:
+            self.served.append(latency_ms)
+        elif status_code == 503:
+            self.rejected.append(latency_ms)
+        else:
+            self.failed.append(latency_ms)
+
+    def report(self, duration_seconds: float) -> dict:
+        total = len(self.served) + len(self.rejected) + len(self.failed)
+        report = {
+            'requests': total,
+            'served': summarise(self.served, duration_seconds) if self.served else None,
+            'rejected_rate': len(self.rejected) / total,
+            'failed_rate': len(self.failed) / total,
+        }
+        if self.served:
+            report['served']['max_ms'] = max(self.served)
+        if self.rejected:
+            report['rejected_p99_ms'] = summarise(self.rejected, duration_seconds)['p99_ms']
+        return report
+
+async def predict(client: httpx.AsyncClient, stats: OverloadStats, image: str, token: str):
+    started_at = time.perf_counter()
+    try:
+        response = await client.post('/api/predict', json={'image': image}, headers={'Authorization': f'Bearer {token}'})
+        status_code = response.status_code
+    except httpx.TimeoutException:
+        status_code = 504
+    stats.record(status_code, (time.perf_counter() - started_at) * 1000)
+
+# open loop, requests arrive at the rate whether or not earlier ones have finished, as phones do
+async def drive(client: httpx.AsyncClient, rate: float, duration: float, image: str, token: str, rng: random.Random) -> dict:
+    stats = OverloadStats()
+    requests = []
+    loop = asyncio.get_running_loop()
+    started_at = next_at = loop.time()
+    while next_at - started_at < duration:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        requests.append(asyncio.create_task(predict(client, stats, image, token)))
+        next_at += rng.expovariate(rate)
+    await asyncio.gather(*requests)
+    return stats.report(loop.time() - started_at)
+
+async def run_scenario(settings: dict, args, image: str, token: str) -> dict:
+    from main import create_app
+
+    with patch('main.predict_admission', AdmissionController(**settings)):
+        app = create_app()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://overload', timeout=httpx.Timeout(args.timeout)) as client:
+        return await drive(client, args.rate, args.duration, image, token, random.Random(args.seed))
+
+async def main(args) -> dict:
+    image = to_base64_jpeg(make_face_image(*args.resolution))
+    token = use_test_token()
+    results = {}
+    with ExitStack() as stack:
+        serving = stack.enter_context(FakeServingServer(latency_seconds=args.serving_latency, capacity=args.serving_capacity))
+        stack.enter_context(patch.dict(os.environ, {'MODEL_PREDICT_URL': serving.url}))
+        for name, settings in get_scenarios(args).items():
+            if args.only and name not in args.only:
+                continue
+            results[name] = await run_scenario(settings, args, image, token)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare /api/predict tail latency under overload with and without admission control")
+    parser.add_argument('--rate', type=float, default=80, help="predictions sent a second")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to send for")
+    parser.add_argument('--serving-latency', type=float, default=0.05, help="fake serving time per request in seconds")
+    parser.add_argument('--serving-capacity', type=int, default=2, help="requests the fake serving handles at once")
+    parser.add_argument('--limit', type=int, default=4, help="admission limit of the fixed and adaptive scenarios")
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--queue-timeout', type=float, default=0.5)
+    parser.add_argument('--target-latency', type=float, default=0.25, help="adaptive scenario's target latency in seconds")
+    parser.add_argument('--resolution', type=int, nargs=2, default=(480, 640), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--timeout', type=float, default=30, help="client timeout in seconds, longer counts as failed")
+    parser.add_argument('--only', nargs='+', choices=['off', 'fixed', 'adaptive'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the report as json")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.rate:.0f} predictions/s for {args.duration:.0f}s, serving {args.serving_capacity} at a time x {args.serving_latency * 1000:.0f}ms")
+        print(f"{'admission':<12}{'served/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'503s':>9}{'failed':>9}")
+        for name, report in results.items():
+            served = report['served'] or {'ops_per_second': 0, 'p50_ms': 0, 'p99_ms': 0, 'max_ms': 0}
+            print(f"{name:<12}{served['ops_per_second']:>10.1f}{served['p50_ms']:>10.1f}{served['p99_ms']:>10.1f}{served['max_ms']:>10.1f}"
+                  f"{report['rejected_rate'] * 100:>8.1f}%{report['failed_rate'] * 100:>8.1f}%")
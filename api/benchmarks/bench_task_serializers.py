@@ -0,0 +1,65 @@
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+from kombu.serialization import dumps, loads
+from services.celery.serializers import COMPACT_JSON, to_epoch_seconds
+
+# Compares message size and encode/decode cost of the celery task payloads for each serializer
+# run from the api directory: python -m benchmarks.bench_task_serializers [--json]
+
+def get_payloads() -> dict:
+    now = datetime.now(timezone.utc)
+    clerk_ids = [f'user_2lQF4rzaQnsst56zUbVxfTn{i:04d}' for i in range(250)]
+    # celery protocol 2 bodies are (args, kwargs, embed)
+    embed = {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}
+    return {
+        'send_notification': ([clerk_ids[0]], {}, embed),
+        'send_notification_batch': ([clerk_ids, to_epoch_seconds(now)], {}, embed),
+        'plan_user_notifications': ([clerk_ids[0], '09:00', '17:00'], {}, embed),
+        # the legacy scheduler sent datetimes, epoch seconds are what replaces them
+        'daily_scheduler (datetimes)': ([clerk_ids[0], now, now + timedelta(hours=8)], {}, embed),
+        'daily_scheduler (epoch seconds)': ([clerk_ids[0], to_epoch_seconds(now), to_epoch_seconds(now + timedelta(hours=8))], {}, embed),
+    }
+
+def bench_payload(payload, serializer: str, number: int) -> dict:
+    content_type, content_encoding, body = dumps(payload, serializer=serializer)
+    encode_seconds = min(timeit.repeat(lambda: dumps(payload, serializer=serializer), number=number, repeat=3)) / number
+    decode_seconds = min(timeit.repeat(lambda: loads(body, content_type, content_encoding, accept={content_type}), number=number, repeat=3)) / number
+    return {
+        'bytes': len(body),
+        'encode_us': encode_seconds * 1e6,
+        'decode_us': decode_seconds * 1e6,
+    }
+
+def run(number: int = 2000) -> dict:
+    results = {}
+    for name, payload in get_payloads().items():
+        results[name] = {}
+        for serializer in ('pickle', 'json', COMPACT_JSON):
+            # the json serializer can't carry datetimes in older kombu versions
+            try:
+                results[name][serializer] = bench_payload(payload, serializer, number)
+            except Exception as e:
+                results[name][serializer] = {'error': str(e)}
+    return results
+
+def print_results(results: dict):
+    print(f"{'payload':<34}{'serializer':<14}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for name, serializers in results.items():
+        for serializer, result in serializers.items():
+            if 'error' in result:
+                print(f"{name:<34}{serializer:<14}  {result['error']}")
+            else:
+                print(f"{name:<34}{serializer:<14}{result['bytes']:>8}{result['encode_us']:>12.2f}{result['decode_us']:>12.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark celery task payload serializers")
+    parser.add_argument('--number', type=int, default=2000, help="encode/decode calls per measurement")
+    parser.add_argument('--json', action='store_true', help="print the results as json")
+    args = parser.parse_args()
+    results = run(args.number)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+
+# Compare two benchmark results files and flag cases that got slower
+# python -m benchmarks.compare results/<old>.json results/<new>.json [--metric p50_ms] [--threshold 0.1]
+# exits with status 1 if any case regressed by more than the threshold
+
+# walk the nested results and yield (case name, stats) for every timed case
+def get_cases(results: dict, prefix: str = ''):
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        path = f'{prefix}/{name}' if prefix else name
+        if 'mean_ms' in value or 'encode_us' in value:
+            yield path, value
+        else:
+            yield from get_cases(value, path)
+
+def compare(old: dict, new: dict, metric: str = 'p50_ms', threshold: float = 0.1) -> list[dict]:
+    old_cases = dict(get_cases(old['benchmarks']))
+    rows = []
+    for case, stats in get_cases(new['benchmarks']):
+        if case not in old_cases or metric not in stats or metric not in old_cases[case]:
+            continue
+        before, after = old_cases[case][metric], stats[metric]
+        change = (after - before) / before if before else 0.0
+        rows.append({
+            'case': case,
+            'before': before,
+            'after': after,
+            'change': change,
+            'regressed': change > threshold,
+        })
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='p50_ms', help="stat to compare, i.e. p50_ms, p95_ms, mean_ms, bytes")
+    parser.add_argument('--threshold', type=float, default=0.1, help="fractional slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    rows = compare(old, new, args.metric, args.threshold)
+    print(f"{old['environment']['commit']} -> {new['environment']['commit']} ({args.metric})")
+    for row in rows:
+        flag = '  REGRESSION' if row['regressed'] else ''
+        print(f"{row['case']:<60}{row['before']:>12.3f}{row['after']:>12.3f}{row['change'] * 100:>+9.1f}%{flag}")
+    sys.exit(1 if any(row['regressed'] for row in rows) else 0)
@@ -0,0 +1,222 @@
+import base64
+import json
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+from constants.emotion_enum import Emotions
+
+# Shared pieces for the benchmarks: synthetic images, a fake TensorFlow Serving server,
+# a seeded local postgres and timing helpers. Nothing here talks to anything outside this machine.
+
+LOCATIONS = ['Home', 'Work', 'School', 'Gym', 'Restaurant', 'Outdoors', 'Commute', 'Vacation', 'Shopping'] # mobile-client/constants/Locations.ts
+
+# draw a face the haarcascade detects, centred in a (height, width) bgr image
+# the face is sized relative to the image so every resolution goes through detection
+# sensor noise is added after the blur, as in a real photo, so the face has fine detail at full resolution for the sharpness check
+def make_face_image(width: int, height: int, face_ratio: float = 0.5, seed: int = 0, noise: float = 4) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    image = rng.integers(30, 60, size=(height, width), dtype=np.uint8)
+    centre = (width // 2, height // 2)
+    radius = int(min(width, height) * face_ratio / 2)
+    cv2.ellipse(image, centre, (int(radius * 0.8), radius), 0, 0, 360, 200, -1)
+    eye_y = centre[1] - radius // 4
+    eye_x = int(radius * 0.35)
+    for dx in (-eye_x, eye_x):
+        cv2.ellipse(image, (centre[0] + dx, eye_y), (radius // 6, radius // 10), 0, 0, 360, 30, -1)
+        cv2.line(image, (centre[0] + dx - radius // 5, eye_y - radius // 5), (centre[0] + dx + radius // 5, eye_y - radius // 5), 60, max(1, radius // 20))
+    cv2.line(image, (centre[0], eye_y), (centre[0] - radius // 10, centre[1] + radius // 5), 150, max(1, radius // 25))
+    cv2.ellipse(image, (centre[0], centre[1] + radius // 2), (radius // 3, radius // 10), 0, 0, 360, 60, -1)
+    image = cv2.GaussianBlur(image, (0, 0), max(1, min(width, height) / 200))
+    if noise:
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+# jpeg encode and base64 the image like the mobile client does
+def to_base64_jpeg(image: np.ndarray, quality: int = 90) -> str:
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Failed to encode benchmark image")
+    return base64.b64encode(encoded.tobytes()).decode('ascii')
+
+# stand in for TensorFlow Serving's REST predict api, returns a random softmax per instance
+class FakeServingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # capacity limits how many requests are served at once, like a container with that many cores, the rest wait their turn
+    def __init__(self, latency_seconds: float = 0.0, capacity: int = None):
+        super().__init__(('127.0.0.1', 0), FakeServingHandler)
+        self.latency_seconds = latency_seconds
+        self.capacity = threading.Semaphore(capacity) if capacity else None
+        self.request_count = 0
+        # the path of each predict request, i.e. /v1/models/emotion/versions/2:predict for a model version
+        self.paths = []
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/v1/models/emotion:predict'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+class FakeServingHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # model status, as checked by the readiness probe
+    def do_GET(self):
+        self.send_json({'model_version_status': [{'version': '1', 'state': 'AVAILABLE', 'status': {'error_code': 'OK'}}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.request_count += 1
+        self.server.paths.append(self.path)
+        if self.server.capacity:
+            with self.server.capacity:
+                time.sleep(self.server.latency_seconds)
+        elif self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+        predictions = []
+        for _ in body['instances']:
+            scores = np.random.dirichlet(np.ones(len(Emotions)))
+            predictions.append(scores.tolist())
+        self.send_json({'predictions': predictions})
+
+    def send_json(self, content: dict):
+        response = json.dumps(content).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+# a signed rs256 token and the key to verify it, so token verification costs what it does in production
+def make_test_token() -> tuple[str, str]:
+    import jwt
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('ascii')
+    now = datetime.now(timezone.utc)
+    token = jwt.encode({'sub': 'user_bench', 'iat': now, 'nbf': now, 'exp': now + timedelta(hours=1)}, private_key, algorithm='RS256')
+    return token, public_pem
+
+# point token verification at the benchmark key
+def use_test_token() -> str:
+    import services.verifyToken as verify_token_module
+
+    token, public_pem = make_test_token()
+    verify_token_module.JWT_PUBLIC_KEY = public_pem
+    verify_token_module.ALGORITHM = 'RS256'
+    return token
+
+# create the schema in a scratch database and fill it with realistic reading volumes
+# each user gets a few readings a day going back far enough to reach their history size
+async def seed_database(engine, history_sizes: list[int], seed: int = 0) -> dict[int, str]:
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from db.models import Base, Emotion, GlobalAccuracyCount, Location, Reading, User
+    from db.partitions import maintain_partitions
+
+    rng = random.Random(seed)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(insert(Emotion), [{'emotion_id': e.value + 1, 'label': str(e)} for e in Emotions])
+        await connection.execute(insert(Location), [{'location_id': i + 1, 'name': name} for i, name in enumerate(LOCATIONS)])
+        await connection.execute(insert(GlobalAccuracyCount), [{'count_id': 1, 'accurate_readings': 0, 'failed_readings': 0}])
+
+        users = {size: f'user_bench_{size}' for size in history_sizes}
+        await connection.execute(insert(User), [
+            {'clerk_id': clerk_id, 'notification_start_time': dt_time(9, 0), 'notification_end_time': dt_time(21, 0)}
+            for clerk_id in users.values()
+        ])
+        now = datetime.now(timezone.utc)
+        for size, clerk_id in users.items():
+            readings = []
+            for i in range(size):
+                readings.append({
+                    'clerk_id': clerk_id,
+                    'datetime': now - timedelta(hours=8 * i, minutes=rng.randint(0, 59)),
+                    'emotion_id': rng.randint(1, len(Emotions)),
+                    'location_id': rng.choice([None, rng.randint(1, len(LOCATIONS))]),
+                    'note': rng.choice([None, 'Benchmark note']),
+                })
+            for start in range(0, len(readings), 5000):
+                await connection.execute(insert(Reading), readings[start:start + 5000])
+
+    # the readings were written to the default partition, split them into months as in production so queries are pruned
+    async with AsyncSession(engine) as session:
+        await maintain_partitions(session)
+    return users
+
+# time fn over repeat calls after warmup calls, returns latency percentiles in milliseconds
+def measure(fn, repeat: int = 50, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    timings = []
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        call_started_at = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - call_started_at) * 1000)
+    return summarise(timings, time.perf_counter() - started_at)
+
+async def measure_async(fn, repeat: int = 50, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        await fn()
+    timings = []
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        call_started_at = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - call_started_at) * 1000)
+    return summarise(timings, time.perf_counter() - started_at)
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarise(timings_ms: list[float], total_seconds: float) -> dict:
+    ordered = sorted(timings_ms)
+    return {
+        'n': len(ordered),
+        'mean_ms': statistics.fmean(ordered),
+        'p50_ms': percentile(ordered, 0.50),
+        'p95_ms': percentile(ordered, 0.95),
+        'p99_ms': percentile(ordered, 0.99),
+        'ops_per_second': len(ordered) / total_seconds if total_seconds else 0,
+    }
+
+# details recorded with every results file so runs on different machines/commits aren't confused
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        commit = 'unknown'
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+    }
@@ -0,0 +1,113 @@
+import argparse
+import os
+import subprocess
+import sys
+from benchmarks.harness import get_environment
+
+# Import time profiling for the processes that are started when scaling out: the api and the celery worker
+# each target is imported in a fresh interpreter with python -X importtime, the fastest of --repeat runs is reported
+# reports are checked in to benchmarks/importtime so changes to start up cost show up in review
+# run from the api directory:
+#   python -m benchmarks.importtime            # print the reports
+#   python -m benchmarks.importtime --write    # update benchmarks/importtime/<target>.txt
+#   python -m benchmarks.importtime --check    # exit 1 if a target is over its budget
+
+REPORTS_DIR = os.path.join(os.path.dirname(__file__), 'importtime')
+
+# module imported by each process and its start up budget in ms
+TARGETS = {
+    'api': ('main', 900),
+    'worker': ('services.celery.tasks', 750),
+}
+
+# modules that should only be imported by the routes or tasks that use them
+LAZY_MODULES = {
+    'api': ['cv2', 'numpy', 'requests'],
+    'worker': ['requests'],
+}
+
+# parse the stderr of python -X importtime into (module, self us, cumulative us, depth)
+def parse_importtime(output: str) -> list[tuple]:
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+def run_importtime(module: str) -> list[tuple]:
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(__file__)),
+    )
+    return parse_importtime(result.stderr)
+
+# total time importing the target, the cumulative time of the target itself
+def get_total_ms(modules: list[tuple], module: str) -> float:
+    return next(cumulative for name, _, cumulative, _ in modules if name == module) / 1000
+
+# modules imported by the target, importtime lists children before their parent so they're the run of deeper lines before it
+def get_subtree(modules: list[tuple], module: str) -> list[tuple]:
+    index = next(i for i, (name, _, _, depth) in enumerate(modules) if name == module and depth == 0)
+    start = index
+    while start > 0 and modules[start - 1][3] > 0:
+        start -= 1
+    return modules[start:index]
+
+# self time summed by top level package, shows which dependencies the time goes to
+def summarise_packages(modules: list[tuple]) -> dict[str, float]:
+    packages = {}
+    for name, self_us, _, _ in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us / 1000
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+def build_report(target: str, repeat: int = 5, top: int = 15) -> tuple[str, float]:
+    module, budget_ms = TARGETS[target]
+    run = min((run_importtime(module) for _ in range(repeat)), key=lambda run: get_total_ms(run, module))
+    total_ms = get_total_ms(run, module)
+    modules = get_subtree(run, module)
+    imported = {name for name, _, _, _ in modules}
+    environment = get_environment()
+
+    lines = [
+        f'# python -X importtime -c "import {module}", fastest of {repeat} runs',
+        f'# commit {environment["commit"]}, python {environment["python"]}, {environment["platform"]}',
+        f'total: {total_ms:.1f} ms (budget {budget_ms} ms)',
+        f'modules imported: {len(modules)}',
+        f'lazy modules imported: {", ".join(name for name in LAZY_MODULES[target] if name in imported) or "none"}',
+        '',
+        'self time by package (ms)',
+    ]
+    for package, self_ms in list(summarise_packages(modules).items())[:top]:
+        lines.append(f'  {self_ms:>8.1f}  {package}')
+    lines += ['', f'direct imports of {module} by cumulative time (ms)']
+    direct = [(name, cumulative) for name, _, cumulative, depth in modules if depth == 1]
+    for name, cumulative in sorted(direct, key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f'  {cumulative / 1000:>8.1f}  {name}')
+    return '\n'.join(lines) + '\n', total_ms
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the import time of the api and celery worker")
+    parser.add_argument('--only', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--write', action='store_true', help="write the reports to benchmarks/importtime")
+    parser.add_argument('--check', action='store_true', help="exit 1 if a target is over budget")
+    args = parser.parse_args()
+
+    over_budget = []
+    for target in args.only:
+        report, total_ms = build_report(target, args.repeat)
+        print(f'== {target}\n{report}')
+        if args.write:
+            os.makedirs(REPORTS_DIR, exist_ok=True)
+            with open(os.path.join(REPORTS_DIR, f'{target}.txt'), 'w') as file:
+                file.write(report)
+        if total_ms > TARGETS[target][1]:
+            over_budget.append(target)
+
+    if args.check and over_budget:
+        print(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
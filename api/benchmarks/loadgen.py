@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from contextlib import ExitStack, nullcontext
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from unittest.mock import patch
+import httpx
+from benchmarks.harness import FakeServingServer, make_face_image, summarise, to_base64_jpeg, use_test_token
+from services.celery.notification_schedule_helpers import plan_notification_slots
+
+# Load generator that replays a day of notification driven traffic
+# every user gets 3 pushes a day inside their window (the same planning the dispatcher uses), a share of them
+# respond after a short delay with a /predict call followed by a readings POST
+# in process (default) the app runs against a fake TensorFlow Serving and a stand in for the readings insert,
+# with --target the same traffic is sent over http to a running api
+# run from the api directory:
+#   python -m benchmarks.loadgen --users 5000 --speedup 60
+#   python -m benchmarks.loadgen --target http://localhost:8000 --token <jwt> --users 500 --from 08:00 --to 10:00
+
+# users' windows start around 8-9am and last most of the day
+def build_population(users: int, rng: random.Random, start_mean_hours: float = 8.5, start_sd_hours: float = 1.5, length_hours: tuple = (8, 14)) -> list[tuple]:
+    population = []
+    for i in range(users):
+        start_minutes = int(min(max(rng.gauss(start_mean_hours, start_sd_hours), 0), 23.5) * 60)
+        length_minutes = rng.randint(length_hours[0] * 60, length_hours[1] * 60)
+        end_minutes = (start_minutes + length_minutes) % (24 * 60)
+        population.append((
+            f'user_load_{i}',
+            dt_time(start_minutes // 60, start_minutes % 60),
+            dt_time(end_minutes // 60, end_minutes % 60),
+        ))
+    return population
+
+# when each responding user opens the app, as (seconds since midnight, clerk_id) sorted by time
+def build_schedule(population: list[tuple], day: date, rng: random.Random, response_rate: float = 0.6, reaction_mean_seconds: float = 90) -> list[tuple]:
+    midnight = datetime.combine(day, dt_time(0, 0), tzinfo=timezone.utc)
+    schedule = []
+    for slot in plan_notification_slots(population, day):
+        if rng.random() > response_rate:
+            continue
+        opened_at = slot['send_at'] + timedelta(seconds=rng.expovariate(1 / reaction_mean_seconds))
+        schedule.append(((opened_at - midnight).total_seconds(), slot['clerk_id']))
+    schedule.sort()
+    return schedule
+
+# the busiest hour of the day, where worker and pool sizing matters
+def get_busiest_hour(schedule: list[tuple]) -> tuple[float, float]:
+    counts = {}
+    for offset, _ in schedule:
+        counts[int(offset // 3600)] = counts.get(int(offset // 3600), 0) + 1
+    hour = max(counts, key=counts.get)
+    return hour * 3600, (hour + 1) * 3600
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def record(self, endpoint: str, latency_ms: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(latency_ms)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def report(self, duration_seconds: float) -> dict:
+        report = {'duration_seconds': duration_seconds, 'peak_in_flight_sessions': self.peak_in_flight, 'endpoints': {}}
+        for endpoint, latencies in self.latencies.items():
+            summary = summarise(latencies, duration_seconds)
+            summary['max_ms'] = max(latencies)
+            summary['error_rate'] = self.errors.get(endpoint, 0) / len(latencies)
+            report['endpoints'][endpoint] = summary
+        return report
+
+async def timed_request(stats: LoadStats, endpoint: str, request):
+    started_at = time.perf_counter()
+    try:
+        response = await request
+        ok = response.status_code < 400
+    except Exception:
+        response, ok = None, False
+    stats.record(endpoint, (time.perf_counter() - started_at) * 1000, ok)
+    return response
+
+# one user responding to a push: predict their emotion, then save the reading
+async def run_session(client: httpx.AsyncClient, stats: LoadStats, clerk_id: str, image: str, token: str, think_seconds: float):
+    stats.in_flight += 1
+    stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+    headers = {'Authorization': f'Bearer {token}'}
+    try:
+        response = await timed_request(stats, 'POST /api/predict', client.post('/api/predict', json={'image': image}, headers=headers))
+        if response is None or response.status_code != 200:
+            return
+        await asyncio.sleep(think_seconds)
+        await timed_request(stats, 'POST /api/readings', client.post('/api/readings', json={
+            'emotion': response.json()['prediction'],
+            'is_accurate': True,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'clerk_id': clerk_id,
+            'probabilities': response.json()['probabilities'],
+            'model_version': response.json()['model_version'],
+        }, headers={**headers, 'Idempotency-Key': str(uuid.uuid4())}))
+    finally:
+        stats.in_flight -= 1
+
+# replay the schedule between start and end (seconds since midnight), compressed by speedup
+async def drive(client: httpx.AsyncClient, schedule: list[tuple], start: float, end: float, speedup: float, image: str, token: str, think_seconds: float) -> dict:
+    stats = LoadStats()
+    sessions = []
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
+    for offset, clerk_id in schedule:
+        if offset < start or offset >= end:
+            continue
+        delay = started_at + (offset - start) / speedup - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sessions.append(asyncio.create_task(run_session(client, stats, clerk_id, image, token, think_seconds / speedup)))
+    await asyncio.gather(*sessions)
+    return stats.report(loop.time() - started_at)
+
+# in process stand in for the readings insert, so the readings endpoint can run without a database
+def fake_insert_reading(db_latency_seconds: float):
+    async def insert_reading(session, request, idempotency_key=None):
+        await asyncio.sleep(db_latency_seconds)
+        return {"id": 1, "emotion": request.emotion, "location": request.location, "datetime": request.timestamp, "note": request.note}, 201
+    return insert_reading
+
+def parse_clock(value: str) -> float:
+    parsed = datetime.strptime(value, '%H:%M')
+    return parsed.hour * 3600 + parsed.minute * 60
+
+async def main(args) -> dict:
+    rng = random.Random(args.seed)
+    population = build_population(args.users, rng)
+    schedule = build_schedule(population, date.today(), rng, args.response_rate, args.reaction_mean)
+    if args.start and args.end:
+        start, end = parse_clock(args.start), parse_clock(args.end)
+    else:
+        start, end = get_busiest_hour(schedule)
+    sessions = sum(1 for offset, _ in schedule if start <= offset < end)
+    print(f"{args.users} users, {len(schedule)} sessions in the day, replaying {sessions} between "
+          f"{timedelta(seconds=start)} and {timedelta(seconds=end)} at {args.speedup}x")
+
+    image = to_base64_jpeg(make_face_image(*args.resolution))
+    timeout = httpx.Timeout(args.timeout)
+    if args.target:
+        async with httpx.AsyncClient(base_url=args.target, timeout=timeout) as client:
+            return await drive(client, schedule, start, end, args.speedup, image, args.token, args.think)
+
+    from main import app
+
+    token = use_test_token()
+    with ExitStack() as stack:
+        serving = stack.enter_context(FakeServingServer(latency_seconds=args.serving_latency))
+        stack.enter_context(patch.dict(os.environ, {'MODEL_PREDICT_URL': serving.url}))
+        stack.enter_context(patch('endpoints.readings.insert_reading', fake_insert_reading(args.db_latency)))
+        # the fake insert doesn't use the session, so no database (or its settings) is needed
+        stack.enter_context(patch('endpoints.readings.Session', nullcontext))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://loadgen', timeout=timeout) as client:
+            return await drive(client, schedule, start, end, args.speedup, image, token, args.think)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay notification driven traffic against the api")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--speedup', type=float, default=60, help="how many times faster than real time to replay")
+    parser.add_argument('--from', dest='start', help="start of the replayed period (HH:MM), defaults to the busiest hour")
+    parser.add_argument('--to', dest='end', help="end of the replayed period (HH:MM)")
+    parser.add_argument('--response-rate', type=float, default=0.6, help="share of pushes that lead to a session")
+    parser.add_argument('--reaction-mean', type=float, default=90, help="mean seconds between a push and the app opening")
+    parser.add_argument('--think', type=float, default=5, help="seconds between the prediction and saving the reading, before speedup")
+    parser.add_argument('--resolution', type=int, nargs=2, default=(960, 1280), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--target', help="base url of a running api, defaults to running the app in process")
+    parser.add_argument('--token', help="bearer token to use with --target")
+    parser.add_argument('--serving-latency', type=float, default=0.02, help="in process fake serving latency in seconds")
+    parser.add_argument('--db-latency', type=float, default=0.005, help="in process readings insert latency in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the report as json")
+    args = parser.parse_args()
+    if args.target and not args.token:
+        parser.error("--token is required with --target")
+
+    report = asyncio.run(main(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Duration {report['duration_seconds']:.1f}s, peak {report['peak_in_flight_sessions']} sessions in flight")
+        print(f"{'endpoint':<22}{'requests':>10}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>9}")
+        for endpoint, summary in report['endpoints'].items():
+            print(f"{endpoint:<22}{summary['n']:>10}{summary['ops_per_second']:>9.1f}{summary['p50_ms']:>10.1f}"
+                  f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}{summary['max_ms']:>10.1f}{summary['error_rate'] * 100:>8.1f}%")
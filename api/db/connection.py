@@ -2,8 +2,10 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import text
 from dotenv import load_dotenv
+from typing import Optional
 import os
 import asyncio
+import time
 
 load_dotenv()
 
@@ -11,22 +13,110 @@ load_dotenv()
 if os.name == 'nt':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-# Get environment variables
-username = os.getenv("DB_USERNAME")
-password = os.getenv("DB_PASSWORD")
-host = os.getenv("DB_HOST")
-port = os.getenv("DB_PORT")
-database = os.getenv("DB_NAME")
+# build the connection url from environment variables
+def get_database_url() -> str:
+    username = os.getenv("DB_USERNAME")
+    password = os.getenv("DB_PASSWORD")
+    host = os.getenv("DB_HOST")
+    port = os.getenv("DB_PORT")
+    database = os.getenv("DB_NAME")
+    return f"postgresql+psycopg://{username}:{password}@{host}:{port}/{database}"
 
-# db connection engine
-engine = create_async_engine(f"postgresql+psycopg://{username}:{password}@{host}:{port}/{database}", echo=True) # echo prints logs
+# the read replica's url, DB_REPLICA_HOST turns it on and the other settings default to the primary's
+def get_replica_database_url() -> Optional[str]:
+    host = os.getenv("DB_REPLICA_HOST")
+    if not host:
+        return None
+    username = os.getenv("DB_REPLICA_USERNAME", os.getenv("DB_USERNAME"))
+    password = os.getenv("DB_REPLICA_PASSWORD", os.getenv("DB_PASSWORD"))
+    port = os.getenv("DB_REPLICA_PORT", os.getenv("DB_PORT"))
+    database = os.getenv("DB_REPLICA_NAME", os.getenv("DB_NAME"))
+    return f"postgresql+psycopg://{username}:{password}@{host}:{port}/{database}"
+
+_engine = None
+_replica_engine = None
+
+# db connection engine, created on first use (or by the api's lifespan) rather than when the module is imported
+# set DB_ECHO=1 to log every sql statement, off by default as it is a synchronous write per query
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(get_database_url(), echo=os.getenv("DB_ECHO") == "1")
+        Session.configure(bind=_engine)
+    return _engine
+
+# engine for the read replica, the primary's when no replica is configured
+def get_replica_engine():
+    global _replica_engine
+    url = get_replica_database_url()
+    if url is None:
+        return get_engine()
+    if _replica_engine is None:
+        _replica_engine = create_async_engine(url, echo=os.getenv("DB_ECHO") == "1")
+        ReplicaSession.configure(bind=_replica_engine)
+    return _replica_engine
+
+# close the pooled connections, the engines are recreated if used again
+async def dispose_engine():
+    global _engine, _replica_engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+    if _replica_engine is not None:
+        await _replica_engine.dispose()
+        _replica_engine = None
+
+# sessions bind to the engine when the first one is opened
+class LazySessionmaker(sessionmaker):
+    def __init__(self, create_engine, **kwargs):
+        super().__init__(**kwargs)
+        self.create_engine = create_engine
+
+    def __call__(self, **kwargs):
+        self.create_engine()
+        return super().__call__(**kwargs)
 
 # configure session
-Session = sessionmaker(
-    bind=engine,
+Session = LazySessionmaker(
+    get_engine,
     class_=AsyncSession,
     expire_on_commit=False
 )
+
+# sessions on the read replica, only for read_session below
+ReplicaSession = LazySessionmaker(
+    get_replica_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
+# replicas apply the primary's writes a little behind it, so a user's reads stay on the primary for this long after they write
+# the window is per process, a user whose next request lands on another worker can read from the replica before it catches up
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", 5))
+
+# clerk_id -> time.monotonic() their reads can go back to the replica
+_recent_writes: dict[str, float] = {}
+
+# call after committing a user's write so their next reads see it
+def record_write(clerk_id: str):
+    now = time.monotonic()
+    # drop the expired entries as new ones are added so the dict stays as small as the number of recent writers
+    if len(_recent_writes) > 1000:
+        for key in [key for key, expires_at in _recent_writes.items() if expires_at <= now]:
+            del _recent_writes[key]
+    _recent_writes[clerk_id] = now + READ_YOUR_WRITES_SECONDS
+
+def has_recent_write(clerk_id: Optional[str]) -> bool:
+    return clerk_id is not None and _recent_writes.get(clerk_id, 0) > time.monotonic()
+
+# session for read only queries, i.e. the readings scans behind the history and charts
+# these go to the replica when one is configured, keeping them off the primary the inserts use,
+# unless the user wrote within READ_YOUR_WRITES_SECONDS and the replica might not have it yet
+# nothing is written through it, writes and reads that lead to writes use Session
+def read_session(clerk_id: Optional[str] = None) -> AsyncSession:
+    if get_replica_database_url() is None or has_recent_write(clerk_id):
+        return Session()
+    return ReplicaSession()
 # run file to test connection
 async def test_connection():
     async with Session() as session:
@@ -0,0 +1,47 @@
+import asyncio
+import os
+from sqlalchemy.sql import text
+from db.connection import dispose_engine, get_engine
+
+# Applies the SQL files in db/migrations in order, each file is run once and recorded in schema_migrations
+# run from the api directory: python -m db.migrate
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# get the migration files in the order they should be applied, the file name prefix gives the order
+def get_migration_files(migrations_dir: str = MIGRATIONS_DIR) -> list[str]:
+    return sorted(file for file in os.listdir(migrations_dir) if file.endswith(".sql"))
+
+# the version of a migration is the file name without the extension i.e. 0001_notification_slots
+def get_pending_migrations(migration_files: list[str], applied_versions: set[str]) -> list[str]:
+    return [file for file in migration_files if file.removesuffix(".sql") not in applied_versions]
+
+async def migrate(migrations_dir: str = MIGRATIONS_DIR):
+    engine = get_engine()
+    async with engine.begin() as connection:
+        await connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version VARCHAR(255) PRIMARY KEY, "
+            "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+        ))
+        result = await connection.execute(text("SELECT version FROM schema_migrations"))
+        applied_versions = {row.version for row in result}
+
+    for migration_file in get_pending_migrations(get_migration_files(migrations_dir), applied_versions):
+        with open(os.path.join(migrations_dir, migration_file)) as file:
+            sql = file.read()
+        # each migration runs in its own transaction so a failure leaves earlier migrations applied
+        async with engine.begin() as connection:
+            # run as written through the driver without parameters, so a % in the sql (i.e. plpgsql format()) isn't read as a placeholder
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.execute(sql)
+            await connection.execute(
+                text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                {"version": migration_file.removesuffix(".sql")}
+            )
+        print(f"Applied migration {migration_file}")
+
+    await dispose_engine()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -0,0 +1,15 @@
+-- notification times planned for each user, replaces the per user daily_scheduler celery chain
+CREATE TABLE IF NOT EXISTS notification_slots (
+    slot_id SERIAL PRIMARY KEY,
+    clerk_id VARCHAR(255) NOT NULL REFERENCES users (clerk_id),
+    slot_date DATE NOT NULL,
+    slot_index INTEGER NOT NULL,
+    send_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    dispatched_at TIMESTAMP WITH TIME ZONE,
+    UNIQUE (clerk_id, slot_date, slot_index)
+);
+
+-- the dispatcher only ever looks for undispatched slots that are due
+CREATE INDEX IF NOT EXISTS ix_notification_slots_due
+    ON notification_slots (send_at)
+    WHERE dispatched_at IS NULL;
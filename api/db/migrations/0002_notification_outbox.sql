@@ -0,0 +1,13 @@
+-- new users are written here in the same transaction as the users row, the worker plans their notifications
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    outbox_id SERIAL PRIMARY KEY,
+    clerk_id VARCHAR(255) NOT NULL REFERENCES users (clerk_id),
+    notification_start_time TIME WITHOUT TIME ZONE NOT NULL,
+    notification_end_time TIME WITHOUT TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    processed_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS ix_notification_outbox_pending
+    ON notification_outbox (created_at)
+    WHERE processed_at IS NULL;
@@ -0,0 +1,9 @@
+-- the model's output stored with each reading, null for readings made before it was kept
+-- probabilities are the 7 softmax scores in Emotions order (ANGRY, DISGUSTED, SCARED, HAPPY, NEUTRAL, SAD, SURPRISED)
+-- confidence is the highest of them, kept as its own column so analytics can filter and average on it directly
+ALTER TABLE readings
+    ADD COLUMN IF NOT EXISTS probabilities REAL[],
+    ADD COLUMN IF NOT EXISTS confidence REAL;
+
+ALTER TABLE readings
+    ADD CONSTRAINT readings_probabilities_length CHECK (probabilities IS NULL OR cardinality(probabilities) = 7);
@@ -0,0 +1,66 @@
+-- readings are range partitioned by month on datetime, so a query over a time range only scans the months in it
+-- and a month past retention is archived by detaching its partition rather than deleting rows
+-- partitions are named readings_YYYY_MM and hold [first of the month, first of the next month) in UTC,
+-- the maintain_reading_partitions task (db/partitions.py) creates them ahead of time and archives old ones
+-- readings_default catches a reading outside every partition (i.e. a device clock that's far out), the task moves them out
+-- the table is rewritten in this migration's transaction, readings are locked until it finishes
+
+ALTER TABLE readings RENAME TO readings_unpartitioned;
+ALTER TABLE readings_unpartitioned RENAME CONSTRAINT readings_pkey TO readings_unpartitioned_pkey;
+-- keep the id sequence, it's dropped with the old table otherwise
+ALTER SEQUENCE readings_reading_id_seq OWNED BY NONE;
+
+-- the primary key has to include the partition key, reading_id is still unique as it comes from the sequence
+CREATE TABLE readings (
+    reading_id INTEGER NOT NULL DEFAULT nextval('readings_reading_id_seq'),
+    datetime TIMESTAMP WITH TIME ZONE NOT NULL,
+    note VARCHAR,
+    location_id INTEGER,
+    emotion_id INTEGER NOT NULL,
+    clerk_id VARCHAR(255) NOT NULL,
+    probabilities REAL[],
+    confidence REAL,
+    PRIMARY KEY (reading_id, datetime),
+    -- named as before, the generated names would be taken by the old table's
+    CONSTRAINT readings_location_id_fkey FOREIGN KEY (location_id) REFERENCES locations (location_id),
+    CONSTRAINT readings_emotion_id_fkey FOREIGN KEY (emotion_id) REFERENCES emotions (emotion_id),
+    CONSTRAINT readings_clerk_id_fkey FOREIGN KEY (clerk_id) REFERENCES users (clerk_id),
+    CONSTRAINT readings_probabilities_length CHECK (probabilities IS NULL OR cardinality(probabilities) = 7)
+) PARTITION BY RANGE (datetime);
+
+ALTER SEQUENCE readings_reading_id_seq OWNED BY readings.reading_id;
+
+-- every user query filters on clerk_id, most on a time range too
+CREATE INDEX ix_readings_clerk_id_datetime ON readings (clerk_id, datetime);
+
+-- a partition for every month from the oldest reading up to 3 months ahead
+DO $$
+DECLARE
+    month TIMESTAMP;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE(min(datetime), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+            interval '1 month'
+        )
+        FROM readings_unpartitioned
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF readings FOR VALUES FROM (%L) TO (%L)',
+            'readings_' || to_char(month, 'YYYY_MM'),
+            month AT TIME ZONE 'UTC',
+            (month + interval '1 month') AT TIME ZONE 'UTC'
+        );
+    END LOOP;
+END $$;
+
+CREATE TABLE readings_default PARTITION OF readings DEFAULT;
+
+INSERT INTO readings (reading_id, datetime, note, location_id, emotion_id, clerk_id, probabilities, confidence)
+SELECT reading_id, datetime, note, location_id, emotion_id, clerk_id, probabilities, confidence
+FROM readings_unpartitioned;
+
+DROP TABLE readings_unpartitioned;
+
+ANALYZE readings;
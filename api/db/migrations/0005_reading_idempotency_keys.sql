@@ -0,0 +1,15 @@
+-- the response to each POST /api/readings sent with an Idempotency-Key header, so a retried upload gets the stored reading back
+-- rather than inserting it again, the key is claimed in the same transaction as the reading so only one of several
+-- concurrent retries inserts it and the others wait on the primary key until it commits
+-- keys are deleted a day after they're used by the remove_expired_idempotency_keys task
+CREATE TABLE IF NOT EXISTS reading_idempotency_keys (
+    clerk_id VARCHAR(255) NOT NULL REFERENCES users (clerk_id),
+    idempotency_key VARCHAR(255) NOT NULL,
+    status_code SMALLINT,
+    response JSONB,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (clerk_id, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS ix_reading_idempotency_keys_created_at
+    ON reading_idempotency_keys (created_at);
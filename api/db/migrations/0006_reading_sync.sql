@@ -0,0 +1,33 @@
+-- delta sync for the app (GET /api/readings/sync), a client keeps its last cursor and only fetches what changed since
+-- sync_version is the id of the transaction that last wrote the reading, stamped on insert and on every update,
+-- transaction ids only go up so it orders the changes, and the sync only returns versions below the oldest transaction
+-- still running so a slow transaction can't commit a version behind a cursor a client already has
+-- readings from before this migration get version 0 and are all sent on a client's first sync
+ALTER TABLE readings ADD COLUMN sync_version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE readings ALTER COLUMN sync_version SET DEFAULT pg_current_xact_id()::text::bigint;
+
+CREATE FUNCTION set_readings_sync_version() RETURNS trigger AS $$
+BEGIN
+    NEW.sync_version := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- on the partitioned table so every partition, including ones created later, gets it
+CREATE TRIGGER readings_sync_version BEFORE UPDATE ON readings
+    FOR EACH ROW EXECUTE FUNCTION set_readings_sync_version();
+
+CREATE INDEX ix_readings_clerk_id_sync_version ON readings (clerk_id, sync_version, reading_id);
+
+-- a row per deleted reading so clients remove it too, written in the same transaction as the delete
+-- archived months aren't deleted this way, clients keep the readings they have from them
+CREATE TABLE IF NOT EXISTS reading_tombstones (
+    reading_id INTEGER NOT NULL,
+    clerk_id VARCHAR(255) NOT NULL REFERENCES users (clerk_id),
+    sync_version BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint,
+    deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (reading_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_reading_tombstones_clerk_id_sync_version
+    ON reading_tombstones (clerk_id, sync_version, reading_id);
@@ -0,0 +1,6 @@
+-- the model version that made a reading's prediction and whether the user said it was accurate, so accuracy can be compared
+-- between versions (GET /api/models/accuracy), global_accuracy_count is still kept as the total over every version
+-- model_version is null when no versions are configured (MODEL_VERSIONS), both are null for readings made before this migration
+ALTER TABLE readings
+    ADD COLUMN IF NOT EXISTS model_version VARCHAR(64),
+    ADD COLUMN IF NOT EXISTS is_accurate BOOLEAN;
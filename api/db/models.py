@@ -1,5 +1,6 @@
 import datetime
-from sqlalchemy import TIME, TIMESTAMP, ForeignKey, String
+from sqlalchemy import DDL, REAL, BigInteger, SmallInteger, TIME, TIMESTAMP, ForeignKey, Index, String, UniqueConstraint, event, func, text
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm import DeclarativeBase
 from typing import Optional
 from sqlalchemy.orm import Mapped, mapped_column
@@ -17,20 +18,43 @@ class User(Base):
     __tablename__ = "users"
     
     user_id: Mapped[int] = mapped_column(primary_key=True)
-    clerk_id: Mapped[str] = mapped_column(String(255))
+    clerk_id: Mapped[str] = mapped_column(String(255), unique=True)
     notification_start_time: Mapped[Optional[datetime.time]] 
     notification_end_time: Mapped[Optional[datetime.time]]
 
+# range partitioned by month on datetime (migration 0004), partitions are managed by db/partitions.py
+# the primary key includes datetime as postgres requires the partition key in it
 class Reading(Base):
     __tablename__ = "readings"
+    __table_args__ = (
+        Index("ix_readings_clerk_id_datetime", "clerk_id", "datetime"),
+        Index("ix_readings_clerk_id_sync_version", "clerk_id", "sync_version", "reading_id"),
+        {"postgresql_partition_by": "RANGE (datetime)"},
+    )
     
-    reading_id: Mapped[int] = mapped_column(primary_key=True)
-    datetime: Mapped[datetime.datetime]
+    reading_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # a string as the column name shadows the module in the class body
+    datetime: Mapped["datetime.datetime"] = mapped_column(primary_key=True)
     note: Mapped[Optional[str]]
     location_id: Mapped[Optional[int]] = mapped_column(ForeignKey('locations.location_id'))
     emotion_id: Mapped[int] = mapped_column(ForeignKey('emotions.emotion_id'))
     clerk_id: Mapped[str] = mapped_column(String(255), ForeignKey('users.clerk_id'))
-    
+    # the model's softmax in Emotions order and its highest value, null if the reading wasn't predicted
+    probabilities: Mapped[Optional[list[float]]] = mapped_column(ARRAY(REAL))
+    confidence: Mapped[Optional[float]] = mapped_column(REAL)
+    # the model version that made the prediction and the user's feedback on it (migration 0007)
+    model_version: Mapped[Optional[str]] = mapped_column(String(64))
+    is_accurate: Mapped[Optional[bool]]
+    # id of the transaction that last wrote the reading, for the delta sync (migration 0006)
+    sync_version: Mapped[int] = mapped_column(BigInteger, server_default=text("pg_current_xact_id()::text::bigint"))
+
+# a table made with create_all (i.e. the benchmark database) gets the default partition so it can be written to straight away,
+# maintain_partitions then moves its readings into monthly partitions
+event.listen(
+    Reading.__table__,
+    'after_create',
+    DDL("CREATE TABLE readings_default PARTITION OF readings DEFAULT").execute_if(dialect='postgresql'),
+)
 
 class Emotion(Base):
     __tablename__ = "emotions"
@@ -51,6 +75,58 @@ class GlobalAccuracyCount(Base):
     accurate_readings: Mapped[int]    
     failed_readings: Mapped[int]
 
+# notification times planned for each user, read by the dispatcher task every minute
+class NotificationSlot(Base):
+    __tablename__ = "notification_slots"
+    __table_args__ = (
+        UniqueConstraint("clerk_id", "slot_date", "slot_index"),
+        # partial index keeps the due slot lookup small, dispatched slots drop out of it
+        Index("ix_notification_slots_due", "send_at", postgresql_where=text("dispatched_at IS NULL")),
+    )
 
-    
-    
\ No newline at end of file
+    slot_id: Mapped[int] = mapped_column(primary_key=True)
+    clerk_id: Mapped[str] = mapped_column(String(255), ForeignKey('users.clerk_id'))
+    slot_date: Mapped[datetime.date]
+    slot_index: Mapped[int]
+    send_at: Mapped[datetime.datetime]
+    dispatched_at: Mapped[Optional[datetime.datetime]]
+
+# transactional outbox written with a new user, drained by the drain_notification_outbox task
+# keeps broker publishes off the signup request, the outbox row commits or rolls back with the user
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        Index("ix_notification_outbox_pending", "created_at", postgresql_where=text("processed_at IS NULL")),
+    )
+
+    outbox_id: Mapped[int] = mapped_column(primary_key=True)
+    clerk_id: Mapped[str] = mapped_column(String(255), ForeignKey('users.clerk_id'))
+    notification_start_time: Mapped[datetime.time]
+    notification_end_time: Mapped[datetime.time]
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+    processed_at: Mapped[Optional[datetime.datetime]]
+
+# the stored response of a reading uploaded with an Idempotency-Key (migration 0005), a retry with the same key gets it back
+class ReadingIdempotencyKey(Base):
+    __tablename__ = "reading_idempotency_keys"
+    __table_args__ = (
+        Index("ix_reading_idempotency_keys_created_at", "created_at"),
+    )
+
+    clerk_id: Mapped[str] = mapped_column(String(255), ForeignKey('users.clerk_id'), primary_key=True)
+    idempotency_key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    status_code: Mapped[Optional[int]] = mapped_column(SmallInteger)
+    response: Mapped[Optional[dict]] = mapped_column(JSONB)
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+
+# a deleted reading, kept so clients remove it on their next sync (migration 0006)
+class ReadingTombstone(Base):
+    __tablename__ = "reading_tombstones"
+    __table_args__ = (
+        Index("ix_reading_tombstones_clerk_id_sync_version", "clerk_id", "sync_version", "reading_id"),
+    )
+
+    reading_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    clerk_id: Mapped[str] = mapped_column(String(255), ForeignKey('users.clerk_id'))
+    sync_version: Mapped[int] = mapped_column(BigInteger, server_default=text("pg_current_xact_id()::text::bigint"))
+    deleted_at: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Monthly partitions of the readings table (migration 0004), maintained by the maintain_reading_partitions task:
+# - partitions are created PARTITIONS_AHEAD months ahead so inserts never land in the default partition
+# - readings that did (a device clock that's far out) are moved into a partition for their month
+# - with RETENTION_MONTHS set, months older than that are written to ARCHIVE_DIR with the export writers,
+#   then detached and dropped, leaving a parquet (or csv.gz without pyarrow) file per month in cold storage
+# run from the api directory:
+#   python -m db.partitions              # maintain the partitions now
+#   python -m db.partitions --explain    # show which partitions the readings queries scan
+
+PARTITIONED_TABLE = 'readings'
+DEFAULT_PARTITION = 'readings_default'
+PARTITIONS_AHEAD = int(os.getenv('READINGS_PARTITIONS_AHEAD', 3))
+# 0 keeps every month
+RETENTION_MONTHS = int(os.getenv('READINGS_RETENTION_MONTHS', 0))
+ARCHIVE_DIR = os.getenv('READINGS_ARCHIVE_DIR', 'archive')
+# parquet by default, csv.gz when pyarrow isn't installed
+ARCHIVE_FORMAT = os.getenv('READINGS_ARCHIVE_FORMAT')
+ARCHIVE_BATCH_SIZE = int(os.getenv('READINGS_ARCHIVE_BATCH_SIZE', 50_000))
+
+PARTITION_NAME = re.compile(rf'^{PARTITIONED_TABLE}_(\d{{4}})_(\d{{2}})$')
+
+def get_month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def get_partition_name(month: date) -> str:
+    return f'{PARTITIONED_TABLE}_{month.year:04d}_{month.month:02d}'
+
+# the month a partition holds, None for anything that isn't a monthly partition i.e. the default
+def parse_partition_name(name: str) -> Optional[date]:
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+# a partition holds [first of the month, first of the next month) in UTC
+def get_partition_bounds(month: date) -> tuple[datetime, datetime]:
+    next_month = add_months(month, 1)
+    return (
+        datetime(month.year, month.month, 1, tzinfo=timezone.utc),
+        datetime(next_month.year, next_month.month, 1, tzinfo=timezone.utc),
+    )
+
+# this month and the next `ahead` months that don't have a partition yet
+def get_months_to_create(existing: set[date], today: date, ahead: int = PARTITIONS_AHEAD) -> list[date]:
+    this_month = get_month_start(today)
+    return [month for month in (add_months(this_month, i) for i in range(ahead + 1)) if month not in existing]
+
+# months before this month and the retention_months before it, oldest first
+def get_months_to_archive(existing: set[date], today: date, retention_months: int = RETENTION_MONTHS) -> list[date]:
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(get_month_start(today), -retention_months)
+    return sorted(month for month in existing if month < cutoff)
+
+async def select_partition_months(session: AsyncSession) -> set[date]:
+    result = await session.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"
+    ), {'table': PARTITIONED_TABLE})
+    return {month for month in (parse_partition_name(row.relname) for row in result) if month is not None}
+
+# months of the readings that have ended up in the default partition
+async def select_default_partition_months(session: AsyncSession) -> set[date]:
+    result = await session.execute(text(
+        f"SELECT DISTINCT date_trunc('month', datetime AT TIME ZONE 'UTC')::date AS month FROM {DEFAULT_PARTITION}"
+    ))
+    return {row.month for row in result}
+
+# create the partition for a month, any of its readings in the default partition are moved into it
+# the table is filled before it's attached as postgres won't attach a range the default partition has rows for
+async def create_partition(session: AsyncSession, month: date):
+    name = get_partition_name(month)
+    start, end = get_partition_bounds(month)
+    bounds = {'start': start, 'end': end}
+    await session.execute(text(f"CREATE TABLE {name} (LIKE {PARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await session.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE datetime >= :start AND datetime < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    # the bounds are literals in ddl, timestamps are rendered in utc so they don't depend on the session's time zone
+    await session.execute(text(
+        f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    await session.commit()
+    logger.info("Created partition %s", name)
+
+# write a month's readings to the archive directory, then detach and drop its partition
+# the partition is locked against writes for the whole archive so the file has every row that's dropped
+async def archive_partition(session: AsyncSession, month: date, archive_dir: str = ARCHIVE_DIR, format: str = None) -> dict:
+    from db.queries import stream_readings_for_export
+    from services.export_readings import CsvGzipWriter, ParquetWriter, create_writer, get_available_formats
+
+    name = get_partition_name(month)
+    format = format or ARCHIVE_FORMAT or (ParquetWriter.name if ParquetWriter.name in get_available_formats() else CsvGzipWriter.name)
+    writer = create_writer(format)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.{writer.extension}')
+    start, end = get_partition_bounds(month)
+
+    await session.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+    expected = (await session.execute(text(f"SELECT count(*) FROM {name}"))).scalar_one()
+    rows = 0
+    with open(path + '.tmp', 'wb') as file:
+        async for batch in stream_readings_for_export(session, None, ARCHIVE_BATCH_SIZE, start=start, end=end):
+            rows += len(batch)
+            file.write(writer.write(batch))
+        file.write(writer.close())
+        file.flush()
+        os.fsync(file.fileno())
+    if rows != expected:
+        await session.rollback()
+        os.remove(path + '.tmp')
+        raise RuntimeError(f"Archived {rows} of the {expected} readings in {name}, the partition was kept")
+    os.replace(path + '.tmp', path)
+
+    await session.execute(text(f"ALTER TABLE {PARTITIONED_TABLE} DETACH PARTITION {name}"))
+    await session.execute(text(f"DROP TABLE {name}"))
+    await session.commit()
+    logger.info("Archived partition %s to %s", name, path, extra={'rows': rows})
+    return {'partition': name, 'path': path, 'rows': rows}
+
+async def maintain_partitions(session: AsyncSession, today: date = None) -> dict:
+    today = today or datetime.now(timezone.utc).date()
+    existing = await select_partition_months(session)
+    # months in the default partition get their own partition, unless they're about to be archived anyway
+    stray = await select_default_partition_months(session)
+    await session.rollback()
+    to_create = sorted(set(get_months_to_create(existing, today)) | (stray - existing))
+    for month in to_create:
+        await create_partition(session, month)
+
+    archived = [await archive_partition(session, month) for month in get_months_to_archive(existing | set(to_create), today)]
+    return {'created': [get_partition_name(month) for month in to_create], 'archived': archived}
+
+# the partitions of readings a query would scan, from its plan
+# run with the query's parameters so the planner (or the executor's start up pruning) can rule partitions out
+async def explain_partitions(session: AsyncSession, query) -> list[str]:
+    connection = await session.connection()
+    compiled = query.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+    plan = result.scalar_one()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+
+    relations = []
+    def walk(node: dict):
+        if node.get('Relation Name', '').startswith(f'{PARTITIONED_TABLE}_'):
+            relations.append(node['Relation Name'])
+        for child in node.get('Plans', []):
+            walk(child)
+    walk(plan[0]['Plan'])
+    return sorted(set(relations))
+
+# the partitions each of the readings queries scans for a user, for checking pruning against a real database
+async def explain_readings_queries(session: AsyncSession, clerk_id: str, now: datetime = None) -> dict[str, list[str]]:
+    from constants.emotion_enum import Emotions
+    from db.queries import apply_filters, select_emotion_counts_query, select_recent_reading_query, select_user_readings_query
+
+    emotions = [str(emotion) for emotion in Emotions]
+    now = now or datetime.now(timezone.utc)
+    this_month = get_month_start(now.date())
+    return {
+        'readings_this_month': await explain_partitions(session, apply_filters(select_user_readings_query(clerk_id), clerk_id, this_month.isoformat(), now.date().isoformat())),
+        'emotion_counts_7d': await explain_partitions(session, select_emotion_counts_query(clerk_id, emotions, now - timedelta(days=7), now, 'day')),
+        'emotion_counts_1yr': await explain_partitions(session, select_emotion_counts_query(clerk_id, emotions, now - timedelta(days=365), now, 'week')),
+        'inserted_reading': await explain_partitions(session, select_recent_reading_query(1, now)),
+        'readings_all_time': await explain_partitions(session, select_user_readings_query(clerk_id)),
+    }
+
+if __name__ == "__main__":
+    from db.connection import Session, dispose_engine
+
+    parser = argparse.ArgumentParser(description="Maintain the readings partitions")
+    parser.add_argument('--explain', metavar='CLERK_ID', nargs='?', const='', help="show the partitions the readings queries scan instead")
+    args = parser.parse_args()
+
+    async def main():
+        try:
+            async with Session() as session:
+                if args.explain is not None:
+                    for name, partitions in (await explain_readings_queries(session, args.explain)).items():
+                        print(f"{name:<22}{len(partitions):>4}  {', '.join(partitions)}")
+                else:
+                    print(await maintain_partitions(session))
+        finally:
+            await dispose_engine()
+
+    asyncio.run(main())
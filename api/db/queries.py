@@ -1,9 +1,11 @@
 from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional
-from sqlalchemy import desc, func, select
+from sqlalchemy import TIMESTAMP, cast, delete, desc, func, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from db.models import Emotion, Location, Reading, GlobalAccuracyCount
+from db.models import Emotion, Location, NotificationOutbox, NotificationSlot, Reading, ReadingIdempotencyKey, ReadingTombstone, GlobalAccuracyCount, User
 from constants.emotion_enum import Emotions
+from services.metrics import timed_query
 
 # apply filters to the reading data queries based on the provided parameters
 def apply_filters(query, clerk_id, start_date=None, end_date=None, emotion=None, location=None):
@@ -26,6 +28,7 @@ def apply_filters(query, clerk_id, start_date=None, end_date=None, emotion=None,
     return query
 
 # get emotion id from emotion label (Happy, Sad, etc.)
+@timed_query
 async def select_emotion_id(session: Session, emotion_label: str):
     result = await session.execute(
         select(Emotion.emotion_id).where(Emotion.label == emotion_label.capitalize())
@@ -33,14 +36,69 @@ async def select_emotion_id(session: Session, emotion_label: str):
     return result.scalar_one_or_none()
 
 # get location id from location name (Home, Work, etc.)
+@timed_query
 async def select_location_id(session: Session, location_name: str):
     result = await session.execute(
         select(Location.location_id).where(Location.name == location_name.capitalize())
     )
     return result.scalar_one_or_none()
 
+# format a reading row for a response, label/name -> emotion/location
+# if no location or note present, key still included just null value
+def format_reading(row) -> dict:
+    return {
+        "id": row.reading_id,
+        "emotion": row.label,
+        "location": row.name,
+        "datetime": row.datetime.strftime('%Y-%m-%dT%H:%M'),
+        "note": row.note,
+    }
+
+# a reading by its id, the datetime is included so only its month's partition is searched
+# the datetime can be the uploaded timestamp string, it's cast so postgres reads it as it did for the insert
+def select_recent_reading_query(reading_id: int, reading_datetime: datetime | str):
+    return (
+        select(
+            Reading.reading_id,
+            Emotion.label,
+            Location.name,
+            Reading.datetime,
+            Reading.note,
+        )
+        .join(Emotion)
+        .outerjoin(Location)
+        .where(Reading.reading_id == reading_id, Reading.datetime == cast(reading_datetime, TIMESTAMP(timezone=True)))
+    )
+
+# claim an idempotency key for a reading in the session's transaction, False if the key has been used already
+# a concurrent request with the same key blocks on the primary key until this transaction ends,
+# then gets False if it committed or claims the key itself if it rolled back
+async def claim_idempotency_key(session: Session, clerk_id: str, idempotency_key: str) -> bool:
+    result = await session.execute(
+        pg_insert(ReadingIdempotencyKey)
+        .values(clerk_id=clerk_id, idempotency_key=idempotency_key)
+        .on_conflict_do_nothing()
+        .returning(ReadingIdempotencyKey.clerk_id)
+    )
+    return result.first() is not None
+
+# the response stored with a used idempotency key
+async def select_idempotent_response(session: Session, clerk_id: str, idempotency_key: str):
+    result = await session.execute(
+        select(ReadingIdempotencyKey.response, ReadingIdempotencyKey.status_code)
+        .where(ReadingIdempotencyKey.clerk_id == clerk_id, ReadingIdempotencyKey.idempotency_key == idempotency_key)
+    )
+    row = result.one()
+    return row.response, row.status_code
+
 # add a new emotion reading to the database
-async def insert_reading(session: Session, request):
+# with an idempotency key a retry of the same upload returns the stored reading, without the lookups or the accuracy count update
+@timed_query
+async def insert_reading(session: Session, request, idempotency_key: Optional[str] = None):
+    if idempotency_key is not None and not await claim_idempotency_key(session, request.clerk_id, idempotency_key):
+        await session.rollback()
+        return await select_idempotent_response(session, request.clerk_id, idempotency_key)
+
     emotion_id = await select_emotion_id(session, request.emotion)
     if emotion_id is None:
         return {"error": "Invalid Emotion"}, 400
@@ -56,7 +114,11 @@ async def insert_reading(session: Session, request):
         note=request.note,
         emotion_id=emotion_id,
         location_id=location_id,
-        clerk_id=request.clerk_id
+        clerk_id=request.clerk_id,
+        probabilities=request.probabilities,
+        confidence=max(request.probabilities) if request.probabilities else None,
+        model_version=request.model_version,
+        is_accurate=request.is_accurate,
     )
     session.add(new_reading)
 
@@ -67,37 +129,33 @@ async def insert_reading(session: Session, request):
     else:
         global_accuracy_count.failed_readings += 1
 
-    await session.commit()
+    await session.flush()
     
     # get the recently added reading to return in the response
-    recently_added_reading = (
-        select(
-            Reading.reading_id,
-            Emotion.label,
-            Location.name,
-            Reading.datetime,
-            Reading.note,
-        )
-        .join(Emotion)
-        .outerjoin(Location)
-        .where(Reading.reading_id == new_reading.reading_id)
-    )
-
-    result = await session.execute(recently_added_reading)
+    result = await session.execute(select_recent_reading_query(new_reading.reading_id, new_reading.datetime))
     row = result.fetchone()
 
-    # return the formatted new reading
-    return {
-            "id": row.reading_id,
-            "emotion": row.label,
-            "location": row.name,
-            "datetime": row.datetime.strftime('%Y-%m-%dT%H:%M'),
-            "note": row.note,
-        }, 201
+    response = format_reading(row)
+    # the response is stored with the key and commits with the reading
+    if idempotency_key is not None:
+        await session.execute(
+            update(ReadingIdempotencyKey)
+            .where(ReadingIdempotencyKey.clerk_id == request.clerk_id, ReadingIdempotencyKey.idempotency_key == idempotency_key)
+            .values(response=response, status_code=201)
+        )
+    await session.commit()
+    return response, 201
 
-# Get the user's readings, can add optional filters for timeframe, emotion and location
-async def select_user_readings(session: Session, clerk_id: str, start_date: Optional[str], end_date: Optional[str], emotion: Optional[str], location: Optional[str]):
-    query = (
+# remove the idempotency keys used before a given time, retries come within minutes so a day is plenty
+@timed_query
+async def delete_expired_idempotency_keys(session: Session, before: datetime) -> int:
+    result = await session.execute(delete(ReadingIdempotencyKey).where(ReadingIdempotencyKey.created_at < before))
+    await session.commit()
+    return result.rowcount
+
+# the user's readings, most recent first
+def select_user_readings_query(clerk_id: str):
+    return (
         select(
             Reading.reading_id,
             Emotion.label,
@@ -110,22 +168,15 @@ async def select_user_readings(session: Session, clerk_id: str, start_date: Opti
         .where(Reading.clerk_id == clerk_id)
         .order_by(desc(Reading.datetime))
     )
+
+# Get the user's readings, can add optional filters for timeframe, emotion and location
+@timed_query
+async def select_user_readings(session: Session, clerk_id: str, start_date: Optional[str], end_date: Optional[str], emotion: Optional[str], location: Optional[str]):
     # if filters are provided, apply them
-    query = apply_filters(query, clerk_id, start_date, end_date, emotion, location)
+    query = apply_filters(select_user_readings_query(clerk_id), clerk_id, start_date, end_date, emotion, location)
     result = await session.execute(query)
     
-     # format the data, label/name -> emotion/location
-    # if no location or note present, key still included just null value
-    formatted_readings = [
-        {
-            "id": row.reading_id,
-            "emotion": row.label,
-            "location": row.name,
-            "datetime": row.datetime.strftime('%Y-%m-%dT%H:%M'),
-            "note": row.note,
-        }
-        for row in result
-    ]
+    formatted_readings = [format_reading(row) for row in result]
     # get the counts of each emotion for the selected readings
     count_query = (
         select(
@@ -152,7 +203,137 @@ async def select_user_readings(session: Session, clerk_id: str, start_date: Opti
     }
     return response
 
+# the oldest transaction still running, every sync_version below it belongs to a transaction that has finished
+# so no reading can still be written with a version below it
+async def select_sync_horizon(session: Session) -> int:
+    result = await session.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+    return result.scalar_one()
+
+# the user's readings written after the cursor (a sync_version, reading_id pair) and below the horizon, in that order
+def select_changed_readings_query(clerk_id: str, cursor: tuple[int, int], horizon: int, limit: int):
+    return (
+        select(
+            Reading.reading_id,
+            Emotion.label,
+            Location.name,
+            Reading.datetime,
+            Reading.note,
+            Reading.sync_version,
+        )
+        .join(Emotion)
+        .outerjoin(Location)
+        .where(
+            Reading.clerk_id == clerk_id,
+            tuple_(Reading.sync_version, Reading.reading_id) > tuple_(*cursor),
+            Reading.sync_version < horizon,
+        )
+        .order_by(Reading.sync_version, Reading.reading_id)
+        .limit(limit)
+    )
+
+def select_tombstones_query(clerk_id: str, cursor: tuple[int, int], horizon: int, limit: int):
+    return (
+        select(ReadingTombstone.reading_id, ReadingTombstone.sync_version)
+        .where(
+            ReadingTombstone.clerk_id == clerk_id,
+            tuple_(ReadingTombstone.sync_version, ReadingTombstone.reading_id) > tuple_(*cursor),
+            ReadingTombstone.sync_version < horizon,
+        )
+        .order_by(ReadingTombstone.sync_version, ReadingTombstone.reading_id)
+        .limit(limit)
+    )
+
+# the readings written and deleted since the cursor, at most limit of them in sync_version order
+# both are read from their (clerk_id, sync_version) index so the cost follows the number of changes, not the history
+# the next cursor is the last change returned, has_more is set when there are more to fetch with it
+@timed_query
+async def select_reading_changes(session: Session, clerk_id: str, cursor: tuple[int, int], limit: int) -> dict:
+    horizon = await select_sync_horizon(session)
+    readings = (await session.execute(select_changed_readings_query(clerk_id, cursor, horizon, limit + 1))).all()
+    tombstones = (await session.execute(select_tombstones_query(clerk_id, cursor, horizon, limit + 1))).all()
+
+    changes = sorted(
+        [(row.sync_version, row.reading_id, row) for row in readings] + [(row.sync_version, row.reading_id, None) for row in tombstones],
+        key=lambda change: change[:2],
+    )
+    page = changes[:limit]
+    return {
+        "readings": [format_reading(row) for _, _, row in page if row is not None],
+        "deleted": [reading_id for _, reading_id, row in page if row is None],
+        "cursor": page[-1][:2] if page else cursor,
+        "has_more": len(changes) > limit,
+    }
+
+# delete one of the user's readings, a tombstone is written with it so their other devices remove it on sync
+@timed_query
+async def delete_reading(session: Session, clerk_id: str, reading_id: int) -> bool:
+    result = await session.execute(
+        delete(Reading).where(Reading.reading_id == reading_id, Reading.clerk_id == clerk_id).returning(Reading.reading_id)
+    )
+    if result.first() is None:
+        return False
+    session.add(ReadingTombstone(reading_id=reading_id, clerk_id=clerk_id))
+    await session.commit()
+    return True
+
+# every reading for an export, a user's in the order they were made or every user's in insert order when clerk_id is None
+# start and end limit it to [start, end), used to archive a month's partition
+def select_readings_for_export(clerk_id: Optional[str] = None, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    query = (
+        select(
+            Reading.reading_id,
+            Reading.clerk_id,
+            Reading.datetime,
+            Emotion.label.label('emotion'),
+            Location.name.label('location'),
+            Reading.note,
+            Reading.confidence,
+            Reading.probabilities,
+        )
+        .join(Emotion)
+        .outerjoin(Location)
+    )
+    if start is not None:
+        query = query.where(Reading.datetime >= start)
+    if end is not None:
+        query = query.where(Reading.datetime < end)
+    if clerk_id is None:
+        return query.order_by(Reading.reading_id)
+    return query.where(Reading.clerk_id == clerk_id).order_by(Reading.datetime, Reading.reading_id)
+
+# stream the readings for an export batch_size rows at a time from a server side cursor
+# so memory stays the same however long the history is
+async def stream_readings_for_export(session: Session, clerk_id: Optional[str], batch_size: int, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    result = await session.stream(select_readings_for_export(clerk_id, start, end), execution_options={'yield_per': batch_size})
+    async for rows in result.partitions():
+        yield rows
+
+# count of each emotion between start_date and end_date, grouped by the truncated date
+# the datetime range limits the scan to the months' partitions it covers
+def select_emotion_counts_query(clerk_id: str, emotions: List[str], start_date: datetime, end_date: datetime, trunc_value: str):
+    # truncates the datetimes in db to required format for grouping using the trunc_value 
+    # if day - remove the time part so all readings on same day are grouped as the same value
+    # if weekly - all dates within that week are grouped as the start date of the week, same for monthly..
+    truncated_date = func.date_trunc(trunc_value, Reading.datetime).label('truncated_date')
+    return (
+        select(
+            func.count(Reading.reading_id).label('count'),
+            truncated_date,
+            Emotion.label
+        )
+        .join(Emotion)
+        .where(
+            Reading.clerk_id == clerk_id,
+            Emotion.label.in_(emotions),
+            Reading.datetime >= start_date,
+            Reading.datetime <= end_date
+        )
+        .group_by(truncated_date, Emotion.label)
+        .order_by(truncated_date)
+    )
+
 # Get the emotion counts for the user over a specified timeframe used for the line chart
+@timed_query
 async def select_emotion_counts_over_time(
     session: Session,
     clerk_id: str,
@@ -174,10 +355,6 @@ async def select_emotion_counts_over_time(
         trunc_value = 'week'
         increment = timedelta(weeks=1) # for year use weekly increments
 
-    # truncates the datetimes in db to required format for grouping using the trunc_value set above 
-    # if day - remove the time part so all readings on same day are grouped as the same value
-    # if weekly - all dates within that week are grouped as the start date of the week, same for monthly..
-    truncated_date = func.date_trunc(trunc_value, Reading.datetime).label('truncated_date')
     counts = {}
     for emotion in emotions:
         counts[emotion] = {}
@@ -186,23 +363,7 @@ async def select_emotion_counts_over_time(
             counts[emotion][current_date.strftime('%Y-%m-%d')] = 0
             current_date += increment
 
-    query = (
-        select(
-            func.count(Reading.reading_id).label('count'),
-            truncated_date,
-            Emotion.label
-        )
-        .join(Emotion)
-        .where(
-            Reading.clerk_id == clerk_id,
-            Emotion.label.in_(emotions),
-            Reading.datetime >= start_date,
-            Reading.datetime <= now
-        )
-        .group_by(truncated_date, Emotion.label)
-        .order_by(truncated_date)
-    )
-
+    query = select_emotion_counts_query(clerk_id, emotions, start_date, now, trunc_value)
     result = await session.execute(query)
             
     # update the counts dict with the actual counts from the db
@@ -215,4 +376,99 @@ async def select_emotion_counts_over_time(
         ]
         for emotion, counts in counts.items()
     }
-    return formatted_counts
\ No newline at end of file
+    return formatted_counts
+
+# the users' feedback on each model version's predictions since a time, readings without feedback (from before it was kept) are left out
+# the range on datetime only scans the months in it
+def select_model_accuracy_query(since: datetime):
+    return (
+        select(
+            Reading.model_version,
+            func.count().label("readings"),
+            func.count().filter(Reading.is_accurate).label("accurate"),
+        )
+        .where(Reading.datetime >= since, Reading.is_accurate.is_not(None))
+        .group_by(Reading.model_version)
+        .order_by(Reading.model_version.nulls_first())
+    )
+
+# the number of readings with feedback and how many were accurate for each model version, the version is None before versions were configured
+@timed_query
+async def select_model_accuracy(session: Session, since: datetime) -> List[dict]:
+    result = await session.execute(select_model_accuracy_query(since))
+    return [{"model_version": row.model_version, "readings": row.readings, "accurate": row.accurate} for row in result]
+
+# get every user that has a notification window, rows are (clerk_id, start_time, end_time)
+@timed_query
+async def select_users_with_notification_window(session: Session) -> List[tuple]:
+    result = await session.execute(
+        select(User.clerk_id, User.notification_start_time, User.notification_end_time)
+        .where(User.notification_start_time.is_not(None), User.notification_end_time.is_not(None))
+    )
+    return result.all()
+
+# bulk insert the planned notification slots, slots already planned for a user on that day are left alone
+@timed_query
+async def insert_notification_slots(session: Session, slots: List[dict]) -> None:
+    if not slots:
+        return
+    await session.execute(
+        pg_insert(NotificationSlot).on_conflict_do_nothing(index_elements=["clerk_id", "slot_date", "slot_index"]),
+        slots
+    )
+    await session.commit()
+
+# mark up to limit due slots as dispatched and return the clerk ids to notify
+# skip locked lets more than one dispatcher run without sending the same slot twice
+@timed_query
+async def claim_due_notification_slots(session: Session, now: datetime, limit: int) -> List[str]:
+    due_slots = (
+        select(NotificationSlot.slot_id)
+        .where(NotificationSlot.dispatched_at.is_(None), NotificationSlot.send_at <= now)
+        .order_by(NotificationSlot.send_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(NotificationSlot)
+        .where(NotificationSlot.slot_id.in_(due_slots))
+        .values(dispatched_at=now)
+        .returning(NotificationSlot.clerk_id)
+        .execution_options(synchronize_session=False)
+    )
+    clerk_ids = list(result.scalars())
+    await session.commit()
+    return clerk_ids
+
+# remove slots that were dispatched before the given time so the table does not grow forever
+@timed_query
+async def delete_dispatched_notification_slots(session: Session, before: datetime) -> int:
+    result = await session.execute(
+        delete(NotificationSlot)
+        .where(NotificationSlot.dispatched_at < before)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return result.rowcount
+
+# mark up to limit pending outbox entries as processed and return them as (clerk_id, start_time, end_time) rows
+# not committed here, the caller commits once the user's slots are planned so a failure leaves them pending
+@timed_query
+async def claim_notification_outbox(session: Session, now: datetime, limit: int) -> List[tuple]:
+    pending = (
+        select(NotificationOutbox.outbox_id)
+        .where(NotificationOutbox.processed_at.is_(None))
+        .order_by(NotificationOutbox.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.outbox_id.in_(pending))
+        .values(processed_at=now)
+        .returning(NotificationOutbox.clerk_id, NotificationOutbox.notification_start_time, NotificationOutbox.notification_end_time)
+        .execution_options(synchronize_session=False)
+    )
+    return result.all()
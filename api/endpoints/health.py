@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from services.health import health_checker
+
+# Probes for the orchestrator, both only read the results of the background checks in services.health
+
+router = APIRouter()
+
+@router.get("/healthz")
+async def healthz() -> JSONResponse:
+    """
+    Liveness probe, the process is up and serving requests
+
+    Returns:
+        JSONResponse: The state of each dependency, always with a 200 status code
+    """
+    return JSONResponse(content={"status": "ok", **health_checker.health.snapshot()}, status_code=200)
+
+@router.get("/readyz")
+async def readyz() -> JSONResponse:
+    """
+    Readiness probe, the app has warmed up and its dependencies passed their last checks
+
+    Returns:
+        JSONResponse: The state of each dependency
+
+    Responses:
+        200: Ready to receive traffic
+        503: Still warming up or a dependency is failing
+    """
+    snapshot = health_checker.health.snapshot()
+    return JSONResponse(content=snapshot, status_code=200 if snapshot['ready'] else 503)
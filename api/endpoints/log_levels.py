@@ -0,0 +1,33 @@
+from fastapi import APIRouter, Header
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import os
+from services.logging_config import get_log_levels, set_log_level
+
+# Change log levels per module on a running api, only included when LOG_ADMIN_SECRET is set
+# requests must send the secret in the X-Log-Admin header
+
+router = APIRouter()
+
+class LogLevel(BaseModel):
+    logger: str
+    level: str
+
+def is_admin(secret: str) -> bool:
+    return bool(os.getenv("LOG_ADMIN_SECRET")) and secret == os.getenv("LOG_ADMIN_SECRET")
+
+@router.get("/debug/log-levels")
+async def get_levels(x_log_admin: str = Header(None)) -> JSONResponse:
+    if not is_admin(x_log_admin):
+        return JSONResponse(content={"error": "Forbidden"}, status_code=403)
+    return JSONResponse(content=get_log_levels(), status_code=200)
+
+@router.put("/debug/log-levels")
+async def put_level(request: LogLevel, x_log_admin: str = Header(None)) -> JSONResponse:
+    if not is_admin(x_log_admin):
+        return JSONResponse(content={"error": "Forbidden"}, status_code=403)
+    try:
+        set_log_level(request.logger, request.level)
+    except (ValueError, TypeError):
+        return JSONResponse(content={"error": f"Invalid log level: {request.level}"}, status_code=400)
+    return JSONResponse(content=get_log_levels(), status_code=200)
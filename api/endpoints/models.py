@@ -0,0 +1,69 @@
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from services.executors import run_cpu_bound
+from services.verifyToken import verify_token
+from db.connection import read_session
+from db.queries import select_model_accuracy
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+security = HTTPBearer()
+
+# 95% wilson score interval of an accuracy, it stays inside 0-1 and is honest about versions with few readings
+def accuracy_interval(accurate: int, readings: int, z: float = 1.96) -> list[float]:
+    if readings == 0:
+        return [0.0, 1.0]
+    accuracy = accurate / readings
+    centre = accuracy + z * z / (2 * readings)
+    margin = z * math.sqrt(accuracy * (1 - accuracy) / readings + z * z / (4 * readings * readings))
+    denominator = 1 + z * z / readings
+    return [max(0.0, (centre - margin) / denominator), min(1.0, (centre + margin) / denominator)]
+
+# API endpoint to compare the accuracy of the model versions
+@router.get("/models/accuracy")
+async def get_model_accuracy(
+    days: int = Query(30, ge=1, le=3650),
+    token: HTTPAuthorizationCredentials = Depends(security)
+) -> JSONResponse:
+    """
+    Get the accuracy of each model version.
+
+    Gets how often users said each model version's prediction was accurate, from the readings of the last `days` days. Token is verified before the query.
+    Each version has its number of readings with feedback, how many were accurate, the accuracy and its 95% interval, versions with overlapping intervals
+    can't be told apart yet. Readings from before versions were configured have a model_version of null.
+
+    Args:
+        days (int, optional): How many days of readings to include. Defaults to 30.
+        token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
+
+    Returns:
+        JSONResponse: A JSON response containing the accuracy of each model version, or an error message.
+
+    Raises:
+        HTTPException: If invalid data is provided in the request.
+        Exception: For any other unexpected errors.
+
+    Responses:
+        200: Accuracy retrieved successfully.
+        401: Unauthorised - Invalid token.
+        500: Internal Server Error - Error retrieving accuracy.
+    """
+    try:
+        verification = await run_cpu_bound(verify_token, token.credentials)
+        if (verification["valid"] == False):
+            return JSONResponse(content={"message": verification["message"]}, status_code=401)
+
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        async with read_session() as session:
+            versions = await select_model_accuracy(session, since)
+        for version in versions:
+            version["accuracy"] = version["accurate"] / version["readings"]
+            version["interval"] = accuracy_interval(version["accurate"], version["readings"])
+        return JSONResponse(content={"days": days, "versions": versions}, status_code=200)
+    except Exception as e:
+        logger.exception("Error retrieving model accuracy")
+        return JSONResponse(content={"error": "Error retrieving model accuracy"}, status_code=500)
@@ -1,32 +1,58 @@
+import asyncio
+import logging
+import os
+from typing import List, Literal, Optional
 from fastapi import APIRouter, Depends
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from pydantic import BaseModel
-from preprocessing.preprocessImage import PreprocessingError, preprocess
-from services.forward_to_serving import forward_to_serving
+from pydantic import BaseModel, Field
+from constants.emotion_enum import Emotions
+from services.executors import run_cpu_bound, run_io_bound
 from services.verifyToken import verify_token
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 security = HTTPBearer()
 
+# most frames accepted in one burst
+MAX_BURST_FRAMES = int(os.getenv("MAX_BURST_FRAMES", 10))
+
 class ImageRequest(BaseModel):
     image: str
+    top_k: Optional[int] = Field(None, ge=1, le=len(Emotions))
+
+class BurstRequest(BaseModel):
+    frames: List[str] = Field(min_length=1)
+    aggregation: Literal['mean', 'majority'] = 'mean'
+    top_k: Optional[int] = Field(None, ge=1, le=len(Emotions))
+
+# the k most likely emotions are only added when asked for, they come from the probabilities already returned
+def add_top_emotions(content: dict, top_k: Optional[int]) -> dict:
+    from services.aggregate_predictions import top_emotions
+
+    if top_k is not None:
+        content["top"] = top_emotions(content["probabilities"], top_k)
+    return content
 
 # API endpoint to upload an image
 @router.post("/predict")
-def upload_image( request: ImageRequest, token: HTTPAuthorizationCredentials = Depends(security)
+async def upload_image( request: ImageRequest, token: HTTPAuthorizationCredentials = Depends(security)
 )-> JSONResponse:
     """
     Upload an image for prediction.
 
     Uploads an image for prediction by ML model. Token is verified before processing the image. The image is preprocessed and forwarded to TensorFlow Serving for prediction.
+    Verification and preprocessing run in the cpu pool and the serving request in the io pool, keeping the event loop free.
+    Every emotion's probability is returned as a list in Emotions order, with the top_k most likely emotions added when requested.
+    The model version is picked by the weights in MODEL_VERSIONS and returned with the prediction, the app saves it with the reading.
+    A copy of the image may be sent to the shadow version (MODEL_SHADOW_VERSION) after the prediction, the response doesn't wait for it.
 
     Args:
-        request (ImageRequest): The image data to be uploaded.
+        request (ImageRequest): The image data to be uploaded, and optionally how many of the most likely emotions to list.
         token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
 
     Returns:
-        JSONResponse: A JSON response containing the prediction and confidence level, or an error message.
+        JSONResponse: A JSON response containing the prediction, confidence level, probabilities (and top emotions) and model version, or an error message.
 
     Raises:
         PreprocessingError: If there is an error in preprocessing the image.
@@ -38,21 +64,95 @@ def upload_image( request: ImageRequest, token: HTTPAuthorizationCredentials = D
         401: Unauthorized - Invalid token.
         500: Internal Server Error - Error retrieving prediction or preprocessing image.
     """
+    # opencv, numpy and requests are only needed here, they're imported by the warm up or the first prediction
+    # rather than with the app so processes start (and tests collect) faster
+    from preprocessing.preprocessImage import PreprocessingError, preprocess
+    from services.forward_to_serving import forward_to_serving
+    from services.model_routing import choose_model_version, submit_shadow
+
     try:
-        verification = verify_token(token.credentials)
+        verification = await run_cpu_bound(verify_token, token.credentials)
         if (verification["valid"] == False):
             return JSONResponse(content={"message": verification["message"]}, status_code=401)
         
-        preprocessed_image = preprocess(request.image)
-        result = forward_to_serving(preprocessed_image)  # forward image to TensorFlow Serving as np array
-    
-        prediction, confidence = result["prediction"], result["confidence"]
-        
-        return JSONResponse(content={"prediction": prediction, "confidence": confidence}, status_code=200)
+        preprocessed_image = await run_cpu_bound(preprocess, request.image)
+        model_version = choose_model_version()
+        result = await run_io_bound(forward_to_serving, preprocessed_image, model_version)  # forward image to TensorFlow Serving as np array
+        if result is None:
+            return JSONResponse(content={"error": "Error retrieving prediction, please try again"}, status_code=500)
+        submit_shadow([preprocessed_image], [result["probabilities"]])
+
+        return JSONResponse(content=add_top_emotions(result, request.top_k), status_code=200)
     except PreprocessingError as e:
-        print("Error in preprocessing image")
-        print("Developer message:", e.developer_message)
+        logger.info("Error in preprocessing image: %s", e.developer_message)
         return JSONResponse(content={"error": e.user_message}, status_code=400)
     except Exception as e:
-        print("Unexpected error: ", e.with_traceback)
-        return JSONResponse(content={"error": "Error retrieving prediction, please try again"}, status_code=500)
\ No newline at end of file
+        logger.exception("Unexpected error in predict")
+        return JSONResponse(content={"error": "Error retrieving prediction, please try again"}, status_code=500)
+
+# API endpoint to upload a burst of frames
+@router.post("/predict/burst")
+async def upload_burst(request: BurstRequest, token: HTTPAuthorizationCredentials = Depends(security)) -> JSONResponse:
+    """
+    Upload a burst of frames for a single prediction.
+
+    Uploads several frames (a burst of photos or frames from a short clip) of the user for one, more robust, prediction. 
+    The token is verified once, the frames are preprocessed in parallel in the cpu pool and every face found is sent to TensorFlow Serving in one request.
+    The softmax of each frame is then combined, by the mean probability or a majority vote, into one prediction.
+    Frames where no face is found are left out. The whole burst is predicted by one model version, as for /predict.
+
+    Args:
+        request (BurstRequest): The frames, how to combine their predictions ('mean' or 'majority'), and optionally how many of the most likely emotions to list.
+        token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
+
+    Returns:
+        JSONResponse: A JSON response containing the prediction, confidence, agreement between frames, mean probabilities (and top emotions), the number of frames used and the model version, or an error message.
+
+    Raises:
+        PreprocessingError: If a face isn't found in any of the frames.
+        Exception: For any other unexpected errors.
+
+    Responses:
+        200: Prediction retrieved successfully.
+        400: Bad Request - Too many frames, or no face found in any frame.
+        401: Unauthorized - Invalid token.
+        500: Internal Server Error - Error retrieving prediction.
+    """
+    from preprocessing.preprocessImage import PreprocessingError, preprocess
+    from services.aggregate_predictions import aggregate_predictions
+    from services.forward_to_serving import forward_batch_to_serving
+    from services.model_routing import choose_model_version, submit_shadow
+
+    try:
+        verification = await run_cpu_bound(verify_token, token.credentials)
+        if (verification["valid"] == False):
+            return JSONResponse(content={"message": verification["message"]}, status_code=401)
+        if len(request.frames) > MAX_BURST_FRAMES:
+            return JSONResponse(content={"error": f"A burst can have at most {MAX_BURST_FRAMES} frames"}, status_code=400)
+
+        results = await asyncio.gather(*(run_cpu_bound(preprocess, frame) for frame in request.frames), return_exceptions=True)
+        faces = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        # anything other than a frame without a usable face is unexpected
+        for error in errors:
+            if not isinstance(error, PreprocessingError):
+                raise error
+        if not faces:
+            logger.info("Error in preprocessing burst: %s", errors[0].developer_message, extra={'frames': len(request.frames)})
+            return JSONResponse(content={"error": errors[0].user_message}, status_code=400)
+
+        model_version = choose_model_version()
+        predictions = await run_io_bound(forward_batch_to_serving, faces, model_version)
+        if predictions is None:
+            return JSONResponse(content={"error": "Error retrieving prediction, please try again"}, status_code=500)
+        submit_shadow(faces, predictions)
+
+        result = aggregate_predictions(predictions, request.aggregation)
+        content = add_top_emotions(result, request.top_k)
+        return JSONResponse(
+            content={**content, "frames": len(request.frames), "frames_used": len(faces), "model_version": model_version},
+            status_code=200,
+        )
+    except Exception as e:
+        logger.exception("Unexpected error in predict burst")
+        return JSONResponse(content={"error": "Error retrieving prediction, please try again"}, status_code=500)
@@ -1,12 +1,19 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+import logging
+from functools import partial
+from typing import Annotated, List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from constants.emotion_enum import Emotions
+from services.compact_encoding import encode_emotion_counts, encode_readings
+from services.executors import run_cpu_bound
+from services.export_readings import create_writer, stream_export
 from services.verifyToken import verify_token
-from db.connection import Session
-from db.queries import insert_reading, select_emotion_counts_over_time, select_user_readings
+from db.connection import Session, read_session, record_write
+from db.queries import delete_reading, insert_reading, select_emotion_counts_over_time, select_reading_changes, select_user_readings
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 security = HTTPBearer()
 
@@ -17,19 +24,33 @@ class ReadingData(BaseModel):
     note: Optional[str] = None
     timestamp: str
     clerk_id: str
+    # the probabilities returned by /predict, in Emotions order
+    probabilities: Optional[List[Annotated[float, Field(ge=0, le=1)]]] = Field(None, min_length=len(Emotions), max_length=len(Emotions))
+    # the model version returned by /predict, null when no versions are configured
+    model_version: Optional[str] = Field(None, max_length=64)
+
+# a json response, in the compact encoding when asked for, run in the cpu pool as a full history can be large
+def render_json(content, encode=None) -> JSONResponse:
+    return JSONResponse(content=encode(content) if encode else content, status_code=200)
 
 @router.post("/readings")
 async def upload_reading( 
     request: ReadingData,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
     token: HTTPAuthorizationCredentials = Depends(security)
 ) -> JSONResponse:
     """
     Upload a new reading.
 
     Uploads a new emotion reading. Token is verified before the reading is saved to the database.
+    When the probabilities from the prediction are included they're stored with the reading, along with the highest as its confidence.
+    The model version that made the prediction and the user's is_accurate feedback are stored with it, for comparing versions (GET /models/accuracy).
+    Clients send a unique Idempotency-Key header with each reading and the same one on retries, a retry of an upload that was saved
+    gets the stored reading back rather than saving it again. Keys are kept for a day.
 
     Args:
         request (ReadingData): The reading data to be uploaded.
+        idempotency_key (Optional[str], optional): The Idempotency-Key header, unique to the reading. Defaults to None.
         token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
 
     Returns:
@@ -40,23 +61,26 @@ async def upload_reading(
         Exception: For any other unexpected errors.
 
     Responses:
-        201: Reading uploaded successfully.
+        201: Reading uploaded successfully, or already uploaded with the same Idempotency-Key.
         401: Unauthorised - Invalid token.
         500: Internal Server Error - Error uploading reading.
     """
     try :
         # verify token
-        verification = verify_token(token.credentials)
+        verification = await run_cpu_bound(verify_token, token.credentials)
         if (verification["valid"] == False):
             return JSONResponse(content={"message": verification["message"]}, status_code=401)
         # save reading to db
         async with Session() as session:
-            response, status_code = await insert_reading(session, request)
-            return JSONResponse(content=response, status_code=status_code)
+            response, status_code = await insert_reading(session, request, idempotency_key)
+        # the user's next reads go to the primary until the replica has this reading
+        if status_code == 201:
+            record_write(request.clerk_id)
+        return JSONResponse(content=response, status_code=status_code)
     except HTTPException as e:
         return JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)
     except Exception as e:
-        print("Unexpected error: ", e.with_traceback)
+        logger.exception("Unexpected error uploading reading")
         return JSONResponse(content={"error": "Error uploading reading, please try again"}, status_code=500)
 
  
@@ -67,12 +91,15 @@ async def get_user_readings(
     end_date: Optional[str] = None,
     emotion: Optional[str] = None,
     location: Optional[str] = None,
+    compact: bool = False,
     token: HTTPAuthorizationCredentials = Depends(security)
 ) -> JSONResponse:
     """
     Retrieve user readings.
 
     Retrieve a users readings based on various optional filters such as date range, emotion, and location. Token is verified before fetching the readings from the database.
+    Read from the replica when one is configured, or the primary for a few seconds after the user uploads a reading.
+    With compact the readings are rows of values with emotions as their Emotions value and locations as an index into a list, see compact_encoding.py.
 
     Args:
         clerk_id (str): User ID whose readings are to be retrieved.
@@ -80,6 +107,7 @@ async def get_user_readings(
         end_date (Optional[str], optional): The end date for filtering readings. Defaults to None.
         emotion (Optional[str], optional): The emotion to filter readings by. Defaults to None.
         location (Optional[str], optional): The location to filter readings by. Defaults to None.
+        compact (bool, optional): Send the readings in the compact encoding. Defaults to False.
         token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
 
     Returns:
@@ -95,18 +123,19 @@ async def get_user_readings(
         500: Internal Server Error - Error retrieving readings.
     """
     try:
-        verification = verify_token(token.credentials)
+        verification = await run_cpu_bound(verify_token, token.credentials)
         if (verification["valid"] == False):
             return JSONResponse(content={"message": verification["message"]}, status_code=401)
         
-        async with Session() as session:    
+        async with read_session(clerk_id) as session:
             response = await select_user_readings(session, clerk_id, start_date, end_date, emotion, location)
-            return JSONResponse(content=response, status_code=200)
+        # a full history can be large, render the json off the event loop
+        return await run_cpu_bound(render_json, response, encode_readings if compact else None)
 
     except HTTPException as e:
         return JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)    
     except Exception as e:
-        print("Unexpected error: ", e.with_traceback)
+        logger.exception("Unexpected error retrieving readings")
         return JSONResponse(content={"error": "Error retrieving readings, please try again"}, status_code=500)
 
         
@@ -115,17 +144,20 @@ async def get_emotion_counts(
     clerk_id: str,
     timeframe: str,
     emotions: List[str] = Query(None),
+    compact: bool = False,
     token: HTTPAuthorizationCredentials = Depends(security)
 ) -> JSONResponse:
     """
     Retrieve emotion counts over time. Used in line chart.
 
     Retrieve emotion count data over a specified timeframe. Token is verified before fetching the emotion counts from the database.
+    Read from the replica when one is configured, or the primary for a few seconds after the user uploads a reading.
 
     Args:
         clerk_id (str): User ID whose readings are to be retrieved.
         timeframe (str): The timeframe for which the emotion counts are to be retrieved. Possible values are '7d', '30d', and '52w'.
         emotions (List[str], optional): A list of emotions to filter the counts by. Defaults to None.
+        compact (bool, optional): Send the dates once and each emotion's counts as a list, with emotions as their Emotions value. Defaults to False.
         token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
         
     Returns:
@@ -141,16 +173,182 @@ async def get_emotion_counts(
         500: Internal Server Error - Error retrieving emotion counts.
     """
     try:
-        verification = verify_token(token.credentials)
+        verification = await run_cpu_bound(verify_token, token.credentials)
         if not verification["valid"]:
             return JSONResponse(content={"message": verification["message"]}, status_code=401)
         
-        async with Session() as session:
+        async with read_session(clerk_id) as session:
             formatted_counts = await select_emotion_counts_over_time(session, clerk_id, emotions, timeframe)
-            return JSONResponse(content=formatted_counts, status_code=200)
+        return await run_cpu_bound(render_json, formatted_counts, encode_emotion_counts if compact else None)
         
     except HTTPException as e:
         return JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)
     except Exception as e:
-        print("Unexpected error: ", e.with_traceback)
-        return JSONResponse(content={"error": "Error retrieving emotion counts, please try again"}, status_code=500)
\ No newline at end of file
+        logger.exception("Unexpected error retrieving emotion counts")
+        return JSONResponse(content={"error": "Error retrieving emotion counts, please try again"}, status_code=500)
+
+
+# the cursor a client sends back is "<sync_version>.<reading_id>" of the last change it got, without one every reading is sent
+SYNC_START = (-1, 0)
+
+def format_sync_cursor(cursor: tuple[int, int]) -> str:
+    return f"{cursor[0]}.{cursor[1]}"
+
+def parse_sync_cursor(cursor: Optional[str]) -> tuple[int, int]:
+    if cursor is None:
+        return SYNC_START
+    sync_version, reading_id = cursor.split('.')
+    return int(sync_version), int(reading_id)
+
+@router.get('/readings/sync')
+async def sync_user_readings(
+    clerk_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    token: HTTPAuthorizationCredentials = Depends(security)
+) -> JSONResponse:
+    """
+    Retrieve the changes to a user's readings since their last sync.
+
+    Returns the readings added or changed and the ids of the readings deleted since the cursor, oldest change first, so a client
+    keeping the history locally only downloads what changed rather than all of it. Without a cursor every reading is returned.
+    The client stores the returned cursor and sends it with its next sync, while has_more is true it should sync again straight away.
+    A change shows up once every database transaction that started before it has finished, normally within milliseconds.
+    Token is verified before fetching the changes from the database.
+
+    Args:
+        clerk_id (str): User ID whose readings are to be synced.
+        cursor (Optional[str], optional): The cursor returned by the last sync. Defaults to None.
+        limit (int, optional): The most changes to return. Defaults to 500.
+        token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
+
+    Returns:
+        JSONResponse: A JSON response containing the changed readings, deleted reading ids, next cursor and has_more, or an error message.
+
+    Raises:
+        Exception: For any unexpected errors.
+
+    Responses:
+        200: Changes retrieved successfully.
+        400: Bad Request - Invalid cursor.
+        401: Unauthorised - Invalid token.
+        500: Internal Server Error - Error retrieving changes.
+    """
+    try:
+        verification = await run_cpu_bound(verify_token, token.credentials)
+        if not verification["valid"]:
+            return JSONResponse(content={"message": verification["message"]}, status_code=401)
+        try:
+            sync_cursor = parse_sync_cursor(cursor)
+        except ValueError:
+            return JSONResponse(content={"error": "Invalid cursor"}, status_code=400)
+
+        async with read_session(clerk_id) as session:
+            changes = await select_reading_changes(session, clerk_id, sync_cursor, limit)
+        return JSONResponse(content={**changes, "cursor": format_sync_cursor(changes["cursor"])}, status_code=200)
+
+    except Exception as e:
+        logger.exception("Unexpected error syncing readings")
+        return JSONResponse(content={"error": "Error syncing readings, please try again"}, status_code=500)
+
+
+@router.delete('/readings/{reading_id}')
+async def delete_user_reading(
+    reading_id: int,
+    clerk_id: str,
+    token: HTTPAuthorizationCredentials = Depends(security)
+) -> JSONResponse:
+    """
+    Delete a reading.
+
+    Deletes one of the user's readings, its id is returned as deleted by the next sync of the user's other devices.
+    Token is verified before the reading is deleted.
+
+    Args:
+        reading_id (int): The id of the reading to delete.
+        clerk_id (str): User ID the reading belongs to.
+        token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
+
+    Returns:
+        JSONResponse: A JSON response containing the deleted reading id, or an error message.
+
+    Raises:
+        Exception: For any unexpected errors.
+
+    Responses:
+        200: Reading deleted successfully.
+        401: Unauthorised - Invalid token.
+        404: Not Found - The user has no reading with this id.
+        500: Internal Server Error - Error deleting reading.
+    """
+    try:
+        verification = await run_cpu_bound(verify_token, token.credentials)
+        if not verification["valid"]:
+            return JSONResponse(content={"message": verification["message"]}, status_code=401)
+
+        async with Session() as session:
+            deleted = await delete_reading(session, clerk_id, reading_id)
+        if not deleted:
+            return JSONResponse(content={"error": "Reading not found"}, status_code=404)
+        record_write(clerk_id)
+        return JSONResponse(content={"id": reading_id}, status_code=200)
+
+    except Exception as e:
+        logger.exception("Unexpected error deleting reading")
+        return JSONResponse(content={"error": "Error deleting reading, please try again"}, status_code=500)
+
+
+@router.get('/readings/export')
+async def export_user_readings(
+    clerk_id: str,
+    format: str = 'csv.gz',
+    token: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Export a user's full history.
+
+    Streams every reading of the user as a file, read from the database in batches through a server side cursor so memory stays bounded however long the history is.
+    Formats are 'csv.gz', and 'parquet' or 'arrow' when pyarrow is installed. The probabilities are kept as a fixed order list (one column per emotion in csv). Token is verified before the export starts.
+
+    Args:
+        clerk_id (str): User ID whose readings are to be exported.
+        format (str, optional): The file format. Defaults to 'csv.gz'.
+        token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
+
+    Returns:
+        StreamingResponse: The export file, or a JSONResponse with an error message.
+
+    Raises:
+        Exception: For any unexpected errors before the export starts, errors part way through end the download early and are logged.
+
+    Responses:
+        200: Export streamed successfully.
+        400: Bad Request - Unknown or unavailable format.
+        401: Unauthorised - Invalid token.
+        500: Internal Server Error - Error starting the export.
+    """
+    try:
+        verification = await run_cpu_bound(verify_token, token.credentials)
+        if not verification["valid"]:
+            return JSONResponse(content={"message": verification["message"]}, status_code=401)
+        try:
+            writer = create_writer(format)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+
+        async def export():
+            try:
+                async for chunk in stream_export(partial(read_session, clerk_id), writer, clerk_id):
+                    yield chunk
+            except Exception:
+                logger.exception("Unexpected error streaming readings export", extra={'format': format})
+                raise
+
+        return StreamingResponse(
+            export(),
+            media_type=writer.media_type,
+            headers={"Content-Disposition": f'attachment; filename="readings.{writer.extension}"'},
+        )
+    except Exception as e:
+        logger.exception("Unexpected error exporting readings")
+        return JSONResponse(content={"error": "Error exporting readings, please try again"}, status_code=500)
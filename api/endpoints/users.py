@@ -1,31 +1,35 @@
+import logging
 from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.responses import JSONResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from datetime import datetime
+from services.executors import run_cpu_bound
 from services.verifyToken import verify_token
-from db.models import User
+from db.models import NotificationOutbox, User
 from db.connection import Session
 from pydantic import BaseModel
-from services.celery.tasks import start_user_notification_scheduler
 
+logger = logging.getLogger(__name__)
 router = APIRouter()    
 security = HTTPBearer()
 
-class User(BaseModel):
+class UserData(BaseModel):
     id: str
     start_time: str
     end_time: str
     
 # adds the users clerk id to the database
 @router.post("/users")
-async def add_user(request: User, token: HTTPAuthorizationCredentials = Depends(security)) -> Response:
+async def add_user(request: UserData, token: HTTPAuthorizationCredentials = Depends(security)) -> Response:
     """
     Add a new user.
 
     Adds a user after token generated on signup. Token is verified before the user is added. 
-    Additionally, the user's notification scheduler is started after the user is added.
+    Additionally, an outbox entry is written with the user so their notifications are planned by the worker,
+    nothing is sent to the broker while handling the request.
 
     Args:
-        request (User): The user data to be added.
+        request (UserData): The user data to be added.
         token (HTTPAuthorizationCredentials): The authorisation token provided by the user.
 
     Returns:
@@ -37,29 +41,38 @@ async def add_user(request: User, token: HTTPAuthorizationCredentials = Depends(
 
     Responses:
         201: User added successfully.
+        400: Invalid notification times.
         401: Unauthorised - Invalid token.
         500: Internal Server Error - Error adding user.
     """
     try:
-        verification = verify_token(token.credentials)
+        verification = await run_cpu_bound(verify_token, token.credentials)
         if (verification["valid"] == False): # check if token is invalid
             return JSONResponse(content={"message": verification["message"]}, status_code=401)
+        try:
+            start_time = datetime.strptime(request.start_time, '%H:%M').time()
+            end_time = datetime.strptime(request.end_time, '%H:%M').time()
+        except ValueError:
+            return JSONResponse(content={"error": "Invalid notification times, expected HH:MM"}, status_code=400)
         # add clerk id to the database
         async with Session() as session:
             new_user = User(
                 clerk_id=request.id, 
-                notification_start_time=request.start_time, 
-                notification_end_time=request.end_time
+                notification_start_time=start_time, 
+                notification_end_time=end_time
             )
             session.add(new_user)
+            # the outbox entry commits with the user, the drain_notification_outbox task plans their notifications
+            session.add(NotificationOutbox(
+                clerk_id=request.id,
+                notification_start_time=start_time,
+                notification_end_time=end_time
+            ))
             await session.commit()
             
-            # start the user's notification scheduler
-            start_user_notification_scheduler(request.id, request.start_time, request.end_time)
-            
         return JSONResponse(content={"message": "User added successfully"}, status_code=201)
     except HTTPException as e:
         return JSONResponse(content={"error": e.detail}, status_code=e.status_code)
     except Exception as e:
-        print("Unexpected error: ", e.with_traceback)
+        logger.exception("Unexpected error adding user")
         return JSONResponse(content={"error": "Error adding user, please try again"}, status_code=500)
\ No newline at end of file
@@ -1,30 +1,104 @@
-from fastapi import FastAPI
+import os
+import sys
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from db.connection import dispose_engine, get_engine
 from endpoints.predict import router as predict_router
 from endpoints.users import router as users_router
 from endpoints.readings import router as reading_router
+from endpoints.health import router as health_router
+from endpoints.models import router as models_router
+from services.admission import AdmissionMiddleware, predict_admission
+from services.compression import CompressionMiddleware, parse_levels
+from services.executors import shutdown_executors
+from services.health import health_checker
+from services.loop_monitor import loop_monitor
+from services.logging_config import RequestIdMiddleware, configure_logging
+from services.metrics import render_metrics
 
 
-app = FastAPI()
+# build the engine and start background services with the app, clean them up on shutdown
+# nothing connects or loads models at import so the module is cheap to import (python -m benchmarks.importtime)
+# the health checker warms up the face detector, database and serving in the background, /readyz reports when it's done
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_engine()
+    loop_monitor.start()
+    health_checker.start()
+    yield
+    await health_checker.stop()
+    await loop_monitor.stop()
+    shutdown_executors()
+    # only imported if a prediction or the warm up has used it
+    if 'services.forward_to_serving' in sys.modules:
+        sys.modules['services.forward_to_serving'].close_serving_session()
+    if 'services.model_routing' in sys.modules:
+        sys.modules['services.model_routing'].close_shadow_session()
+    await dispose_engine()
 
-# CORS - not recommended for production adding all origins/methods/headers
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# app factory, run with: uvicorn main:app or uvicorn main:create_app --factory
+def create_app() -> FastAPI:
+    configure_logging()
+    app = FastAPI(lifespan=lifespan)
 
+    # CORS - not recommended for production adding all origins/methods/headers
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    # compresses responses for clients that accept it, i.e. the readings history and chart series sent to phones
+    app.add_middleware(
+        CompressionMiddleware,
+        encodings=os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip"),
+        minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", 1024)),
+        offload_size=int(os.getenv("COMPRESSION_OFFLOAD_SIZE", 65536)),
+        levels=parse_levels(os.getenv("COMPRESSION_LEVELS", "")),
+    )
+    # bounds the predictions running and queued in this worker, the rest get a 503 with Retry-After
+    app.add_middleware(AdmissionMiddleware, controller=predict_admission, paths=('/api/predict', '/api/predict/burst'))
+    # correlates every log line from a request, added last so it wraps everything else
+    app.add_middleware(RequestIdMiddleware)
 
-@app.get("/")
-async def root():
-    return {"message": "Listening"}
+    @app.get("/")
+    async def root():
+        return {"message": "Listening"}
 
-# Routes
-app.include_router(predict_router, prefix="/api")
-app.include_router(users_router, prefix="/api")
-app.include_router(reading_router, prefix='/api')
+    # prometheus scrape endpoint
+    @app.get("/metrics")
+    async def metrics():
+        body, content_type = render_metrics()
+        return Response(content=body, media_type=content_type)
+
+    # Routes
+    app.include_router(health_router)
+    app.include_router(predict_router, prefix="/api")
+    app.include_router(users_router, prefix="/api")
+    app.include_router(reading_router, prefix='/api')
+    app.include_router(models_router, prefix='/api')
+
+    # opt in request profiling, nothing is installed unless enabled
+    if os.getenv("PROFILING_ENABLED") == "1":
+        from services.profiling import ProfilingMiddleware, router as profiling_router
+        app.add_middleware(
+            ProfilingMiddleware,
+            sample_rate=float(os.getenv("PROFILING_SAMPLE_RATE", 0)),
+            secret=os.getenv("PROFILING_SECRET"),
+            interval=float(os.getenv("PROFILING_INTERVAL_MS", 1)) / 1000,
+        )
+        app.include_router(profiling_router)
+
+    # runtime log level changes per module
+    if os.getenv("LOG_ADMIN_SECRET"):
+        from endpoints.log_levels import router as log_levels_router
+        app.include_router(log_levels_router)
+
+    return app
+
+app = create_app()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+import os
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from services.metrics import DETECTION_CACHE_REQUESTS, PREPROCESS_STAGE_SECONDS
+
+load_dotenv()
+
+# Face detectors used by preprocessing, chosen with FACE_DETECTOR:
+#   haar  - opencv's haarcascade (default), no model file needed
+#   yunet - opencv's YuNet cnn (cv2.FaceDetectorYN) on cpu, needs YUNET_MODEL_PATH pointing at
+#           face_detection_yunet_2023mar.onnx from https://github.com/opencv/opencv_zoo
+# every detector takes the greyscale image and returns the faces found as an (n, 4) array of x, y, w, h boxes in that image
+# opencv keeps per call state on a detector so each thread loads its own
+
+class FaceDetector:
+    name = None
+
+    # load the model for the calling thread, called by the warm up so the first request doesn't pay for it
+    def load(self):
+        raise NotImplementedError
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+def to_boxes(faces) -> np.ndarray:
+    return np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+
+# the search is limited to the face sizes a selfie can have, faces smaller than min_face_ratio of the image's
+# short side aren't searched for, which skips the full resolution scales where most of the time went
+# the scale step is raised if the range would otherwise need more than max_scales steps
+# (CASCADE_FIND_BIGGEST_OBJECT would be the other way to stop early, but opencv 4 ignores flags for this cascade format)
+class HaarCascadeDetector(FaceDetector):
+    name = 'haar'
+
+    def __init__(self, scale_factor: float = 1.1, min_neighbors: int = 5, min_size: int = 60, min_face_ratio: float = 0.2, max_scales: int = 32):
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.min_face_ratio = min_face_ratio
+        self.max_scales = max_scales
+        self.local = threading.local()
+
+    # scale factor, min size and max size for an image of this size
+    def get_search_parameters(self, height: int, width: int) -> tuple:
+        short_side = min(height, width)
+        min_side = min(short_side, max(self.min_size, int(short_side * self.min_face_ratio)))
+        scale_factor = max(self.scale_factor, (short_side / min_side) ** (1 / self.max_scales))
+        return scale_factor, (min_side, min_side), (short_side, short_side)
+
+    # parsing the xml takes longer than detecting a face, so it's loaded once per thread
+    def load(self) -> cv2.CascadeClassifier:
+        haar_cascade = getattr(self.local, 'haar_cascade', None)
+        if haar_cascade is None:
+            with PREPROCESS_STAGE_SECONDS.labels(stage='detector_load').time():
+                haar_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            # not cached if it failed to load so the next call tries again
+            if haar_cascade.empty():
+                raise RuntimeError("Failed to load haarcascade")
+            self.local.haar_cascade = haar_cascade
+        return haar_cascade
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        haar_cascade = self.load()
+        scale_factor, min_size, max_size = self.get_search_parameters(*image.shape[:2])
+        with PREPROCESS_STAGE_SECONDS.labels(stage='detect_faces').time():
+            faces = haar_cascade.detectMultiScale(image, scaleFactor=scale_factor, minNeighbors=self.min_neighbors, minSize=min_size, maxSize=max_size)
+        return to_boxes(faces)
+
+# one forward pass of a small cnn instead of a multi scale scan, images are shrunk to max_side first
+# as the model finds faces in a few hundred pixels just as well and the cost grows with the input size
+class YuNetDetector(FaceDetector):
+    name = 'yunet'
+
+    def __init__(self, model_path: str, score_threshold: float = 0.7, nms_threshold: float = 0.3, max_side: int = 640):
+        if not model_path or not os.path.isfile(model_path):
+            raise ValueError(f"YuNet model not found: {model_path} - Set YUNET_MODEL_PATH to face_detection_yunet_2023mar.onnx")
+        self.model_path = model_path
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.max_side = max_side
+        self.local = threading.local()
+
+    def load(self):
+        model = getattr(self.local, 'model', None)
+        if model is None:
+            with PREPROCESS_STAGE_SECONDS.labels(stage='detector_load').time():
+                model = cv2.FaceDetectorYN.create(self.model_path, "", (self.max_side, self.max_side), self.score_threshold, self.nms_threshold)
+            self.local.model = model
+        return model
+
+    def detect(self, image: np.ndarray) -> np.ndarray:
+        model = self.load()
+        height, width = image.shape[:2]
+        scale = min(1.0, self.max_side / max(height, width))
+        with PREPROCESS_STAGE_SECONDS.labels(stage='detect_faces').time():
+            small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+            # the model expects 3 channels, the greyscale image is repeated into each
+            if small.ndim == 2:
+                small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+            model.setInputSize((small.shape[1], small.shape[0]))
+            _, faces = model.detect(small)
+        if faces is None:
+            return to_boxes([])
+
+        # rows are x, y, w, h, 5 landmarks and a score in the shrunk image, scale back and clip to the image
+        corners = np.rint(np.column_stack([faces[:, :2], faces[:, :2] + faces[:, 2:4]]) / scale)
+        corners = np.clip(corners, 0, [width, height, width, height])
+        boxes = np.column_stack([corners[:, :2], corners[:, 2:] - corners[:, :2]])
+        return to_boxes(boxes[(boxes[:, 2] > 0) & (boxes[:, 3] > 0)])
+
+DETECTORS = {
+    HaarCascadeDetector.name: HaarCascadeDetector,
+    YuNetDetector.name: YuNetDetector,
+}
+
+def create_face_detector(name: str = None) -> FaceDetector:
+    name = (name or os.getenv('FACE_DETECTOR', HaarCascadeDetector.name)).lower()
+    if name == YuNetDetector.name:
+        return YuNetDetector(
+            os.getenv('YUNET_MODEL_PATH'),
+            score_threshold=float(os.getenv('YUNET_SCORE_THRESHOLD', 0.7)),
+            max_side=int(os.getenv('YUNET_MAX_SIDE', 640)),
+        )
+    if name == HaarCascadeDetector.name:
+        return HaarCascadeDetector(min_face_ratio=float(os.getenv('HAAR_MIN_FACE_RATIO', 0.2)))
+    raise ValueError(f"Unknown face detector: {name} - Expected one of {list(DETECTORS)}")
+
+_detector = None
+_detector_lock = threading.Lock()
+
+# the configured detector, shared by every thread (each loads its own model)
+def get_face_detector() -> FaceDetector:
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = create_face_detector()
+    return _detector
+
+# most recent detections keyed by a hash of the uploaded image, so a photo that's sent again
+# (a retry after a timeout, or a repeated frame) skips detection
+class DetectionCache:
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.detections = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            faces = self.detections.get(key)
+            if faces is not None:
+                self.detections.move_to_end(key)
+        DETECTION_CACHE_REQUESTS.labels(result='miss' if faces is None else 'hit').inc()
+        return faces
+
+    def add(self, key, faces: np.ndarray):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.detections[key] = faces
+            self.detections.move_to_end(key)
+            while len(self.detections) > self.max_size:
+                self.detections.popitem(last=False)
+
+detection_cache = DetectionCache(int(os.getenv('DETECTION_CACHE_SIZE', 256)))
+
+# detect faces with the configured detector, cached when a key for the image is given
+def detect_faces(image: np.ndarray, cache_key: bytes = None) -> np.ndarray:
+    detector = get_face_detector()
+    if cache_key is None:
+        return detector.detect(image)
+    key = (detector.name, cache_key)
+    faces = detection_cache.get(key)
+    if faces is None:
+        faces = detector.detect(image)
+        detection_cache.add(key, faces)
+    return faces
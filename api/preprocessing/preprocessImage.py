@@ -1,6 +1,13 @@
 import cv2
 import numpy as np
+import os
 import base64
+import hashlib
+from dotenv import load_dotenv
+from preprocessing.faceDetectors import detect_faces
+from services.metrics import PREPROCESS_QUALITY_CHECKS, PREPROCESS_STAGE_SECONDS
+
+load_dotenv()
 
 # exception handler for preprocessing errors
 class PreprocessingError(Exception):
@@ -11,17 +18,35 @@ class PreprocessingError(Exception):
         
 generic_user_message = "An error occurred while processing the image. Please try again."
 
-# Preprocess the image by greyscaling, detecting face, cropping to bounding box, and resizing
+# quality thresholds for the detected face, frames that fail are rejected before they're sent to the model
+# setting a threshold to 0 (or QUALITY_MAX_BRIGHTNESS to 255) turns its check off
+# the size checks sit above the haar detector's own floor (60px or HAAR_MIN_FACE_RATIO, 0.2, of the short side),
+# so a face the detector finds but that's too far away gets told to move closer rather than that no face was found
+# the smallest face in pixels
+QUALITY_MIN_FACE_SIZE = int(os.getenv('QUALITY_MIN_FACE_SIZE', 96))
+# the smallest face as a fraction of the photo's short side
+QUALITY_MIN_FACE_RATIO = float(os.getenv('QUALITY_MIN_FACE_RATIO', 0.25))
+# the range of the face's mean pixel value
+QUALITY_MIN_BRIGHTNESS = float(os.getenv('QUALITY_MIN_BRIGHTNESS', 40))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv('QUALITY_MAX_BRIGHTNESS', 220))
+# the lowest sharpness, the variance of the laplacian of the face at the photo's resolution normalised for its size (see get_sharpness)
+QUALITY_MIN_SHARPNESS = float(os.getenv('QUALITY_MIN_SHARPNESS', 20))
+# the face size the sharpness is normalised to
+SHARPNESS_REFERENCE_SIZE = 256
+
+# Preprocess the image by greyscaling, detecting face, cropping to bounding box, resizing and checking the quality of the face
 # Note: do not normalise the pixel values as the first stage of the model does this
 
 def b64_to_numpy(base_64_image: str) -> np.ndarray:
     try:
         # decode the base64 image
-        decoded_image = base64.b64decode(base_64_image)
+        with PREPROCESS_STAGE_SECONDS.labels(stage='base64_decode').time():
+            decoded_image = base64.b64decode(base_64_image)
         # convert the image to numpy array
         np_image = np.frombuffer(decoded_image, dtype=np.uint8)
         # decode the numpy array to image formay that opencv can read
-        cv2_image = cv2.imdecode(np_image, cv2.IMREAD_COLOR)
+        with PREPROCESS_STAGE_SECONDS.labels(stage='imdecode').time():
+            cv2_image = cv2.imdecode(np_image, cv2.IMREAD_COLOR)
 
         if cv2_image is None:
             raise PreprocessingError(generic_user_message, "Error in decoding base64 image: cv2 image is None")
@@ -33,36 +58,25 @@ def b64_to_numpy(base_64_image: str) -> np.ndarray:
 # greyscale the image
 def greyscale(image: np.ndarray) -> np.ndarray:
     try:
-        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        with PREPROCESS_STAGE_SECONDS.labels(stage='greyscale').time():
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     except Exception as e:
         raise PreprocessingError(generic_user_message, f"Error in greyscaling image: {e}")
 
 # find the largest face in the image - 
 # haarcascadae often mistakenly detects multiple faces - the largest is usually the correct one
-def find_largest_face(faces: list) -> tuple:
-    largest_face = None
-    max_area = 0
-    
-    for x, y, w, h in faces:
-        area = w * h
-        if area > max_area:
-            max_area = area
-            largest_face = (x, y, w, h)
-            
-    return largest_face
+def find_largest_face(faces) -> tuple:
+    faces = np.asarray(faces).reshape(-1, 4)
+    if len(faces) == 0:
+        return None
+    # argmax returns the first of equally large faces
+    return tuple(int(value) for value in faces[np.argmax(faces[:, 2] * faces[:, 3])])
 
-def detect_and_crop_to_face(image: np.ndarray) -> np.ndarray:
+# the bounding box (x, y, w, h) of the face in the image
+def detect_face(image: np.ndarray, cache_key: bytes = None) -> tuple:
     try:
-        # load the haarcascade for face detection
-        haar_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')    
-        
-        # check if haarcascade was loaded
-        if haar_cascade.empty():
-            raise PreprocessingError(generic_user_message, "Failed to load haarcascade")
-
-        
-        # detect faces in the image
-        face = haar_cascade.detectMultiScale(image, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60))
+        # detect faces in the image with the configured detector (FACE_DETECTOR), see faceDetectors.py
+        face = detect_faces(image, cache_key)
         
         # throw error if no face is detected
         if len(face) == 0:
@@ -70,35 +84,74 @@ def detect_and_crop_to_face(image: np.ndarray) -> np.ndarray:
         
         # get the largest face in case multiple faces are detected
         if len(face) > 1:
-            x, y, w, h = find_largest_face(face)
-        else:
-            x, y, w, h = face[0]
-
-        # crop the image to the detected face
-        cropped_face = image[y:y+h, x:x+w]
-        
-        return cropped_face
+            return find_largest_face(face)
+        return tuple(int(value) for value in face[0])
     
     except PreprocessingError as e:
         raise e
     except Exception as e:
         raise PreprocessingError(generic_user_message, f"Error in detecting and cropping face: {e}")
+
+def detect_and_crop_to_face(image: np.ndarray, cache_key: bytes = None) -> np.ndarray:
+    x, y, w, h = detect_face(image, cache_key)
+    # crop the image to the detected face
+    return image[y:y+h, x:x+w]
     
 # resize the image to 48x48 as expected by the model
 def resize(image: np.ndarray) -> np.ndarray:
     try:
-        return cv2.resize(image, (48, 48), interpolation=cv2.INTER_AREA)
+        with PREPROCESS_STAGE_SECONDS.labels(stage='resize').time():
+            return cv2.resize(image, (48, 48), interpolation=cv2.INTER_AREA)
     except Exception as e:
-        print("Error in resizing image:", e)
         raise PreprocessingError(generic_user_message, f"Error in resizing image: {e}")
+
+# variance of the laplacian of the face crop before it's resized, shrinking it to 48x48 averages a few pixels of blur away
+# the variance of a textured face falls slowly as the crop grows (roughly with the square root of its size),
+# so it's scaled to SHARPNESS_REFERENCE_SIZE for one threshold to fit every camera resolution
+def get_sharpness(face: np.ndarray) -> float:
+    _, stddev = cv2.meanStdDev(cv2.Laplacian(face, cv2.CV_32F))
+    return float(stddev[0][0] ** 2) * (min(face.shape[:2]) / SHARPNESS_REFERENCE_SIZE) ** 0.5
+
+# reject frames the model can't read well, with a message telling the user what to fix
+# the face size and ratio come from the bounding box, brightness and sharpness are measured on the face crop at the photo's resolution
+# every check is counted on each frame before the first failure is raised, so the metrics give the rate each is hit
+def check_quality(image_shape: tuple, face_box: tuple, face: np.ndarray) -> None:
+    with PREPROCESS_STAGE_SECONDS.labels(stage='quality_gate').time():
+        _, _, w, h = face_box
+        face_size = min(w, h)
+        brightness = float(face.mean())
+        sharpness = get_sharpness(face)
+        failed = {
+            'face_size': face_size < QUALITY_MIN_FACE_SIZE,
+            'face_ratio': face_size < QUALITY_MIN_FACE_RATIO * min(image_shape[:2]),
+            'brightness': not QUALITY_MIN_BRIGHTNESS <= brightness <= QUALITY_MAX_BRIGHTNESS,
+            'sharpness': sharpness < QUALITY_MIN_SHARPNESS,
+        }
+    for check, result in failed.items():
+        PREPROCESS_QUALITY_CHECKS.labels(check=check, result='fail' if result else 'pass').inc()
+
+    measurements = f"face {w}x{h} in {image_shape[1]}x{image_shape[0]}, brightness {brightness:.0f}, sharpness {sharpness:.0f}"
+    if failed['face_size'] or failed['face_ratio']:
+        raise PreprocessingError("Your face is too small in the photo, please move closer to the camera", f"Face too small: {measurements}")
+    # darkness also blurs the edges, so lighting is reported ahead of sharpness
+    if failed['brightness'] and brightness < QUALITY_MIN_BRIGHTNESS:
+        raise PreprocessingError("The photo is too dark, please move somewhere brighter", f"Face too dark: {measurements}")
+    if failed['brightness']:
+        raise PreprocessingError("The photo is too bright, please avoid strong light on your face", f"Face too bright: {measurements}")
+    if failed['sharpness']:
+        raise PreprocessingError("The photo is blurry, please hold the camera still", f"Face too blurry: {measurements}")
     
 # preprocessing pipeline
 def preprocess(base64_image: str) -> np.ndarray:
     try: 
         np_image = b64_to_numpy(base64_image)
         greyscale_image = greyscale(np_image)
-        cropped_face = detect_and_crop_to_face(greyscale_image)
-        resized_image = resize(cropped_face)
+        # detections are cached by a hash of the upload, so the same photo sent again skips detection
+        cache_key = hashlib.blake2b(base64_image.encode(), digest_size=16).digest()
+        x, y, w, h = detect_face(greyscale_image, cache_key)
+        face = greyscale_image[y:y+h, x:x+w]
+        check_quality(greyscale_image.shape, (x, y, w, h), face)
+        resized_image = resize(face)
         # add the channel dimension to match the model input shape
         preprocessed_image = np.expand_dims(resized_image, axis=-1)
         return preprocessed_image
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+from services.metrics import ADMISSION_IN_FLIGHT, ADMISSION_LIMIT, ADMISSION_QUEUE_SECONDS, ADMISSION_REQUESTS
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Admission control for the predictions, each worker runs at most `limit` at once and queues a few more for a short time
+# anything past that gets a fast 503 with Retry-After, rather than piling onto the pools and TensorFlow Serving
+# until every request times out together
+# with adaptive on the limit follows the latency of admitted predictions (AIMD), it grows by about 1 for each limit's worth
+# of predictions under the target latency and is cut by `backoff` when one goes over
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float, adaptive: bool = False,
+                 min_limit: int = 1, max_limit: int = 128, target_latency: float = 1.0, backoff: float = 0.9):
+        self.limit = float(limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.in_flight = 0
+        self.waiters = deque()
+        # moving average of how long admitted predictions take
+        self.latency = None
+        self.last_decrease = 0.0
+        ADMISSION_LIMIT.set(self.current_limit())
+
+    # a limit of 0 turns admission control off
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit)) if self.enabled else 0
+
+    # Little's law, the queue drains at limit / latency predictions a second
+    def expected_wait(self, position: int) -> float:
+        if self.latency is None:
+            return 0.0
+        return position * self.latency / self.current_limit()
+
+    # seconds until a rejected client should try again, the time for everything queued now to be served
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.expected_wait(len(self.waiters) + 1)))
+
+    async def acquire(self):
+        if self.in_flight < self.current_limit() and not self.waiters:
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.set(self.in_flight)
+            ADMISSION_REQUESTS.labels(result='admitted').inc()
+            return
+        if len(self.waiters) >= self.queue_size:
+            ADMISSION_REQUESTS.labels(result='queue_full').inc()
+            raise Overloaded('queue_full', self.retry_after())
+        # rejected now rather than after waiting out the deadline when the queue won't drain in time
+        if self.expected_wait(len(self.waiters) + 1) > self.queue_timeout:
+            ADMISSION_REQUESTS.labels(result='deadline').inc()
+            raise Overloaded('deadline', self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        started_at = time.perf_counter()
+        try:
+            # release hands its slot straight to the first waiter, in_flight is already counted when the future is set
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_REQUESTS.labels(result='timeout').inc()
+            raise Overloaded('timeout', self.retry_after())
+        except BaseException:
+            # cancelled (i.e. the client went away) just after being handed a slot, pass it on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if future in self.waiters:
+                self.waiters.remove(future)
+            ADMISSION_QUEUE_SECONDS.observe(time.perf_counter() - started_at)
+        ADMISSION_REQUESTS.labels(result='queued').inc()
+
+    # called when an admitted prediction finishes, with how long it took
+    def release(self, latency: float = None):
+        self.in_flight -= 1
+        if latency is not None:
+            self.observe(latency)
+        while self.waiters and self.in_flight < self.current_limit():
+            future = self.waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+        ADMISSION_IN_FLIGHT.set(self.in_flight)
+
+    def observe(self, latency: float):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if not self.adaptive:
+            return
+        now = time.monotonic()
+        if latency > self.target_latency:
+            # at most once per latency, the predictions finishing just after were admitted under the old limit
+            if now - self.last_decrease >= latency:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+        elif self.in_flight + 1 >= self.current_limit():
+            # only grown while the limit is what's holding predictions back
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        ADMISSION_LIMIT.set(self.current_limit())
+
+# pure asgi middleware, so a rejected request is answered before its body (the image) is read
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController, paths: tuple):
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths or not self.controller.enabled:
+            return await self.app(scope, receive, send)
+        try:
+            await self.controller.acquire()
+        except Overloaded as e:
+            logger.info("Prediction rejected: %s", e.reason, extra={'in_flight': self.controller.in_flight, 'queued': len(self.controller.waiters)})
+            response = JSONResponse(
+                content={"error": "The server is busy, please try again shortly"},
+                status_code=503,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - started_at)
+
+predict_admission = AdmissionController(
+    limit=int(os.getenv('ADMISSION_LIMIT', 32)),
+    queue_size=int(os.getenv('ADMISSION_QUEUE_SIZE', 64)),
+    queue_timeout=float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 2)),
+    adaptive=os.getenv('ADMISSION_ADAPTIVE') == '1',
+    min_limit=int(os.getenv('ADMISSION_MIN_LIMIT', 1)),
+    max_limit=int(os.getenv('ADMISSION_MAX_LIMIT', 128)),
+    target_latency=float(os.getenv('ADMISSION_TARGET_LATENCY', 1)),
+)
@@ -0,0 +1,32 @@
+import numpy as np
+from constants.emotion_enum import Emotions
+
+# Combines the model's softmax for each frame of a burst into one prediction
+# mean - the frames' probabilities are averaged and the most likely emotion on average wins
+# majority - each frame votes for its most likely emotion, a tie goes to the emotion with the higher mean probability
+# confidence is the winning emotion's mean probability, agreement the share of frames that picked it
+# probabilities is the mean of the frames' softmax, in Emotions order
+
+AGGREGATIONS = ('mean', 'majority')
+
+def aggregate_predictions(predictions: np.ndarray, method: str = 'mean') -> dict:
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {method} - Expected one of {list(AGGREGATIONS)}")
+    mean = predictions.mean(axis=0)
+    votes = np.bincount(predictions.argmax(axis=1), minlength=predictions.shape[1])
+    if method == 'mean':
+        index = int(np.argmax(mean))
+    else:
+        candidates = np.flatnonzero(votes == votes.max())
+        index = int(candidates[np.argmax(mean[candidates])])
+    return {
+        "prediction": Emotions(index).name,
+        "confidence": float(mean[index]),
+        "agreement": float(votes[index] / len(predictions)),
+        "probabilities": mean.tolist(),
+    }
+
+# the k most likely emotions from a probability vector in Emotions order, most likely first
+def top_emotions(probabilities: list[float], k: int) -> list[dict]:
+    ranked = sorted(range(len(probabilities)), key=lambda index: probabilities[index], reverse=True)
+    return [{"emotion": Emotions(index).name, "probability": float(probabilities[index])} for index in ranked[:k]]
@@ -0,0 +1,71 @@
+import argparse
+from kombu.serialization import loads
+from services.celery.celery_config import celery_app
+from services.celery.serializers import COMPACT_JSON, to_compact_payload
+
+# One off migration for messages queued before tasks switched from pickle to compactjson
+# stop the workers first so their unacked eta messages go back to the queue, then from the api directory run:
+#   python -m services.celery.drain_pickle_messages [--dry-run]
+# pickled legacy scheduling messages are dropped, other pickled messages are re-published as compactjson
+# with their headers (task name, eta etc.) kept, messages already in a new format are re-published untouched
+
+LEGACY_TASKS = {
+    'services.celery.tasks.daily_scheduler',
+    'services.celery.tasks.schedule_notifications',
+}
+
+# decide what to do with one message, returns None to drop it or the (body, serializer) to re-publish
+def convert_message(headers: dict, content_type: str, content_encoding: str, body: bytes):
+    if content_type != 'application/x-python-serialize':
+        return body, None
+    if headers.get('task') in LEGACY_TASKS:
+        return None
+    payload = loads(body, content_type, content_encoding, accept={content_type})
+    return to_compact_payload(payload), COMPACT_JSON
+
+def drain_pickle_messages(queue_name: str = 'celery', dry_run: bool = False) -> dict:
+    counts = {'dropped': 0, 'converted': 0, 'untouched': 0}
+    queue = celery_app.amqp.queues[queue_name]
+    with celery_app.connection_for_write() as connection:
+        channel = connection.channel()
+        bound_queue = queue.bind(channel)
+        # only look at the messages that were there when we started, re-published ones go to the back of the queue
+        _, message_count, _ = bound_queue.queue_declare(passive=True)
+        producer = connection.Producer(channel)
+
+        for _ in range(message_count):
+            message = bound_queue.get(no_ack=False, accept=['pickle', COMPACT_JSON, 'json'])
+            if message is None:
+                break
+            converted = convert_message(message.headers, message.content_type, message.content_encoding, message.body)
+            if converted is None:
+                counts['dropped'] += 1
+            else:
+                body, serializer = converted
+                counts['converted' if serializer else 'untouched'] += 1
+                if not dry_run:
+                    publish_options = {
+                        'exchange': message.delivery_info.get('exchange', ''),
+                        'routing_key': message.delivery_info.get('routing_key', queue_name),
+                        'headers': message.headers,
+                        'correlation_id': message.properties.get('correlation_id'),
+                        'reply_to': message.properties.get('reply_to'),
+                    }
+                    if serializer:
+                        producer.publish(body, serializer=serializer, **publish_options)
+                    else:
+                        producer.publish(body, content_type=message.content_type, content_encoding=message.content_encoding, **publish_options)
+            # in a dry run messages are left unacked, closing the channel puts them back on the queue
+            if not dry_run:
+                message.ack()
+
+        channel.close()
+    print(f"Drained {queue_name}: {counts['dropped']} legacy messages dropped, {counts['converted']} converted, {counts['untouched']} untouched")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert or drop celery messages still serialized with pickle")
+    parser.add_argument('--queue', default='celery')
+    parser.add_argument('--dry-run', action='store_true', help="count the messages without changing the queue")
+    args = parser.parse_args()
+    drain_pickle_messages(args.queue, args.dry_run)
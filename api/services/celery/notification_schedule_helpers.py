@@ -1,5 +1,6 @@
 import random
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Optional
 
 # Helper Functions for Notification Scheduling, used by the Celery tasks
 
@@ -28,6 +29,43 @@ def get_random_notification_times(start_datetime: datetime, end_datetime: dateti
     
     return notification_times
 
+# get the user's notification window for a given day as utc datetimes
+# windows that end before they start (i.e. 22:00 - 02:00) run over into the next day
+def get_notification_window(day: date, start_time: time, end_time: time) -> tuple[datetime, datetime]:
+    start_datetime = datetime.combine(day, start_time, tzinfo=timezone.utc)
+    end_datetime = datetime.combine(day, end_time, tzinfo=timezone.utc)
+    if end_datetime <= start_datetime:
+        end_datetime += timedelta(days=1)
+    return start_datetime, end_datetime
+
+# plan the notification slots for each user on a given day, users are (clerk_id, start_time, end_time) rows
+# slot_index makes each slot unique per user per day, so planning the same day twice is harmless
+# only slots after not_before are kept, used when a user signs up part way through the day
+def plan_notification_slots(users: Iterable[tuple], day: date, not_before: Optional[datetime] = None) -> list[dict]:
+    slots = []
+    for clerk_id, start_time, end_time in users:
+        # users without a notification window are not sent any notifications
+        if start_time is None or end_time is None:
+            continue
+        start_datetime, end_datetime = get_notification_window(day, start_time, end_time)
+        for slot_index, send_at in enumerate(get_random_notification_times(start_datetime, end_datetime)):
+            if not_before is not None and send_at <= not_before:
+                continue
+            slots.append({
+                "clerk_id": clerk_id,
+                "slot_date": day,
+                "slot_index": slot_index,
+                "send_at": send_at,
+            })
+    return slots
+
+# plan a new user's remaining slots for today and all of tomorrow's
+# tomorrow is included as the daily planning may have already run today
+def plan_new_user_slots(users: Iterable[tuple], now: datetime) -> list[dict]:
+    users = list(users)
+    today = now.date()
+    return plan_notification_slots(users, today, not_before=now) + plan_notification_slots(users, today + timedelta(days=1))
+
 if __name__ == "__main__":
     # test the helper functions
     start_time = "09:00"
@@ -0,0 +1,145 @@
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Batched sender for Native Notify push notifications, used by the send_notification_batch task
+# one pooled session is shared by every batch a worker process sends so tls connections are reused
+
+NATIVE_NOTIFY_URL = 'https://app.nativenotify.com/api/indie/notification'
+
+# statuses worth retrying, anything else is treated as a permanent failure for that user
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# limits the rate requests are made at, tokens refill continuously up to capacity
+# shared between the sender's threads so the whole batch stays under the api's rate limit
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # block until a token is available
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class NotificationSender:
+    def __init__(
+        self,
+        url: str = NATIVE_NOTIFY_URL,
+        max_concurrency: int = 8,
+        rate_per_second: float = 50,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 30,
+        timeout_seconds: float = 10,
+    ):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.timeout_seconds = timeout_seconds
+        self.rate_limiter = TokenBucket(rate_per_second, capacity=max_concurrency)
+        # pool size matches the concurrency so every thread keeps its own connection alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    # exponential backoff with jitter, honours retry-after when the api asks us to slow down
+    # capped so the retries of a notification can't sleep its thread past the task's time limit and lose the whole batch
+    def get_backoff(self, attempt: int, response=None) -> float:
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(float(response.headers['Retry-After']), self.max_backoff_seconds)
+        return min(self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5), self.max_backoff_seconds)
+
+    # send one notification, retrying transient failures, returns True if it was sent
+    # with a deadline (time.monotonic()) nothing is started after it and requests are cut short to end by it,
+    # None means the deadline passed before the notification was tried, so it can be sent again later
+    def send(self, clerk_id: str, deadline: Optional[float] = None) -> Optional[bool]:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                if attempt == 0:
+                    return None
+                break
+            response = None
+            try:
+                response = self.session.post(
+                    self.url,
+                    json={
+                        'subID': clerk_id,
+                        'appId': os.getenv('NATIVE_NOTIFY_APP_ID'),
+                        'appToken': os.getenv('NATIVE_NOTIFY_TOKEN'),
+                        'title': 'How are you feeling?',
+                        'message': 'Time to check in on your mood!',
+                    },
+                    timeout=self.timeout_seconds if remaining is None else min(self.timeout_seconds, remaining),
+                )
+                if response.status_code == 201:
+                    return True
+                if response.status_code not in TRANSIENT_STATUS_CODES:
+                    logger.warning('Failed to send notification', extra={'clerk_id': clerk_id, 'status_code': response.status_code, 'response': response.text})
+                    return False
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.info('Transient error sending notification: %s', e, extra={'clerk_id': clerk_id, 'attempt': attempt, 'sample_rate': 0.1})
+            if attempt < self.max_retries:
+                backoff = self.get_backoff(attempt, response)
+                if deadline is not None and time.monotonic() + backoff >= deadline:
+                    break
+                time.sleep(backoff)
+        logger.warning('Giving up on notification after %d attempts', attempt + 1, extra={'clerk_id': clerk_id})
+        return False
+
+    # send notifications to many users at once, results are aggregated for the whole batch
+    # unsent are the users not tried before the deadline, a batch that's cut short returns rather than being killed with its results
+    def send_batch(self, clerk_ids: list[str], deadline: Optional[float] = None) -> dict:
+        started_at = time.perf_counter()
+        # each send runs in a copy of the task's context so its logs keep the task id
+        contexts = [contextvars.copy_context() for _ in clerk_ids]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = list(executor.map(lambda clerk_id, context: context.run(self.send, clerk_id, deadline), clerk_ids, contexts))
+        duration = time.perf_counter() - started_at
+        failed = [clerk_id for clerk_id, sent in zip(clerk_ids, results) if sent is False]
+        unsent = [clerk_id for clerk_id, sent in zip(clerk_ids, results) if sent is None]
+        return {
+            'sent': len(clerk_ids) - len(failed) - len(unsent),
+            'failed': failed,
+            'unsent': unsent,
+            'duration_seconds': duration,
+        }
+
+_sender = None
+
+# one sender per worker process, created on first use so the pooled connections are reused between tasks
+def get_notification_sender() -> NotificationSender:
+    global _sender
+    if _sender is None:
+        _sender = NotificationSender(
+            max_concurrency=int(os.getenv('NOTIFY_MAX_CONCURRENCY', 8)),
+            rate_per_second=float(os.getenv('NOTIFY_RATE_LIMIT', 50)),
+        )
+    return _sender
@@ -0,0 +1,54 @@
+import json
+from datetime import date, datetime, timezone
+from kombu.serialization import register
+
+# Compact JSON serializer for celery task payloads, replaces pickle
+# task signatures only carry json types, datetimes are passed as epoch seconds (see to_epoch_seconds)
+# anything else that slips through is encoded as an iso string rather than falling back to pickle
+
+COMPACT_JSON = 'compactjson'
+COMPACT_JSON_CONTENT_TYPE = 'application/x-compact-json'
+
+# datetimes are passed between tasks as whole seconds since the epoch in utc
+def to_epoch_seconds(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+def from_epoch_seconds(seconds: int) -> datetime:
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+def encode_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"Type {type(value).__name__} is not supported in task payloads, pass json types or epoch seconds")
+
+# no whitespace between separators, keeps the message as small as plain json can be
+def compact_dumps(payload) -> str:
+    return json.dumps(payload, separators=(',', ':'), default=encode_default, ensure_ascii=False)
+
+def compact_loads(payload):
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        payload = bytes(payload).decode('utf-8')
+    return json.loads(payload)
+
+# convert the args of a message that was pickled into ones the compact serializer can carry
+# used when draining legacy pickle messages, datetimes become epoch seconds
+def to_compact_payload(value):
+    if isinstance(value, datetime):
+        return to_epoch_seconds(value)
+    if isinstance(value, dict):
+        return {key: to_compact_payload(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_compact_payload(item) for item in value]
+    return value
+
+register(
+    COMPACT_JSON,
+    compact_dumps,
+    compact_loads,
+    content_type=COMPACT_JSON_CONTENT_TYPE,
+    content_encoding='utf-8',
+)
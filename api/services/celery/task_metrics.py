@@ -0,0 +1,36 @@
+import os
+import time
+from celery.signals import task_postrun, task_prerun, worker_init
+from prometheus_client import CollectorRegistry, start_http_server
+from services.metrics import CELERY_TASK_SECONDS
+
+# Records how long each celery task takes, connected when the celery app is configured
+# set CELERY_METRICS_PORT to serve the metrics from the worker, with the prefork pool PROMETHEUS_MULTIPROC_DIR
+# must also be set so the child processes' metrics are collected
+
+_started_at = {}
+
+@task_prerun.connect
+def record_task_start(task_id=None, **kwargs):
+    _started_at[task_id] = time.perf_counter()
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started_at = _started_at.pop(task_id, None)
+    if started_at is None or task is None:
+        return
+    # task names are fixed by the registered tasks and states by celery, so labels stay bounded
+    CELERY_TASK_SECONDS.labels(task=task.name, state=state or 'UNKNOWN').observe(time.perf_counter() - started_at)
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    port = os.getenv('CELERY_METRICS_PORT')
+    if not port:
+        return
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(int(port), registry=registry)
+    else:
+        start_http_server(int(port))
@@ -1,16 +1,36 @@
-from datetime import timedelta
-import requests
+import asyncio
+import logging
+from datetime import timedelta, timezone
 import os
+import time
+from typing import Optional
+from celery import group
 from dotenv import load_dotenv
 from datetime import datetime
+from db.connection import Session, dispose_engine
+from db.partitions import maintain_partitions
+from db.queries import claim_due_notification_slots, claim_notification_outbox, delete_dispatched_notification_slots, delete_expired_idempotency_keys, insert_notification_slots, select_users_with_notification_window
 from services.celery.celery_config import celery_app
-from services.celery.notification_schedule_helpers import iso_time_to_datetime_with_todays_date, get_random_notification_times
+from services.celery.serializers import from_epoch_seconds, to_epoch_seconds
+from services.celery.notification_schedule_helpers import plan_new_user_slots, plan_notification_slots
 
 load_dotenv()
+logger = logging.getLogger(__name__)
+
+# timeout of the legacy send_notification's request, so a hanging api can't hold it past the task's time limit
+NOTIFY_TIMEOUT_SECONDS = 10
+# time left before the soft time limit when a batch stops starting sends, the last requests are cut short to end by then
+SEND_DEADLINE_MARGIN = 20
+
+# requests and the sender are imported on the first send rather than when beat or a worker loads the tasks
+def get_notification_sender():
+    from services.celery import notification_sender
+    return notification_sender.get_notification_sender()
 
 # sends a notification to the user through Native Notify API
 @celery_app.task(name='services.celery.tasks.send_notification')
 def send_notification(clerk_id: str):
+    import requests
     try:
         response = requests.post('https://app.nativenotify.com/api/indie/notification', 
             json={
@@ -19,95 +39,170 @@ def send_notification(clerk_id: str):
                 'appToken': os.getenv('NATIVE_NOTIFY_TOKEN'),
                 'title': 'How are you feeling?',
                 'message': 'Time to check in on your mood!',
-            }
+            },
+            timeout=NOTIFY_TIMEOUT_SECONDS,
         )
         if response.status_code != 201:
-            print(f'Failed to send notification to {clerk_id}: {response.status_code} - {response.text}')
+            logger.warning('Failed to send notification', extra={'clerk_id': clerk_id, 'status_code': response.status_code, 'response': response.text})
         else:
-            print('Notification sent successfully')
+            logger.debug('Notification sent successfully', extra={'clerk_id': clerk_id, 'sample_rate': 0.01})
     except Exception as e:
-        print(f"Error: {str(e)}")
+        logger.exception('Error sending notification: %s', e, extra={'clerk_id': clerk_id})
         raise e
 
-# schedules notifications for the user at random times during their time range
+# sends a notification to many users at once, reusing the worker's pooled connections
+# scheduled_for is the epoch seconds the slots were due, used to report how late the batch ran
+# sending stops SEND_DEADLINE_MARGIN before the soft time limit, users not tried by then are sent in a new batch
+# rather than the worker killing the task, as their slots are already marked dispatched nothing else would send them
+@celery_app.task(name='services.celery.tasks.send_notification_batch')
+def send_notification_batch(clerk_ids: list[str], scheduled_for: Optional[int] = None):
+    soft_time_limit = send_notification_batch.soft_time_limit or celery_app.conf.task_soft_time_limit
+    deadline = time.monotonic() + soft_time_limit - SEND_DEADLINE_MARGIN if soft_time_limit else None
+    result = get_notification_sender().send_batch(clerk_ids, deadline)
+    if scheduled_for is not None:
+        result['delay_seconds'] = (datetime.now(timezone.utc) - from_epoch_seconds(scheduled_for)).total_seconds()
+    rate = result['sent'] / result['duration_seconds'] if result['duration_seconds'] else 0
+    logger.info("Sent %d/%d notifications in %.2fs (%.1f/s)", result['sent'], len(clerk_ids), result['duration_seconds'], rate,
+                extra={'delay_seconds': result.get('delay_seconds')})
+    if result['failed']:
+        logger.warning("Failed to send notifications to %d users", len(result['failed']), extra={'failed': result['failed']})
+    if result['unsent']:
+        logger.warning("Ran out of time, sending %d notifications in a new batch", len(result['unsent']))
+        send_notification_batch.apply_async((result['unsent'], scheduled_for))
+    return result
+
+# number of due slots claimed from the db at a time by the dispatcher
+DISPATCH_BATCH_SIZE = 1000
+# number of users in each send_notification_batch task, lets several workers share a large claim
+NOTIFICATION_BATCH_SIZE = 250
+# dispatched slots are kept for a week before being cleaned up
+SLOT_RETENTION = timedelta(days=7)
+
+# run a db query from a task, tasks are sync so each call gets its own event loop
+# the engine is disposed afterwards as pooled connections can't be reused across event loops
+def run_query(query, *args):
+    async def run():
+        try:
+            async with Session() as session:
+                return await query(session, *args)
+        finally:
+            await dispose_engine()
+    return asyncio.run(run())
+
+# runs every minute from celery beat, claims the slots that are due and fans the notifications out in bulk
+@celery_app.task(name='services.celery.tasks.dispatch_due_notifications')
+def dispatch_due_notifications():
+    now = datetime.now(timezone.utc)
+    dispatched = 0
+    while True:
+        clerk_ids = run_query(claim_due_notification_slots, now, DISPATCH_BATCH_SIZE)
+        if not clerk_ids:
+            break
+        group(
+            send_notification_batch.s(clerk_ids[i:i + NOTIFICATION_BATCH_SIZE], to_epoch_seconds(now))
+            for i in range(0, len(clerk_ids), NOTIFICATION_BATCH_SIZE)
+        ).apply_async()
+        dispatched += len(clerk_ids)
+        if len(clerk_ids) < DISPATCH_BATCH_SIZE:
+            break
+    logger.info("Dispatched %d notifications due by %s", dispatched, now.strftime('%H:%M:%S'))
+    return dispatched
+
+# runs daily from celery beat, plans tomorrow's notification slots for every user
+# planning is idempotent so it is safe for this to be retried or run more than once
+@celery_app.task(name='services.celery.tasks.plan_daily_notifications')
+def plan_daily_notifications():
+    tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+    users = run_query(select_users_with_notification_window)
+    slots = plan_notification_slots(users, tomorrow)
+    run_query(insert_notification_slots, slots)
+    removed = run_query(delete_dispatched_notification_slots, datetime.now(timezone.utc) - SLOT_RETENTION)
+    logger.info("Planned %d notification slots for %d users on %s, removed %d old slots", len(slots), len(users), tomorrow, removed)
+    return len(slots)
+
+# number of new users planned at a time when draining the outbox
+OUTBOX_BATCH_SIZE = 500
+
+# plan the notifications of users that signed up since the last run
+# the outbox entries are only marked processed when their slots commit with them
+async def process_notification_outbox(session, now: datetime, limit: int) -> int:
+    users = await claim_notification_outbox(session, now, limit)
+    await insert_notification_slots(session, plan_new_user_slots(users, now))
+    await session.commit()
+    return len(users)
+
+# runs every minute from celery beat, drains the outbox written by POST /api/users
+@celery_app.task(name='services.celery.tasks.drain_notification_outbox')
+def drain_notification_outbox():
+    now = datetime.now(timezone.utc)
+    planned = 0
+    while True:
+        processed = run_query(process_notification_outbox, now, OUTBOX_BATCH_SIZE)
+        planned += processed
+        if processed < OUTBOX_BATCH_SIZE:
+            break
+    if planned:
+        logger.info("Planned notifications for %d new users", planned)
+    return planned
+
+# plans the remaining slots for today and tomorrow for a single user, i.e. to replan after a change of window
+@celery_app.task(name='services.celery.tasks.plan_user_notifications')
+def plan_user_notifications(clerk_id: str, start_time: str, end_time: str):
+    user = [(clerk_id, datetime.strptime(start_time, '%H:%M').time(), datetime.strptime(end_time, '%H:%M').time())]
+    slots = plan_new_user_slots(user, datetime.now(timezone.utc))
+    run_query(insert_notification_slots, slots)
+    logger.info("Planned %d notification slots", len(slots), extra={'clerk_id': clerk_id})
+    return len(slots)
+
+# runs daily from celery beat, creates the coming months' readings partitions and archives the ones past retention
+@celery_app.task(name='services.celery.tasks.maintain_reading_partitions')
+def maintain_reading_partitions():
+    result = run_query(maintain_partitions)
+    logger.info("Created %d readings partitions, archived %d", len(result['created']), len(result['archived']),
+                extra={'partitions_created': result['created'], 'partitions_archived': [archive['partition'] for archive in result['archived']]})
+    return result
+
+# idempotency keys of uploaded readings are kept this long, client retries happen within minutes
+IDEMPOTENCY_KEY_RETENTION = timedelta(days=1)
+
+# runs hourly from celery beat, removes the idempotency keys past retention
+@celery_app.task(name='services.celery.tasks.remove_expired_idempotency_keys')
+def remove_expired_idempotency_keys():
+    removed = run_query(delete_expired_idempotency_keys, datetime.now(timezone.utc) - IDEMPOTENCY_KEY_RETENTION)
+    logger.info("Removed %d expired idempotency keys", removed)
+    return removed
+
+# legacy per user scheduling tasks, replaced by the slot dispatcher above
+# kept registered so messages still queued with an eta are acknowledged and dropped rather than rescheduled
+# these were sent pickled with datetimes, drained messages carry epoch seconds instead
 @celery_app.task(name='services.celery.tasks.schedule_notifications')
 def schedule_notifications(clerk_id: str, start_datetime: datetime, end_datetime: datetime):
-    # get 3 new random notification times for the user
-    print(f"Getting random notification times for {clerk_id}")
-    notification_times = get_random_notification_times(start_datetime, end_datetime)
-    print(f"Notification times for {clerk_id}: {notification_times}")
-    # schedule a notification task for each of the random times that day
-    for notification_time in notification_times:
-        send_notification.apply_async(
-            args=[clerk_id], 
-            eta=notification_time,
-            serializer='pickle'
-        )
-        print(f"Scheduled notification for {clerk_id} at {notification_time.strftime('%H:%M:%S')}")
+    logger.info("Dropping legacy schedule_notifications task, notifications are planned by the dispatcher", extra={'clerk_id': clerk_id})
 
-# schedules notifications for the user at random times during their time range, and schedules the task to run again the next day
 @celery_app.task(name='services.celery.tasks.daily_scheduler')
 def daily_scheduler(clerk_id: str, start_datetime: datetime, end_datetime: datetime):
-    print(f"Executing daily_scheduler for {clerk_id} with start_datetime={start_datetime} and end_datetime={end_datetime}")
-    
-    # schedule todays notifications for the user
-    schedule_notifications(clerk_id, start_datetime, end_datetime)
-
-    # add a day to todays times to get tomorrow's times
-    tomorrow_start_time = start_datetime + timedelta(days=1)
-    tomorrow_end_time = end_datetime + timedelta(days=1)
-    
-    # schedule this task to run again at tomorrow's start time
-    daily_scheduler.apply_async(
-        args=[clerk_id, tomorrow_start_time, tomorrow_end_time], 
-        eta=tomorrow_start_time,
-        serializer='pickle'
-    )
-    print(f"Scheduled daily_scheduler for {clerk_id} at {tomorrow_start_time.strftime('%Y-%m-%d %H:%M')}")
-    
-# format the date and start the user notification scheduler    
-def start_user_notification_scheduler(clerk_id: str, start_time: str, end_time: str):
-    try:
-        print(f"Starting user notification scheduler for {clerk_id} with start_time={start_time} and end_time={end_time}")
-        # convert the user's start and end times to datetime objects with today's date
-        start_datetime = iso_time_to_datetime_with_todays_date(start_time)
-        end_datetime = iso_time_to_datetime_with_todays_date(end_time)
-        # start the scheduler for the user
-        daily_scheduler(clerk_id, start_datetime, end_datetime)
-        print(f"Applied daily_scheduler task for {clerk_id}")
-    except Exception as error:
-        print(f"Failed to start user notification scheduler for {clerk_id}: {error}")        
-        
+    logger.info("Dropping legacy daily_scheduler task, notifications are planned by the dispatcher", extra={'clerk_id': clerk_id})
 
 # test functions with worker
 
-def test_schedule_notifications():
-    clerk_id = 'user_2lQF4rzaQnsst56zUbVxfTnHuth' # test user
-    start_datetime = datetime.now()
-    end_datetime = start_datetime + timedelta(hours=8)
-    schedule_notifications(clerk_id, start_datetime, end_datetime)
+def test_dispatch_due_notifications():
+    dispatch_due_notifications()
 
-def test_daily_scheduler():
-    clerk_id = 'user_2lQF4rzaQnsst56zUbVxfTnHuth'
-    start_datetime = datetime.now()
-    end_datetime = start_datetime + timedelta(hours=8)
-    daily_scheduler(clerk_id, start_datetime, end_datetime)
+def test_plan_daily_notifications():
+    plan_daily_notifications()
 
 
 def test_send_notification():
     clerk_id = 'user_2lRbgolJz67jaNXPxu3oaEiCSmA'
     send_notification.apply_async(args=[clerk_id])
 
-def test_start_user_notification_scheduler():
-    clerk_id = 'user_2lQF4rzaQnsst56zUbVxfTnHuth'
-    start_time = '09:00'
-    end_time = '17:00'
-    start_user_notification_scheduler(clerk_id, start_time, end_time)
+def test_drain_notification_outbox():
+    drain_notification_outbox()
 
 if __name__ == "__main__":
-    # uncomment the function you want to test, running test_start_user_notification_scheduler() will run everything, or test each function individually
+    # uncomment the function you want to test
 
     # test_send_notification()
-    # test_schedule_notifications()
-    # test_daily_scheduler()
-    test_start_user_notification_scheduler()
\ No newline at end of file
+    # test_dispatch_due_notifications()
+    # test_plan_daily_notifications()
+    test_drain_notification_outbox()
\ No newline at end of file
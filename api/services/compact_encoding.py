@@ -0,0 +1,36 @@
+from constants.emotion_enum import Emotions
+
+# Compact json for the readings history and the chart series, opt in with ?compact=true
+# emotions are sent as their Emotions value (the same order as the probabilities) and locations as an index into a list sent once,
+# readings are rows under one list of column names so the keys aren't repeated for every reading
+
+READING_COLUMNS = ['id', 'emotion', 'location', 'datetime', 'note']
+
+# labels are capitalised in the database (Happy) and as sent by the app (happy), the code is the same for both
+def emotion_code(label: str) -> int:
+    return Emotions[label.upper()].value
+
+# GET /readings, {"readings": [{...}], "counts": {"Happy": 3, ...}} as
+# {"columns": [...], "locations": ["Home", ...], "readings": [[1, 3, 0, "2024-09-01T12:00", null], ...], "counts": [0, 0, 0, 3, ...]}
+def encode_readings(response: dict) -> dict:
+    locations = {}
+    rows = []
+    for reading in response['readings']:
+        location = reading['location']
+        if location is not None:
+            location = locations.setdefault(location, len(locations))
+        rows.append([reading['id'], emotion_code(reading['emotion']), location, reading['datetime'], reading['note']])
+    counts = [0] * len(Emotions)
+    for label, count in response['counts'].items():
+        counts[emotion_code(label)] = count
+    return {'columns': READING_COLUMNS, 'locations': list(locations), 'readings': rows, 'counts': counts}
+
+# GET /readings/emotion-counts, {"Happy": [{"date": "2024-09-01", "count": 2}, ...], ...} as
+# {"dates": ["2024-09-01", ...], "emotions": [3, ...], "counts": [[2, ...], ...]}, every emotion has a count for the same dates
+def encode_emotion_counts(counts: dict) -> dict:
+    series = list(counts.values())
+    return {
+        'dates': [point['date'] for point in series[0]] if series else [],
+        'emotions': [emotion_code(label) for label in counts],
+        'counts': [[point['count'] for point in points] for points in series],
+    }
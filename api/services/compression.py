@@ -0,0 +1,181 @@
+import gzip
+import importlib.util
+import zlib
+from typing import Optional
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+from services.executors import run_cpu_bound
+from services.metrics import COMPRESSION_BYTES
+
+load_dotenv()
+
+# Negotiated response compression, the client's Accept-Encoding picks zstd, brotli or gzip (in that order when it takes several)
+# brotli and zstd need their packages (pip install brotli zstandard), gzip is always there
+# bodies under the minimum size are sent as they are, large ones are compressed in the cpu pool so the event loop isn't held up,
+# streamed responses (i.e. exports) are compressed a chunk at a time as they're sent
+
+# json and text compress well, the exports that are already compressed (csv.gz, parquet) aren't compressed again
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/vnd.apache.arrow.stream')
+
+# the module each encoding needs, in the order they're preferred
+ENCODING_MODULES = {'zstd': 'zstandard', 'br': 'brotli', 'gzip': 'zlib'}
+DEFAULT_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6}
+
+# COMPRESSION_LEVELS="gzip=6,br=5,zstd=3" -> {'gzip': 6, 'br': 5, 'zstd': 3}, encodings left out keep their default
+def parse_levels(value: str) -> dict[str, int]:
+    levels = {}
+    for entry in value.split(','):
+        if '=' in entry:
+            name, level = entry.split('=', 1)
+            levels[name.strip()] = int(level)
+    return levels
+
+# the encodings set in COMPRESSION_ENCODINGS whose package is installed, in order of preference
+def get_available_encodings(encodings: str) -> list[str]:
+    names = [name.strip() for name in encodings.split(',') if name.strip()]
+    for name in names:
+        if name not in ENCODING_MODULES:
+            raise ValueError(f"Unknown compression encoding: {name} - Expected one of {list(ENCODING_MODULES)}")
+    return [name for name in ENCODING_MODULES if name in names and importlib.util.find_spec(ENCODING_MODULES[name])]
+
+# q values of an Accept-Encoding header, i.e. "gzip, br;q=0.5" is {'gzip': 1.0, 'br': 0.5}
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    weights = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    return weights
+
+# the client's most wanted encoding of those available, ties go to the server's order, None to send it uncompressed
+def choose_encoding(header: str, available: list[str]) -> Optional[str]:
+    weights = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for name in available:
+        q = weights.get(name, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+# compresses a whole body in one go
+def compress(encoding: str, level: int, data: bytes) -> bytes:
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        import brotli
+        return brotli.compress(data, quality=level)
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+# compresses a stream a chunk at a time, compress returns what's ready so far and flush the rest at the end
+class StreamCompressor:
+    def __init__(self, encoding: str, level: int):
+        if encoding == 'gzip':
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self.compress = self.compressor.compress
+            self.flush = self.compressor.flush
+        elif encoding == 'br':
+            import brotli
+            self.compressor = brotli.Compressor(quality=level)
+            self.compress = self.compressor.process
+            self.flush = self.compressor.finish
+        else:
+            import zstandard
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self.compress = self.compressor.compress
+            self.flush = self.compressor.flush
+
+def is_compressible(headers: Headers) -> bool:
+    content_type = headers.get('content-type', '')
+    return 'content-encoding' not in headers and content_type.startswith(COMPRESSIBLE_TYPES)
+
+# pure asgi middleware so streamed responses are compressed as they go rather than collected first
+class CompressionMiddleware:
+    def __init__(self, app, encodings: str = 'zstd,br,gzip', minimum_size: int = 1024, offload_size: int = 65536, levels: dict = None):
+        self.app = app
+        self.encodings = get_available_encodings(encodings)
+        self.minimum_size = minimum_size
+        self.offload_size = offload_size
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''), self.encodings)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        responder = CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send_compressed)
+
+    # a large body takes a few ms of cpu to compress, it's done in the cpu pool (the compressors release the gil) so other requests carry on
+    async def run(self, func, data: bytes) -> bytes:
+        if len(data) >= self.offload_size:
+            return await run_cpu_bound(func, data)
+        return func(data)
+
+# the state of one response, the start message is held back until the first body shows whether to compress it
+class CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.level = middleware.levels[encoding]
+        self.send = send
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send_compressed(self, message):
+        if message['type'] == 'http.response.start':
+            self.start_message = message
+            return
+        if message['type'] != 'http.response.body' or self.passthrough:
+            return await self.send(message)
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            start_message, self.start_message = self.start_message, None
+            headers = MutableHeaders(scope=start_message)
+            if not is_compressible(headers):
+                self.passthrough = True
+                await self.send(start_message)
+                return await self.send(message)
+            headers.add_vary_header('Accept-Encoding')
+            if not more_body:
+                # the whole body in one message, compressed in one go when it's big enough to be worth it
+                if len(body) < self.middleware.minimum_size:
+                    self.passthrough = True
+                    await self.send(start_message)
+                    return await self.send(message)
+                compressed = await self.middleware.run(lambda data: compress(self.encoding, self.level, data), body)
+                self.count(body, compressed)
+                headers['Content-Encoding'] = self.encoding
+                headers['Content-Length'] = str(len(compressed))
+                await self.send(start_message)
+                return await self.send({'type': 'http.response.body', 'body': compressed})
+            # streamed, the length isn't known any more
+            self.compressor = StreamCompressor(self.encoding, self.level)
+            headers['Content-Encoding'] = self.encoding
+            del headers['Content-Length']
+            await self.send(start_message)
+
+        compressed = await self.middleware.run(self.compressor.compress, body) if body else b''
+        if not more_body:
+            compressed += self.compressor.flush()
+        self.count(body, compressed)
+        if compressed or not more_body:
+            await self.send({'type': 'http.response.body', 'body': compressed, 'more_body': more_body})
+
+    def count(self, body: bytes, compressed: bytes):
+        COMPRESSION_BYTES.labels(encoding=self.encoding, stage='original').inc(len(body))
+        COMPRESSION_BYTES.labels(encoding=self.encoding, stage='compressed').inc(len(compressed))
@@ -0,0 +1,66 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Named thread pools for running sync work from async endpoints without blocking the event loop
+# cpu - token verification, image preprocessing, rendering large responses (opencv and the jwt signature check release the gil for most of it,
+#       json rendering holds it, so a large response keeps the event loop free of the call but still competes with it for the gil)
+# io - blocking network calls such as the TensorFlow Serving request
+# shadow - copies of predictions sent to a candidate model, kept apart so they never hold up the io pool
+
+CPU_POOL = 'cpu'
+IO_POOL = 'io'
+SHADOW_POOL = 'shadow'
+
+POOL_SIZES = {
+    CPU_POOL: int(os.getenv('CPU_POOL_SIZE', os.cpu_count() or 1)),
+    IO_POOL: int(os.getenv('IO_POOL_SIZE', 32)),
+    SHADOW_POOL: int(os.getenv('SHADOW_POOL_SIZE', 4)),
+}
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+
+# get a pool by name, pools are created on first use
+def get_executor(name: str) -> ThreadPoolExecutor:
+    if name not in POOL_SIZES:
+        raise ValueError(f"Unknown executor: {name} - Expected one of {list(POOL_SIZES)}")
+    if name not in _executors:
+        _executors[name] = ThreadPoolExecutor(max_workers=POOL_SIZES[name], thread_name_prefix=f"{name}-pool")
+    return _executors[name]
+
+# the caller's context is copied into the pool thread so logs keep their request id
+async def run_in_pool(name: str, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(name), functools.partial(context.run, func, *args, **kwargs))
+
+async def run_cpu_bound(func, *args, **kwargs):
+    return await run_in_pool(CPU_POOL, func, *args, **kwargs)
+
+async def run_io_bound(func, *args, **kwargs):
+    return await run_in_pool(IO_POOL, func, *args, **kwargs)
+
+# run func once in every thread of a pool, used to preload per thread state on startup
+# each call waits at a barrier until all the pool's threads have one, so no thread runs two, or gives up after timeout when some are busy
+def run_in_every_thread(name: str, func, timeout: float = 30) -> list:
+    executor = get_executor(name)
+    barrier = threading.Barrier(POOL_SIZES[name])
+
+    def run():
+        barrier.wait(timeout)
+        return func()
+
+    futures = [executor.submit(run) for _ in range(POOL_SIZES[name])]
+    return [future.result() for future in futures]
+
+# called on app shutdown, pools are recreated if used again
+def shutdown_executors(wait: bool = True):
+    for executor in _executors.values():
+        executor.shutdown(wait=wait)
+    _executors.clear()
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import os
+from dotenv import load_dotenv
+from constants.emotion_enum import Emotions
+from services.executors import run_cpu_bound
+
+load_dotenv()
+
+# Exports of complete mood histories, streamed from a server side cursor and encoded a batch at a time
+# so memory stays bounded by the batch size rather than the number of readings:
+#   csv.gz  - gzipped csv, the probabilities as one column per emotion
+#   parquet - columnar, a row group per batch, zstd compressed
+#   arrow   - arrow ipc stream, a record batch per batch
+# parquet and arrow need pyarrow, which is only imported when they're used
+# users export their own history from GET /api/readings/export, every user's is exported from the command line:
+#   python -m services.export_readings --output readings.parquet [--clerk-id <id>] [--format parquet]
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 50_000))
+
+EMOTION_LABELS = [str(emotion) for emotion in Emotions]
+
+# collects what a writer writes until it's taken, the writers encode into it and each chunk is sent on
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ReadingsWriter:
+    name = None
+    media_type = None
+    extension = None
+
+    # encode a batch of rows from select_readings_for_export, returns the bytes ready to send
+    def write(self, rows: list) -> bytes:
+        raise NotImplementedError
+
+    # finish the file, returns the last bytes
+    def close(self) -> bytes:
+        raise NotImplementedError
+
+# the probabilities are stored as REAL, 6 significant figures is all the precision they have
+# and writing the shortest repr of the double they're read back as would nearly double the size of the csv
+def format_float(value: float) -> str:
+    return None if value is None else f'{value:.6g}'
+
+class CsvGzipWriter(ReadingsWriter):
+    name = 'csv.gz'
+    media_type = 'application/gzip'
+    extension = 'csv.gz'
+
+    def __init__(self, compress_level: int = 6):
+        self.sink = ChunkSink()
+        self.file = gzip.GzipFile(fileobj=self.sink, mode='wb', compresslevel=compress_level)
+        self.write_header = True
+
+    def encode(self, rows: list) -> bytes:
+        text = io.StringIO()
+        writer = csv.writer(text)
+        if self.write_header:
+            writer.writerow(['reading_id', 'clerk_id', 'datetime', 'emotion', 'location', 'note', 'confidence', *EMOTION_LABELS])
+            self.write_header = False
+        writer.writerows(
+            [
+                row.reading_id, row.clerk_id, row.datetime.isoformat(), row.emotion, row.location, row.note, format_float(row.confidence),
+                *(map(format_float, row.probabilities) if row.probabilities else [None] * len(EMOTION_LABELS)),
+            ]
+            for row in rows
+        )
+        return text.getvalue().encode()
+
+    def write(self, rows: list) -> bytes:
+        self.file.write(self.encode(rows))
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        # an export without any readings still gets the header
+        if self.write_header:
+            self.file.write(self.encode([]))
+        self.file.close()
+        return self.sink.take()
+
+# columns shared by the arrow and parquet writers, the probabilities are a fixed size list in Emotions order
+# and the emotion is dictionary encoded against every label so each batch has the same dictionary
+class ArrowBatchWriter(ReadingsWriter):
+    def __init__(self):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.emotions = pa.array(EMOTION_LABELS)
+        self.emotion_index = {label: index for index, label in enumerate(EMOTION_LABELS)}
+        self.schema = pa.schema([
+            ('reading_id', pa.int64()),
+            ('clerk_id', pa.string()),
+            ('datetime', pa.timestamp('us', tz='UTC')),
+            ('emotion', pa.dictionary(pa.int8(), pa.string())),
+            ('location', pa.string()),
+            ('note', pa.string()),
+            ('confidence', pa.float32()),
+            ('probabilities', pa.list_(pa.float32(), len(EMOTION_LABELS))),
+        ])
+        self.sink = ChunkSink()
+
+    def to_record_batch(self, rows: list):
+        pa = self.pa
+        emotions = pa.array([self.emotion_index[row.emotion] for row in rows], type=pa.int8())
+        return pa.record_batch([
+            pa.array([row.reading_id for row in rows], type=pa.int64()),
+            pa.array([row.clerk_id for row in rows], type=pa.string()),
+            pa.array([row.datetime for row in rows], type=self.schema.field('datetime').type),
+            pa.DictionaryArray.from_arrays(emotions, self.emotions),
+            pa.array([row.location for row in rows], type=pa.string()),
+            pa.array([row.note for row in rows], type=pa.string()),
+            pa.array([row.confidence for row in rows], type=pa.float32()),
+            pa.array([row.probabilities for row in rows], type=self.schema.field('probabilities').type),
+        ], schema=self.schema)
+
+class ArrowWriter(ArrowBatchWriter):
+    name = 'arrow'
+    media_type = 'application/vnd.apache.arrow.stream'
+    extension = 'arrows'
+
+    def __init__(self):
+        super().__init__()
+        self.writer = self.pa.ipc.new_stream(self.sink, self.schema)
+
+    def write(self, rows: list) -> bytes:
+        if rows:
+            self.writer.write_batch(self.to_record_batch(rows))
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.take()
+
+class ParquetWriter(ArrowBatchWriter):
+    name = 'parquet'
+    media_type = 'application/vnd.apache.parquet'
+    extension = 'parquet'
+
+    def __init__(self, compression: str = 'zstd'):
+        import pyarrow.parquet as pq
+
+        super().__init__()
+        self.writer = pq.ParquetWriter(self.sink, self.schema, compression=compression)
+
+    def write(self, rows: list) -> bytes:
+        if rows:
+            self.writer.write_batch(self.to_record_batch(rows))
+        return self.sink.take()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.take()
+
+WRITERS = {
+    CsvGzipWriter.name: CsvGzipWriter,
+    ParquetWriter.name: ParquetWriter,
+    ArrowWriter.name: ArrowWriter,
+}
+
+# formats that can be written here, parquet and arrow are left out when pyarrow isn't installed
+def get_available_formats() -> list[str]:
+    try:
+        import pyarrow # noqa: F401
+    except ImportError:
+        return [CsvGzipWriter.name]
+    return list(WRITERS)
+
+def create_writer(name: str) -> ReadingsWriter:
+    if name not in WRITERS:
+        raise ValueError(f"Unknown export format: {name} - Expected one of {list(WRITERS)}")
+    if name not in get_available_formats():
+        raise ValueError(f"Export format {name} needs pyarrow - Install it or use {CsvGzipWriter.name}")
+    return WRITERS[name]()
+
+# the export as chunks of bytes, each batch is encoded in the cpu pool so the event loop keeps serving requests
+# the next batch is only fetched once the last chunk has been taken, so a slow client holds back the cursor
+async def stream_export(session_factory, writer: ReadingsWriter, clerk_id: str = None, batch_size: int = EXPORT_BATCH_SIZE):
+    from db.queries import stream_readings_for_export
+
+    async with session_factory() as session:
+        async for rows in stream_readings_for_export(session, clerk_id, batch_size):
+            chunk = await run_cpu_bound(writer.write, rows)
+            if chunk:
+                yield chunk
+    yield await run_cpu_bound(writer.close)
+
+async def export_to_file(output: str, name: str, clerk_id: str = None, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    from db.connection import Session, dispose_engine
+
+    size = 0
+    try:
+        with open(output, 'wb') as file:
+            async for chunk in stream_export(Session, create_writer(name), clerk_id, batch_size):
+                size += file.write(chunk)
+    finally:
+        await dispose_engine()
+    return size
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export readings to parquet, arrow or gzipped csv")
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--format', choices=list(WRITERS), default=ParquetWriter.name)
+    parser.add_argument('--clerk-id', help="only export this user's readings, defaults to every user")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    size = asyncio.run(export_to_file(args.output, args.format, args.clerk_id, args.batch_size))
+    print(f"Exported {size / 1e6:.1f} MB to {args.output}")
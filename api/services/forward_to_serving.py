@@ -1,38 +1,120 @@
 from fastapi.responses import JSONResponse
+import logging
 import requests
 import os
 import numpy as np
+from typing import Optional
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from constants.emotion_enum import Emotions
+from services.executors import IO_POOL, POOL_SIZES
+from services.metrics import MODEL_PREDICTIONS, SERVING_REQUEST_SECONDS
+from services.model_routing import get_predict_url
 
 load_dotenv()
- 
-def forward_to_serving(image_data: np.ndarray) -> dict:
+logger = logging.getLogger(__name__)
+
+_serving_session = None
+
+# one pooled session for every request to serving so connections are kept alive between predictions
+# sized to the io pool the requests are made from, created by the warm up or the first prediction
+def get_serving_session() -> requests.Session:
+    global _serving_session
+    if _serving_session is None:
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZES[IO_POOL]))
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZES[IO_POOL]))
+        _serving_session = session
+    return _serving_session
+
+# close the pooled connections on shutdown
+def close_serving_session():
+    global _serving_session
+    if _serving_session is not None:
+        _serving_session.close()
+        _serving_session = None
+
+# model status endpoint, MODEL_PREDICT_URL is .../v1/models/<name>:predict and the status is .../v1/models/<name>
+def get_model_status_url() -> str:
+    return os.getenv("MODEL_STATUS_URL") or os.getenv("MODEL_PREDICT_URL", "").removesuffix(":predict")
+
+# check a preprocessed image can be sent to the model
+def check_shape(image_data: np.ndarray):
+    # Do not proceed if the image shape is not (48, 48, 1)
+    if image_data.shape != (48, 48, 1):
+        raise ValueError(f"Unexpected image shape: {image_data.shape} - Expected: (48, 48, 1)")
+
+# the body of a predict request to serving
+def serving_payload(images: list[np.ndarray]) -> dict:
+    return {"instances": [{"input_layer_1": image.tolist()} for image in images]} # must match the input layer name in the model and must be a list
+
+# one request to serving for any number of images, returns the softmax for each as an (n, 7) array
+# with a model version the request goes to that version (see model_routing.py), otherwise to MODEL_PREDICT_URL
+def request_predictions(images: list[np.ndarray], model_version: Optional[str] = None) -> np.ndarray:
+    with SERVING_REQUEST_SECONDS.labels(stage='serialize').time():
+        payload = serving_payload(images)
+    MODEL_PREDICTIONS.labels(model_version=model_version or 'default').inc(len(images))
+    with SERVING_REQUEST_SECONDS.labels(stage='round_trip').time():
+        response = get_serving_session().post(
+            get_predict_url(model_version), # this is the url the docker container is running on
+            json=payload,
+        )
+    with SERVING_REQUEST_SECONDS.labels(stage='parse').time():
+        return np.asarray(response.json()["predictions"], dtype=np.float64)
+
+def forward_to_serving(image_data: np.ndarray, model_version: Optional[str] = None) -> dict:
     """
     Forwards image data to TensorFlow Serving, running in a Docker container
     
     Parameters:
     imageData (np.ndarray): NumPy array of the image data
+    model_version (Optional[str]): The model version to predict with, or None for MODEL_PREDICT_URL
     
     Returns:
-    dict: A dictionary containing 'prediction' (string) and 'confidence' (float)
+    dict: A dictionary containing 'prediction' (string), 'confidence' (float), 'probabilities' (list of 7 floats, in Emotions order)
+    and 'model_version' (the version that made the prediction, or None)
     
     Raises:
     ValueError: If the image shape is not (48, 48, 1)
     """    
-    # Do not proceed if the image shape is not (48, 48, 1)
-    if image_data.shape != (48, 48, 1):
-        raise ValueError(f"Unexpected image shape: {image_data.shape} - Expected: (48, 48, 1)")   
+    check_shape(image_data)
     try:
-        response = requests.post(
-            os.getenv("MODEL_PREDICT_URL"), # this is the url the docker container is running on
-            json={"instances": [{"input_layer_1": image_data.tolist()}]}, # must match the input layer name in the model and must be a list
-        )             
-        prediction = response.json()
-        most_likely_emotion_index = int(np.argmax(prediction["predictions"][0])) # get the index of the highest confidence - maps to Emotion enum
-        confidence = prediction["predictions"][0][most_likely_emotion_index]        
+        predictions = request_predictions([image_data], model_version)
+        most_likely_emotion_index = int(np.argmax(predictions[0])) # get the index of the highest confidence - maps to Emotion enum
+        confidence = float(predictions[0][most_likely_emotion_index])
                 
-        return {"prediction": Emotions(most_likely_emotion_index).name, "confidence": confidence}
+        # serving already returns every emotion's probability, they're kept in Emotions order rather than a dict of labels
+        return {
+            "prediction": Emotions(most_likely_emotion_index).name,
+            "confidence": confidence,
+            "probabilities": predictions[0].tolist(),
+            "model_version": model_version,
+        }
+
+    except Exception as error:
+        logger.exception("Error in forward to serving: %s", error)
+
+def forward_batch_to_serving(images: list[np.ndarray], model_version: Optional[str] = None) -> np.ndarray:
+    """
+    Forwards several images to TensorFlow Serving in a single request, i.e. the frames of a burst
+    
+    Parameters:
+    images (list[np.ndarray]): NumPy arrays of the image data
+    model_version (Optional[str]): The model version to predict with, or None for MODEL_PREDICT_URL
+    
+    Returns:
+    np.ndarray: The softmax for each image as an (n, 7) array, in the order given, or None if the request failed
+    
+    Raises:
+    ValueError: If an image shape is not (48, 48, 1)
+    """
+    for image_data in images:
+        check_shape(image_data)
+    try:
+        predictions = request_predictions(images, model_version)
+        if predictions.shape != (len(images), len(Emotions)):
+            raise ValueError(f"Unexpected predictions shape: {predictions.shape} - Expected: ({len(images)}, {len(Emotions)})")
+        return predictions
 
     except Exception as error:
-        print("Error in Forward to Serving: ", error)
+        logger.exception("Error in forward batch to serving: %s", error)
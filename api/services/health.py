@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from sqlalchemy.sql import text
+from db.connection import ReplicaSession, Session, get_replica_database_url
+from services.executors import CPU_POOL, run_in_every_thread, run_io_bound
+from services.metrics import DEPENDENCY_UP
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Startup warm up and dependency health for the /healthz and /readyz probes
+# on startup the face detector is loaded in every cpu pool thread, a database connection is opened and a dummy
+# prediction is sent to serving, so the first real requests don't pay for any of it
+# the database and serving are then checked every HEALTH_CHECK_INTERVAL seconds in the background, and the face detector until it has loaded,
+# probes only read the last results so they stay cheap however often they're called
+# opencv, numpy and requests are imported by the warm up in the background, not when the app is imported
+
+DATABASE = 'database'
+SERVING = 'serving'
+FACE_DETECTOR = 'face_detector'
+
+# last known state of each dependency
+class DependencyHealth:
+    def __init__(self, dependencies: list[str]):
+        self.dependencies = {
+            name: {'ok': False, 'checked_at': None, 'latency_ms': None, 'error': 'Not checked yet'}
+            for name in dependencies
+        }
+        self.warmed_up = False
+
+    def record(self, name: str, ok: bool, latency: float, error: str = None):
+        self.dependencies[name] = {'ok': ok, 'checked_at': time.time(), 'latency_ms': latency * 1000, 'error': error}
+        DEPENDENCY_UP.labels(dependency=name).set(1 if ok else 0)
+
+    # ready for traffic once warmed up and every dependency passed its last check
+    def is_ready(self) -> bool:
+        return self.warmed_up and all(state['ok'] for state in self.dependencies.values())
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {
+            'ready': self.is_ready(),
+            'warmed_up': self.warmed_up,
+            'dependencies': {
+                name: {**state, 'age_seconds': None if state['checked_at'] is None else now - state['checked_at']}
+                for name, state in self.dependencies.items()
+            },
+        }
+
+# the read replica is checked too when one is configured, the readings history and charts are read from it
+async def check_database():
+    async with Session() as session:
+        await session.execute(text('SELECT 1'))
+    if get_replica_database_url() is not None:
+        async with ReplicaSession() as session:
+            await session.execute(text('SELECT 1'))
+
+# serving answers the status request before the model is loaded, so check a version is AVAILABLE too
+def check_serving():
+    from services.forward_to_serving import get_model_status_url, get_serving_session
+    response = get_serving_session().get(get_model_status_url(), timeout=2)
+    response.raise_for_status()
+    states = [version['state'] for version in response.json().get('model_version_status', [])]
+    if 'AVAILABLE' not in states:
+        raise RuntimeError(f"No model version available: {states}")
+
+# load the configured face detector in the calling thread and run a detection so opencv's own lazy setup happens now too
+def warm_face_detector():
+    import numpy as np
+    from preprocessing.faceDetectors import get_face_detector
+    get_face_detector().detect(np.zeros((120, 120), dtype=np.uint8))
+
+# a prediction for a blank image, the first request to serving is slow while the model warms its own caches
+def warm_serving():
+    import numpy as np
+    from services.forward_to_serving import forward_to_serving
+    check_serving()
+    if forward_to_serving(np.zeros((48, 48, 1), dtype=np.uint8)) is None:
+        raise RuntimeError("Dummy prediction failed")
+
+class HealthChecker:
+    def __init__(self, interval: float = 10, timeout: float = 5):
+        self.interval = interval
+        self.timeout = timeout
+        self.health = DependencyHealth([DATABASE, SERVING, FACE_DETECTOR])
+        self.task = None
+        self.face_detector_round = None
+
+    # run a check and record the result, a check that takes longer than timeout fails
+    async def check(self, name: str, check) -> bool:
+        started_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if self.health.dependencies[name]['ok'] or self.health.dependencies[name]['checked_at'] is None:
+                logger.warning("Health check failed for %s: %s", name, error, extra={'dependency': name})
+            self.health.record(name, False, time.perf_counter() - started_at, error)
+            return False
+        if not self.health.dependencies[name]['ok'] and self.health.dependencies[name]['checked_at'] is not None:
+            logger.info("Health check recovered for %s", name, extra={'dependency': name})
+        self.health.record(name, True, time.perf_counter() - started_at)
+        return True
+
+    # loads the detector in every cpu thread, the calls wait on each other at a barrier so busy threads can hold it past the timeout
+    # the timeout only stops waiting for it, the round carries on in the pools, so a new one isn't started until it has finished
+    # (each round takes a cpu thread from every request it's queued behind) and its barrier gives up after the check's timeout
+    async def check_face_detector(self) -> bool:
+        if self.face_detector_round is None or self.face_detector_round.done():
+            self.face_detector_round = asyncio.ensure_future(run_io_bound(run_in_every_thread, CPU_POOL, warm_face_detector, self.timeout))
+            # a round that fails after its check timed out is picked up by the next check, not logged as never retrieved
+            self.face_detector_round.add_done_callback(lambda round: round.cancelled() or round.exception())
+        face_detector_round = self.face_detector_round
+        return await self.check(FACE_DETECTOR, lambda: asyncio.shield(face_detector_round))
+
+    async def warm_up(self):
+        started_at = time.perf_counter()
+        await asyncio.gather(
+            self.check_face_detector(),
+            self.check(DATABASE, check_database),
+            self.check(SERVING, lambda: run_io_bound(warm_serving)),
+        )
+        self.health.warmed_up = True
+        logger.info("Warm up finished in %.0fms", (time.perf_counter() - started_at) * 1000, extra=self.health.snapshot())
+
+    # once loaded the face detector stays loaded, it's only tried again until it has loaded in every thread
+    async def check_all(self):
+        checks = [
+            self.check(DATABASE, check_database),
+            self.check(SERVING, lambda: run_io_bound(check_serving)),
+        ]
+        if not self.health.dependencies[FACE_DETECTOR]['ok']:
+            checks.append(self.check_face_detector())
+        await asyncio.gather(*checks)
+
+    async def run(self):
+        await self.warm_up()
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check_all()
+
+    # warm up runs in the background, /readyz reports not ready until it finishes
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+health_checker = HealthChecker(
+    interval=float(os.getenv('HEALTH_CHECK_INTERVAL', 10)),
+    timeout=float(os.getenv('HEALTH_CHECK_TIMEOUT', 5)),
+)
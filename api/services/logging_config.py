@@ -0,0 +1,152 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Structured json logging for the api and celery workers
+# records are put on a queue by the calling thread and written to stdout by a background listener,
+# so logging on a hot path never waits on the stream
+# every record carries the request id (api) or task id (celery) of the work it was logged from
+# high volume messages can be sampled with extra={'sample_rate': 0.01}
+# levels can be set per module with LOG_LEVELS="services.celery=DEBUG,db=WARNING" or at runtime with set_log_level
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+task_id_var = contextvars.ContextVar('task_id', default=None)
+
+# attributes every LogRecord has, anything else was passed in extra and is included in the output
+RESERVED_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'request_id', 'task_id', 'sample_rate'}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in ('request_id', 'task_id'):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+# adds the correlation ids to the record in the thread that logged it, before it is queued
+class CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.task_id = task_id_var.get()
+        return True
+
+# keeps a record with probability sample_rate when one is given in extra, everything else is kept
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample_rate = getattr(record, 'sample_rate', None)
+        if sample_rate is None or record.levelno >= logging.ERROR:
+            return True
+        return random.random() < sample_rate
+
+# the stdlib QueueHandler flattens the record into a preformatted string, keep the fields for the json formatter instead
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_listener = None
+
+# parse LOG_LEVELS into {logger name: level}
+def parse_log_levels(value: str) -> dict[str, str]:
+    levels = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def set_log_level(logger_name: str, level: str):
+    logging.getLogger(logger_name or None).setLevel(level.upper())
+
+def get_log_levels() -> dict[str, str]:
+    levels = {'root': logging.getLevelName(logging.getLogger().level)}
+    for name, logger in logging.root.manager.loggerDict.items():
+        if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(logger.level)
+    return levels
+
+# set up the queue handler on the root logger, safe to call more than once
+def configure_logging(level: str = None, stream=None):
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    output_handler = logging.StreamHandler(stream or sys.stdout)
+    output_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+    for logger_name, logger_level in parse_log_levels(os.getenv('LOG_LEVELS', '')).items():
+        set_log_level(logger_name, logger_level)
+
+# a forked process (the celery prefork children) inherits the listener but not its thread, so nothing would drain the queue
+# it's dropped without stopping it (its thread isn't in this process) and logging set up again with a queue of its own
+def configure_logging_after_fork(level: str = None, stream=None):
+    global _listener
+    _listener = None
+    configure_logging(level, stream)
+
+# flush anything still queued, called at exit
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+# pure asgi middleware, takes the request id from X-Request-ID or makes one and returns it on the response
+class RequestIdMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request_id = next((value.decode() for name, value in scope['headers'] if name == b'x-request-id'), None) or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + [(b'x-request-id', request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import os
+from dotenv import load_dotenv
+from services.metrics import EVENT_LOOP_LAG_SECONDS
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Reports when the event loop is blocked, a sleep that wakes up late means something ran on the loop for that long
+# set LOOP_DEBUG=1 to also have asyncio name the slow callbacks (adds overhead, for debugging only)
+
+class EventLoopLagMonitor:
+    def __init__(self, interval: float = 0.5, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started_at = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - started_at - self.interval
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            EVENT_LOOP_LAG_SECONDS.set(lag)
+            if lag > self.threshold:
+                self.blocked_count += 1
+                logger.warning("Event loop blocked for %.0fms", lag * 1000, extra={'lag_ms': lag * 1000, 'threshold_ms': self.threshold * 1000})
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if os.getenv('LOOP_DEBUG') == '1':
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold
+        self.task = loop.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+loop_monitor = EventLoopLagMonitor(
+    interval=float(os.getenv('LOOP_LAG_INTERVAL_MS', 500)) / 1000,
+    threshold=float(os.getenv('LOOP_LAG_THRESHOLD_MS', 100)) / 1000,
+)
@@ -0,0 +1,139 @@
+import functools
+import inspect
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Prometheus metrics, served from /metrics by the api
+# labels are only ever set from fixed names in code (stages, query functions, task names) so cardinality stays bounded
+
+# preprocessing stages are fast, buckets go from 0.5ms up to the worst case for a large photo
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+PREPROCESS_STAGE_SECONDS = Histogram(
+    'preprocess_stage_seconds',
+    'Time spent in each stage of image preprocessing',
+    ['stage'], # base64_decode, imdecode, greyscale, detector_load, detect_faces, resize, quality_gate (the crop is a slice of the image, there's nothing to time)
+    buckets=STAGE_BUCKETS,
+)
+
+SERVING_REQUEST_SECONDS = Histogram(
+    'serving_request_seconds',
+    'Time spent forwarding an image to TensorFlow Serving',
+    ['stage'], # serialize, round_trip, parse
+    buckets=REQUEST_BUCKETS,
+)
+
+# model versions are only those configured in MODEL_VERSIONS and MODEL_SHADOW_VERSION
+MODEL_PREDICTIONS = Counter(
+    'model_predictions_total',
+    'Images predicted by each model version',
+    ['model_version'], # default when no versions are configured
+)
+
+SHADOW_PREDICTIONS = Counter(
+    'shadow_predictions_total',
+    'Images sent to the shadow model version and whether it agreed with the version that answered',
+    ['model_version', 'result'], # agree, disagree, error, dropped
+)
+
+SHADOW_REQUEST_SECONDS = Histogram(
+    'shadow_request_seconds',
+    'Time spent on each request to the shadow model version',
+    ['model_version'],
+    buckets=REQUEST_BUCKETS,
+)
+
+DETECTION_CACHE_REQUESTS = Counter(
+    'detection_cache_requests_total',
+    'Face detection cache lookups',
+    ['result'], # hit, miss
+)
+
+# every check runs on every frame, so fail / (pass + fail) is the rate each threshold is hit
+PREPROCESS_QUALITY_CHECKS = Counter(
+    'preprocess_quality_checks_total',
+    'Results of the quality checks on each detected face',
+    ['check', 'result'], # face_size, face_ratio, brightness, sharpness / pass, fail
+)
+
+# admission control for /api/predict and /api/predict/burst, see admission.py
+ADMISSION_REQUESTS = Counter(
+    'admission_requests_total',
+    'Predictions admitted straight away, after queueing, or rejected with a 503',
+    ['result'], # admitted, queued, queue_full, deadline, timeout
+)
+
+ADMISSION_QUEUE_SECONDS = Histogram(
+    'admission_queue_seconds',
+    'Time predictions spent queued for admission',
+    buckets=REQUEST_BUCKETS,
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    'admission_in_flight',
+    'Predictions running in this worker',
+)
+
+ADMISSION_LIMIT = Gauge(
+    'admission_limit',
+    'Most predictions this worker runs at once, changes with ADMISSION_ADAPTIVE',
+)
+
+COMPRESSION_BYTES = Counter(
+    'compression_bytes_total',
+    'Response bytes before and after compression',
+    ['encoding', 'stage'], # zstd, br, gzip / original, compressed
+)
+
+DB_QUERY_SECONDS = Histogram(
+    'db_query_seconds',
+    'Time spent in each query function in db/queries.py',
+    ['query'],
+    buckets=REQUEST_BUCKETS,
+)
+
+CELERY_TASK_SECONDS = Histogram(
+    'celery_task_seconds',
+    'Time spent running each celery task',
+    ['task', 'state'],
+    buckets=TASK_BUCKETS,
+)
+
+EVENT_LOOP_LAG_SECONDS = Gauge(
+    'event_loop_lag_seconds',
+    'Most recent event loop lag measured by the loop monitor',
+)
+
+DEPENDENCY_UP = Gauge(
+    'dependency_up',
+    'Result of the most recent health check of each dependency, 1 if it passed',
+    ['dependency'], # database, serving, face_detector
+)
+
+# time a query function, the function name is used as the label
+def timed_query(func):
+    histogram = DB_QUERY_SECONDS.labels(query=func.__name__)
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started_at)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started_at)
+    return wrapper
+
+# the body and content type of the /metrics response
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
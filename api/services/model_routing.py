@@ -0,0 +1,128 @@
+import contextvars
+import logging
+import os
+import random
+import threading
+from typing import Optional
+import numpy as np
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from services.executors import POOL_SIZES, SHADOW_POOL, get_executor
+from services.metrics import SHADOW_PREDICTIONS, SHADOW_REQUEST_SECONDS
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+# TensorFlow Serving can serve several versions of the model side by side, this picks the one that answers each prediction
+# MODEL_VERSIONS lists them with their share of the traffic, i.e. "1=90,2=10", names are serving version numbers or version labels
+# the version is returned with the prediction and saved on the reading, so is_accurate can be compared between versions
+# MODEL_SHADOW_VERSION is sent a copy of MODEL_SHADOW_RATE of the predictions in the background, its answer is never returned,
+# only whether it agreed with the version that answered is counted
+
+# most shadow requests waiting or running at once, copies past this are dropped rather than queued
+SHADOW_MAX_PENDING = int(os.getenv('MODEL_SHADOW_MAX_PENDING', 32))
+SHADOW_TIMEOUT_SECONDS = float(os.getenv('MODEL_SHADOW_TIMEOUT', 5))
+
+_shadow_pending = 0
+_shadow_lock = threading.Lock()
+_shadow_session = None
+
+# the configured versions and their weights, empty when predictions go to MODEL_PREDICT_URL as it is
+def get_model_versions() -> dict[str, float]:
+    versions = {}
+    for entry in os.getenv('MODEL_VERSIONS', '').split(','):
+        if not entry.strip():
+            continue
+        name, _, weight = entry.partition('=')
+        versions[name.strip()] = float(weight) if weight.strip() else 1.0
+        if versions[name.strip()] < 0:
+            raise ValueError(f"Invalid MODEL_VERSIONS weight for {name.strip()}: {weight}")
+    return versions
+
+# pick the version for a prediction by weight, None when no versions are configured
+def choose_model_version() -> Optional[str]:
+    versions = get_model_versions()
+    if not versions:
+        return None
+    return random.choices(list(versions), weights=list(versions.values()))[0]
+
+# the predict url of a version, MODEL_PREDICT_URL is .../v1/models/<name>:predict
+def get_predict_url(model_version: Optional[str] = None) -> str:
+    url = os.getenv("MODEL_PREDICT_URL")
+    if model_version is None:
+        return url
+    path = 'versions' if model_version.isdigit() else 'labels'
+    return f"{url.removesuffix(':predict')}/{path}/{model_version}:predict"
+
+# its own session so shadow requests don't take connections from the predictions being answered
+def get_shadow_session() -> requests.Session:
+    global _shadow_session
+    if _shadow_session is None:
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZES[SHADOW_POOL]))
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZES[SHADOW_POOL]))
+        _shadow_session = session
+    return _shadow_session
+
+# close the shadow session's connections on shutdown
+def close_shadow_session():
+    global _shadow_session
+    if _shadow_session is not None:
+        _shadow_session.close()
+        _shadow_session = None
+
+# send the images to the shadow version and count how many of its predictions agree with the answered ones
+def run_shadow(model_version: str, images: list[np.ndarray], predictions: np.ndarray):
+    from services.forward_to_serving import serving_payload
+
+    global _shadow_pending
+    try:
+        with SHADOW_REQUEST_SECONDS.labels(model_version=model_version).time():
+            response = get_shadow_session().post(
+                get_predict_url(model_version), json=serving_payload(images), timeout=SHADOW_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+            shadow_predictions = np.asarray(response.json()["predictions"], dtype=np.float64)
+        if shadow_predictions.shape != predictions.shape:
+            raise ValueError(f"Unexpected shadow predictions shape: {shadow_predictions.shape} - Expected: {predictions.shape}")
+        agreed = int(np.sum(shadow_predictions.argmax(axis=1) == predictions.argmax(axis=1)))
+        SHADOW_PREDICTIONS.labels(model_version=model_version, result='agree').inc(agreed)
+        SHADOW_PREDICTIONS.labels(model_version=model_version, result='disagree').inc(len(images) - agreed)
+    except Exception as error:
+        logger.warning("Error in shadow prediction: %s", error, extra={'model_version': model_version})
+        SHADOW_PREDICTIONS.labels(model_version=model_version, result='error').inc(len(images))
+    finally:
+        with _shadow_lock:
+            _shadow_pending -= 1
+
+def submit_shadow(images: list[np.ndarray], predictions) -> bool:
+    """
+    Sends a copy of answered predictions' images to the shadow model version, without waiting for it
+
+    Parameters:
+    images (list[np.ndarray]): The preprocessed images that were predicted
+    predictions: The softmax for each image from the version that answered, as an (n, 7) array or list of lists
+
+    Returns:
+    bool: True if the copy was queued, False if there's no shadow version, the prediction wasn't sampled or too many are pending
+    """
+    global _shadow_pending
+    model_version = os.getenv('MODEL_SHADOW_VERSION')
+    if not model_version or random.random() >= float(os.getenv('MODEL_SHADOW_RATE', 1.0)):
+        return False
+    with _shadow_lock:
+        if _shadow_pending >= SHADOW_MAX_PENDING:
+            SHADOW_PREDICTIONS.labels(model_version=model_version, result='dropped').inc(len(images))
+            return False
+        _shadow_pending += 1
+    # the caller's context is copied so the shadow's logs keep the request id
+    context = contextvars.copy_context()
+    try:
+        get_executor(SHADOW_POOL).submit(context.run, run_shadow, model_version, images, np.asarray(predictions, dtype=np.float64))
+    except RuntimeError:
+        # the pool is shut down while the app stops
+        with _shadow_lock:
+            _shadow_pending -= 1
+        return False
+    return True
@@ -0,0 +1,229 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import JSONResponse, Response
+from dotenv import load_dotenv
+from services.executors import run_cpu_bound, run_io_bound
+
+load_dotenv()
+
+# Opt in request profiling, only installed when PROFILING_ENABLED=1 so there is no cost otherwise
+# a sampled share of requests (PROFILING_SAMPLE_RATE) or any request sent with X-Profile: <PROFILING_SECRET> is profiled
+# a background thread samples the stacks of the event loop and pool threads, giving a wall clock profile of the request
+# note requests running at the same time share the event loop so their frames can show up in each other's profiles
+# profiles are kept in memory per route as raw samples and only rendered to speedscope json or collapsed stacks
+# in the cpu pool when downloaded from /debug/profiles, so profiling a request adds no serialisation to the event loop
+
+PROFILE_HEADER = 'x-profile'
+
+# frames that mean a thread is waiting for work rather than doing any
+IDLE_FRAMES = {('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get')}
+
+def is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+# samples the stacks of the given threads, and of any thread whose name starts with one of thread_prefixes, every interval seconds until stopped
+# the prefixed threads are looked up on every sample so pool threads started during the request are picked up too
+class SamplingProfiler:
+    def __init__(self, thread_ids: set[int], interval: float = 0.001, thread_prefixes: tuple[str, ...] = ()):
+        self.thread_ids = thread_ids
+        self.thread_prefixes = thread_prefixes
+        self.interval = interval
+        self.samples = {} # thread name -> list of stacks, each a tuple of (file, line, function) from root to leaf
+        self.started_at = None
+        self.duration = 0.0
+        self.running = False
+        self.thread = None
+
+    def sample(self):
+        frames = sys._current_frames()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        thread_ids = self.thread_ids | {
+            thread_id for thread_id, name in names.items() if self.thread_prefixes and name.startswith(self.thread_prefixes)
+        }
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            if frame is None or is_idle(frame):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append((frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.setdefault(names.get(thread_id, str(thread_id)), []).append(tuple(stack))
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+
+    # only flags the sampler to finish, join() waits for its last sample
+    def stop(self):
+        self.running = False
+        self.duration = time.perf_counter() - self.started_at
+
+    def join(self):
+        self.thread.join()
+
+    # https://www.speedscope.app/file-format-schema.json, one sampled profile per thread
+    def to_speedscope(self, name: str) -> dict:
+        frames, frame_index, profiles = [], {}, []
+        for thread_name, stacks in self.samples.items():
+            samples = []
+            for stack in stacks:
+                indexes = []
+                for file, line, function in stack:
+                    key = (file, line, function)
+                    if key not in frame_index:
+                        frame_index[key] = len(frames)
+                        frames.append({'name': function, 'file': file, 'line': line})
+                    indexes.append(frame_index[key])
+                samples.append(indexes)
+            profiles.append({
+                'type': 'sampled',
+                'name': thread_name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': len(samples) * self.interval,
+                'samples': samples,
+                'weights': [self.interval] * len(samples),
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'moodmirror-profiler',
+            'shared': {'frames': frames},
+            'profiles': profiles,
+        }
+
+    # folded stacks as read by flamegraph.pl / inferno: thread;root;...;leaf count
+    def to_collapsed(self) -> str:
+        counts = {}
+        for thread_name, stacks in self.samples.items():
+            for stack in stacks:
+                key = ';'.join([thread_name] + [f'{function} ({os.path.basename(file)}:{line})' for file, line, function in stack])
+                counts[key] = counts.get(key, 0) + 1
+        return '\n'.join(f'{stack} {count}' for stack, count in counts.items())
+
+# rendered in the cpu pool at download time, a profile of a slow request holds tens of thousands of stacks
+def render_profile(profile: dict, format: str) -> str:
+    profiler = profile['profiler']
+    if format == 'collapsed':
+        return profiler.to_collapsed()
+    return json.dumps(profiler.to_speedscope(f"{profile['method']} {profile['route']}"))
+
+# most recent profiles per route, the number of routes and profiles kept are both capped
+class ProfileStore:
+    def __init__(self, max_per_route: int = 5, max_routes: int = 50):
+        self.max_per_route = max_per_route
+        self.max_routes = max_routes
+        self.profiles = OrderedDict() # route -> OrderedDict of profile id -> profile
+        self.lock = threading.Lock()
+
+    def add(self, route: str, profile: dict) -> str:
+        profile_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            route_profiles = self.profiles.setdefault(route, OrderedDict())
+            self.profiles.move_to_end(route)
+            route_profiles[profile_id] = profile
+            while len(route_profiles) > self.max_per_route:
+                route_profiles.popitem(last=False)
+            while len(self.profiles) > self.max_routes:
+                self.profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str):
+        with self.lock:
+            for route_profiles in self.profiles.values():
+                if profile_id in route_profiles:
+                    return route_profiles[profile_id]
+        return None
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                route: [
+                    {'id': profile_id, 'method': profile['method'], 'duration_ms': profile['duration_ms'], 'samples': profile['samples']}
+                    for profile_id, profile in route_profiles.items()
+                ]
+                for route, route_profiles in self.profiles.items()
+            }
+
+profile_store = ProfileStore()
+
+# pure asgi middleware so streamed responses are profiled until their last chunk is sent
+class ProfilingMiddleware:
+    def __init__(self, app, sample_rate: float = 0.0, secret: str = None, interval: float = 0.001, store: ProfileStore = profile_store):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.interval = interval
+        self.store = store
+
+    def should_profile(self, scope) -> bool:
+        if self.secret:
+            for name, value in scope.get('headers', []):
+                if name == PROFILE_HEADER.encode() and hmac.compare_digest(value, self.secret.encode()):
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'].startswith('/debug/profiles') or not self.should_profile(scope):
+            return await self.app(scope, receive, send)
+
+        # sample the event loop thread and the executor pools the endpoints offload to
+        profiler = SamplingProfiler({threading.get_ident()}, self.interval, thread_prefixes=('cpu-pool', 'io-pool', 'AnyIO worker'))
+        profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.stop()
+            # waiting on the sampler's last tick happens off the event loop
+            await run_io_bound(profiler.join)
+            # use the route template once routing has happened so /readings?clerk_id=... all land together
+            route = getattr(scope.get('route'), 'path', None) or scope['path']
+            self.store.add(route, {
+                'method': scope['method'],
+                'route': route,
+                'duration_ms': profiler.duration * 1000,
+                'samples': sum(len(stacks) for stacks in profiler.samples.values()),
+                'profiler': profiler,
+            })
+
+router = APIRouter()
+
+def check_secret(secret: str):
+    expected = os.getenv('PROFILING_SECRET')
+    if not expected or secret is None or not hmac.compare_digest(secret.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+# list the stored profiles per route
+@router.get('/debug/profiles')
+async def list_profiles(x_profile: str = Header(None)) -> JSONResponse:
+    check_secret(x_profile)
+    return JSONResponse(content=profile_store.summary())
+
+# download a profile, speedscope json by default or collapsed stacks for flamegraph.pl
+@router.get('/debug/profiles/{profile_id}')
+async def download_profile(profile_id: str, format: str = 'speedscope', x_profile: str = Header(None)):
+    check_secret(x_profile)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    content = await run_cpu_bound(render_profile, profile, format)
+    if format == 'collapsed':
+        return Response(content, media_type='text/plain', headers={'Content-Disposition': f'attachment; filename="{profile_id}.folded"'})
+    return Response(content, media_type='application/json', headers={'Content-Disposition': f'attachment; filename="{profile_id}.speedscope.json"'})
@@ -18,3 +18,5 @@ def test_forward_to_serving_integration():
 
     assert result['confidence'] >= 0.0 and result['confidence'] <= 1.0
     assert result['prediction'] in [emotion.name for emotion in Emotions]
+    assert len(result['probabilities']) == len(Emotions)
+    assert max(result['probabilities']) == result['confidence']
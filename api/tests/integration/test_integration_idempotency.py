@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db.connection import Session, dispose_engine
+from db.models import GlobalAccuracyCount, Reading, ReadingIdempotencyKey, User
+from db.queries import insert_reading
+from endpoints.readings import ReadingData
+
+CLERK_ID = 'user_integration_idempotency'
+CONCURRENT_RETRIES = 10
+
+# needs the database from .env with the migrations applied
+# the same upload is sent concurrently, as a client that retries before its first attempt has returned would
+@pytest.mark.integration
+def test_concurrent_retries_insert_one_reading():
+    request = ReadingData(emotion='happy', is_accurate=True, timestamp='2024-09-01T12:00:00+00:00', clerk_id=CLERK_ID)
+
+    async def upload():
+        async with Session() as session:
+            return await insert_reading(session, request, 'retried-key')
+
+    async def count_accurate_readings():
+        async with Session() as session:
+            return (await session.get(GlobalAccuracyCount, 1)).accurate_readings
+
+    async def run():
+        try:
+            async with Session() as session:
+                await session.execute(pg_insert(User).values(clerk_id=CLERK_ID).on_conflict_do_nothing())
+                await session.commit()
+            accurate_before = await count_accurate_readings()
+            responses = await asyncio.gather(*(upload() for _ in range(CONCURRENT_RETRIES)))
+            async with Session() as session:
+                readings = (await session.execute(select(func.count()).where(Reading.clerk_id == CLERK_ID))).scalar_one()
+            return responses, readings, await count_accurate_readings() - accurate_before
+        finally:
+            async with Session() as session:
+                await session.execute(delete(ReadingIdempotencyKey).where(ReadingIdempotencyKey.clerk_id == CLERK_ID))
+                await session.execute(delete(Reading).where(Reading.clerk_id == CLERK_ID))
+                await session.execute(delete(User).where(User.clerk_id == CLERK_ID))
+                await session.commit()
+            await dispose_engine()
+
+    responses, readings, counted = asyncio.run(run())
+
+    assert readings == 1
+    assert counted == 1
+    # every retry gets the one reading back
+    assert all(response == responses[0] for response in responses)
+    assert responses[0][1] == 201
@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db.connection import Session, dispose_engine
+from db.models import Reading, User
+from db.queries import insert_reading, select_model_accuracy
+from endpoints.readings import ReadingData
+
+CLERK_ID = 'user_integration_model_accuracy'
+# (model version, is_accurate) of each reading uploaded
+FEEDBACK = [('integration-a', True), ('integration-a', True), ('integration-a', False), ('integration-b', False)]
+
+# needs the database from .env with the migrations applied
+@pytest.mark.integration
+def test_accuracy_by_model_version():
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        try:
+            async with Session() as session:
+                await session.execute(pg_insert(User).values(clerk_id=CLERK_ID).on_conflict_do_nothing())
+                await session.commit()
+            for minutes, (model_version, is_accurate) in enumerate(FEEDBACK):
+                request = ReadingData(
+                    emotion='happy', is_accurate=is_accurate, timestamp=(now - timedelta(minutes=minutes)).isoformat(),
+                    clerk_id=CLERK_ID, model_version=model_version,
+                )
+                async with Session() as session:
+                    await insert_reading(session, request)
+            async with Session() as session:
+                return await select_model_accuracy(session, now - timedelta(days=1))
+        finally:
+            async with Session() as session:
+                await session.execute(delete(Reading).where(Reading.clerk_id == CLERK_ID))
+                await session.execute(delete(User).where(User.clerk_id == CLERK_ID))
+                await session.commit()
+            await dispose_engine()
+
+    versions = {version['model_version']: version for version in asyncio.run(run())}
+
+    assert versions['integration-a'] == {'model_version': 'integration-a', 'readings': 3, 'accurate': 2}
+    assert versions['integration-b'] == {'model_version': 'integration-b', 'readings': 1, 'accurate': 0}
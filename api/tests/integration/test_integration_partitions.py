@@ -0,0 +1,24 @@
+import asyncio
+import pytest
+from db.connection import Session, dispose_engine
+from db.partitions import DEFAULT_PARTITION, explain_readings_queries, maintain_partitions
+
+# needs the database from .env with the migrations applied
+# checks the queries over a time range only scan the partitions for it
+@pytest.mark.integration
+def test_readings_queries_are_pruned():
+    async def explain():
+        try:
+            async with Session() as session:
+                await maintain_partitions(session)
+                return await explain_readings_queries(session, 'user_integration')
+        finally:
+            await dispose_engine()
+
+    partitions = asyncio.run(explain())
+
+    assert len(partitions['readings_this_month']) == 1
+    assert len(partitions['inserted_reading']) == 1
+    assert len(partitions['emotion_counts_7d']) <= 2
+    assert len(partitions['emotion_counts_1yr']) <= 13
+    assert DEFAULT_PARTITION in partitions['readings_all_time']
@@ -0,0 +1,45 @@
+import asyncio
+import os
+import pytest
+from datetime import datetime, timezone
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from unittest.mock import patch
+import db.connection
+from db.connection import Session, dispose_engine, read_session, record_write
+from db.models import Reading, User
+from db.queries import select_user_readings
+
+CLERK_ID = 'user_integration_replica'
+
+# needs two databases from .env with the migrations applied, DB_NAME as the primary and DB_REPLICA_NAME standing in for its replica
+# they don't replicate, so a reading only written to the primary shows which one a read went to
+@pytest.mark.integration
+@pytest.mark.skipif(not os.getenv('DB_REPLICA_HOST'), reason="DB_REPLICA_HOST isn't set")
+def test_reads_are_routed_to_the_replica_after_the_write_window():
+    async def run():
+        try:
+            async with Session() as session:
+                await session.execute(pg_insert(User).values(clerk_id=CLERK_ID).on_conflict_do_nothing())
+                await session.execute(insert(Reading).values(clerk_id=CLERK_ID, emotion_id=1, datetime=datetime.now(timezone.utc)))
+                await session.commit()
+            record_write(CLERK_ID)
+
+            async with read_session(CLERK_ID) as session:
+                after_write = await select_user_readings(session, CLERK_ID, None, None, None, None)
+            with patch.dict(db.connection._recent_writes, clear=True):
+                async with read_session(CLERK_ID) as session:
+                    after_window = await select_user_readings(session, CLERK_ID, None, None, None, None)
+            return after_write, after_window
+        finally:
+            async with Session() as session:
+                await session.execute(delete(Reading).where(Reading.clerk_id == CLERK_ID))
+                await session.execute(delete(User).where(User.clerk_id == CLERK_ID))
+                await session.commit()
+            await dispose_engine()
+
+    after_write, after_window = asyncio.run(run())
+
+    # the user sees their own reading straight after writing it, then reads go to the replica which doesn't have it
+    assert len(after_write['readings']) == 1
+    assert after_window['readings'] == []
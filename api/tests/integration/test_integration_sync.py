@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from datetime import datetime, timezone
+from sqlalchemy import delete, insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db.connection import Session, dispose_engine
+from db.models import Reading, ReadingTombstone, User
+from db.queries import delete_reading, select_reading_changes
+
+CLERK_ID = 'user_integration_sync'
+START = (-1, 0)
+
+async def insert_test_reading() -> int:
+    async with Session() as session:
+        result = await session.execute(
+            insert(Reading).values(clerk_id=CLERK_ID, emotion_id=1, datetime=datetime.now(timezone.utc)).returning(Reading.reading_id)
+        )
+        await session.commit()
+        return result.scalar_one()
+
+async def sync(cursor: tuple[int, int], limit: int = 500) -> dict:
+    async with Session() as session:
+        return await select_reading_changes(session, CLERK_ID, cursor, limit)
+
+def run(test):
+    async def wrapper():
+        try:
+            async with Session() as session:
+                await session.execute(pg_insert(User).values(clerk_id=CLERK_ID).on_conflict_do_nothing())
+                await session.commit()
+            return await test()
+        finally:
+            async with Session() as session:
+                await session.execute(delete(ReadingTombstone).where(ReadingTombstone.clerk_id == CLERK_ID))
+                await session.execute(delete(Reading).where(Reading.clerk_id == CLERK_ID))
+                await session.execute(delete(User).where(User.clerk_id == CLERK_ID))
+                await session.commit()
+            await dispose_engine()
+    return asyncio.run(wrapper())
+
+# needs the database from .env with the migrations applied
+@pytest.mark.integration
+def test_sync_pages_through_changes_and_deletions():
+    async def test():
+        reading_ids = [await insert_test_reading() for _ in range(5)]
+        first = await sync(START, limit=3)
+        second = await sync(first['cursor'], limit=3)
+        async with Session() as session:
+            await delete_reading(session, CLERK_ID, reading_ids[0])
+        third = await sync(second['cursor'])
+        return reading_ids, first, second, third
+
+    reading_ids, first, second, third = run(test)
+
+    assert [reading['id'] for reading in first['readings']] == reading_ids[:3]
+    assert first['has_more']
+    assert [reading['id'] for reading in second['readings']] == reading_ids[3:]
+    assert not second['has_more']
+    assert third['readings'] == [] and third['deleted'] == [reading_ids[0]]
+
+# a transaction that started before a reading was written holds it back from the sync until it finishes,
+# otherwise that transaction could still commit a reading with a version behind the cursor the client gets
+@pytest.mark.integration
+def test_sync_waits_for_older_transactions():
+    async def test():
+        async with Session() as older:
+            await older.execute(text("SELECT pg_current_xact_id()"))
+            reading_id = await insert_test_reading()
+            during = await sync(START)
+            await older.commit()
+        after = await sync(START)
+        return reading_id, during, after
+
+    reading_id, during, after = run(test)
+
+    assert during['readings'] == []
+    assert [reading['id'] for reading in after['readings']] == [reading_id]
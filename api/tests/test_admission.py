@@ -0,0 +1,173 @@
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from services.admission import AdmissionController, Overloaded
+from main import create_app
+
+def controller(**kwargs):
+    return AdmissionController(**{'limit': 2, 'queue_size': 2, 'queue_timeout': 1.0, **kwargs})
+
+
+def test_admits_up_to_limit_then_queues_in_order():
+    async def test():
+        admission = controller()
+        await admission.acquire()
+        await admission.acquire()
+        order = []
+
+        async def queued(name):
+            await admission.acquire()
+            order.append(name)
+
+        waiters = [asyncio.create_task(queued('first')), asyncio.create_task(queued('second'))]
+        await asyncio.sleep(0)
+        assert len(admission.waiters) == 2 and order == []
+        admission.release()
+        admission.release()
+        await asyncio.gather(*waiters)
+        return admission, order
+
+    admission, order = asyncio.run(test())
+
+    assert order == ['first', 'second']
+    assert admission.in_flight == 2
+    assert not admission.waiters
+
+def test_rejects_when_queue_full():
+    async def test():
+        admission = controller(queue_size=0)
+        await admission.acquire()
+        await admission.acquire()
+        with pytest.raises(Overloaded) as e:
+            await admission.acquire()
+        return e.value
+
+    assert asyncio.run(test()).reason == 'queue_full'
+
+def test_rejects_after_queue_timeout():
+    async def test():
+        admission = controller(limit=1, queue_timeout=0.05)
+        await admission.acquire()
+        with pytest.raises(Overloaded) as e:
+            await admission.acquire()
+        # the slot isn't handed to the request that gave up
+        admission.release()
+        return admission, e.value
+
+    admission, error = asyncio.run(test())
+
+    assert error.reason == 'timeout'
+    assert admission.in_flight == 0 and not admission.waiters
+
+# with 4 predictions running that each take 1s, the 5th would wait 0.25s, past the 0.2s deadline
+def test_rejects_straight_away_when_wait_is_past_deadline():
+    async def test():
+        admission = controller(limit=4, queue_timeout=0.2)
+        admission.latency = 1.0
+        for _ in range(4):
+            await admission.acquire()
+        started_at = time.perf_counter()
+        with pytest.raises(Overloaded) as e:
+            await admission.acquire()
+        return e.value, time.perf_counter() - started_at
+
+    error, waited = asyncio.run(test())
+
+    assert error.reason == 'deadline'
+    assert waited < 0.1
+    assert error.retry_after == 1
+
+def test_retry_after_from_queue_length():
+    admission = controller(limit=2)
+    admission.latency = 3.0
+    admission.waiters.extend([None] * 3)
+
+    # the 4th in the queue starts after 4 predictions of 3s, 2 at a time
+    assert admission.retry_after() == 6
+
+def test_adaptive_limit_increases_while_fast():
+    admission = controller(limit=4, adaptive=True, target_latency=1.0)
+    admission.in_flight = 4
+    for _ in range(4):
+        admission.in_flight -= 1
+        admission.observe(0.1)
+        admission.in_flight += 1
+
+    assert admission.current_limit() == 4
+    assert 4.9 < admission.limit < 5.0
+
+def test_adaptive_limit_decreases_once_per_latency():
+    admission = controller(limit=10, adaptive=True, target_latency=1.0, min_limit=2)
+    with patch('services.admission.time.monotonic', return_value=100.0):
+        admission.observe(2.0)
+        admission.observe(2.0)
+    assert admission.limit == 9.0
+
+    with patch('services.admission.time.monotonic', return_value=102.0):
+        admission.observe(2.0)
+    assert admission.limit == pytest.approx(8.1)
+
+def test_adaptive_limit_kept_within_bounds():
+    admission = controller(limit=2, adaptive=True, target_latency=1.0, min_limit=2, max_limit=3)
+    admission.observe(5.0)
+    assert admission.current_limit() == 2
+
+    admission.in_flight = 2
+    for _ in range(20):
+        admission.observe(0.1)
+    assert admission.limit == 3
+
+# every prediction either finishes or is turned away within the queue deadline plus its own time
+def test_tail_latency_bounded_under_overload():
+    work_seconds = 0.02
+
+    async def test():
+        admission = controller(limit=2, queue_size=4, queue_timeout=0.1)
+
+        async def request():
+            started_at = time.perf_counter()
+            try:
+                await admission.acquire()
+            except Overloaded:
+                return 'rejected', time.perf_counter() - started_at
+            try:
+                await asyncio.sleep(work_seconds)
+            finally:
+                admission.release(work_seconds)
+            return 'served', time.perf_counter() - started_at
+
+        return await asyncio.gather(*(request() for _ in range(100)))
+
+    results = asyncio.run(test())
+    served = [latency for result, latency in results if result == 'served']
+    rejected = [latency for result, latency in results if result == 'rejected']
+
+    assert served and rejected
+    assert max(served) < 0.1 + work_seconds + 0.1
+    assert max(rejected) < 0.1 + 0.1
+
+
+# the worker is full and has no queue
+@pytest.fixture
+def admission():
+    admission = controller(queue_size=0)
+    admission.in_flight = 2
+    return admission
+
+@pytest.fixture
+def client(admission):
+    with patch('main.predict_admission', admission):
+        yield TestClient(create_app())
+
+def test_predict_rejected_with_retry_after(client, admission):
+    response = client.post('/api/predict', json={'image': ''}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert 'busy' in response.json()['error']
+    assert admission.in_flight == 2
+
+def test_other_routes_not_limited(client):
+    assert client.get('/').status_code == 200
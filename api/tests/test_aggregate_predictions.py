@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from services.aggregate_predictions import aggregate_predictions, top_emotions
+
+# softmax rows in Emotions order: ANGRY, DISGUSTED, SCARED, HAPPY, NEUTRAL, SAD, SURPRISED
+def softmax(**probabilities) -> list[float]:
+    names = ['ANGRY', 'DISGUSTED', 'SCARED', 'HAPPY', 'NEUTRAL', 'SAD', 'SURPRISED']
+    row = [probabilities.get(name, 0.0) for name in names]
+    remainder = (1 - sum(row)) / row.count(0.0) if row.count(0.0) else 0
+    return [value or remainder for value in row]
+
+@pytest.fixture
+def predictions():
+    # two frames mildly happy, one very sad
+    return np.array([softmax(HAPPY=0.5, SAD=0.3), softmax(HAPPY=0.5, SAD=0.3), softmax(SAD=0.98)])
+
+
+def test_mean(predictions):
+    result = aggregate_predictions(predictions, 'mean')
+
+    assert result['prediction'] == 'SAD'
+    assert result['confidence'] == pytest.approx((0.3 + 0.3 + 0.98) / 3)
+    assert result['agreement'] == pytest.approx(1 / 3)
+
+def test_majority(predictions):
+    result = aggregate_predictions(predictions, 'majority')
+
+    assert result['prediction'] == 'HAPPY'
+    assert result['confidence'] == pytest.approx(predictions[:, 3].mean())
+    assert result['agreement'] == pytest.approx(2 / 3)
+
+def test_majority_tie_goes_to_higher_mean():
+    predictions = np.array([softmax(HAPPY=0.6), softmax(NEUTRAL=0.9)])
+
+    assert aggregate_predictions(predictions, 'majority')['prediction'] == 'NEUTRAL'
+
+def test_single_frame_matches_argmax():
+    predictions = np.array([softmax(SURPRISED=0.7)])
+
+    for method in ('mean', 'majority'):
+        result = aggregate_predictions(predictions, method)
+        assert result == {'prediction': 'SURPRISED', 'confidence': pytest.approx(0.7), 'agreement': 1.0, 'probabilities': pytest.approx(predictions[0].tolist())}
+
+def test_unknown_aggregation(predictions):
+    with pytest.raises(ValueError):
+        aggregate_predictions(predictions, 'median')
+
+def test_probabilities_are_the_mean_in_emotions_order(predictions):
+    result = aggregate_predictions(predictions, 'majority')
+
+    assert result['probabilities'] == pytest.approx(predictions.mean(axis=0).tolist())
+    assert len(result['probabilities']) == 7
+
+def test_top_emotions():
+    top = top_emotions(softmax(HAPPY=0.6, SAD=0.3, ANGRY=0.04), 2)
+
+    assert [emotion['emotion'] for emotion in top] == ['HAPPY', 'SAD']
+    assert top[0]['probability'] == pytest.approx(0.6)
+    assert len(top_emotions(softmax(HAPPY=0.6), 7)) == 7
@@ -0,0 +1,43 @@
+from constants.emotion_enum import Emotions
+from services.compact_encoding import READING_COLUMNS, encode_emotion_counts, encode_readings
+
+def test_readings_as_rows_with_codes():
+    response = {
+        'readings': [
+            {'id': 1, 'emotion': 'Happy', 'location': 'Home', 'datetime': '2024-09-01T12:00', 'note': None},
+            {'id': 2, 'emotion': 'sad', 'location': 'Work', 'datetime': '2024-09-01T13:00', 'note': 'meeting'},
+            {'id': 3, 'emotion': 'Happy', 'location': 'Home', 'datetime': '2024-09-02T09:00', 'note': None},
+            {'id': 4, 'emotion': 'Angry', 'location': None, 'datetime': '2024-09-02T10:00', 'note': None},
+        ],
+        'counts': {'Happy': 2, 'Sad': 1, 'Angry': 1},
+    }
+
+    encoded = encode_readings(response)
+
+    assert encoded['columns'] == READING_COLUMNS
+    assert encoded['locations'] == ['Home', 'Work']
+    assert encoded['readings'] == [
+        [1, Emotions.HAPPY.value, 0, '2024-09-01T12:00', None],
+        [2, Emotions.SAD.value, 1, '2024-09-01T13:00', 'meeting'],
+        [3, Emotions.HAPPY.value, 0, '2024-09-02T09:00', None],
+        [4, Emotions.ANGRY.value, None, '2024-09-02T10:00', None],
+    ]
+    assert len(encoded['counts']) == len(Emotions)
+    assert encoded['counts'][Emotions.HAPPY.value] == 2
+    assert encoded['counts'][Emotions.SURPRISED.value] == 0
+
+def test_no_readings():
+    assert encode_readings({'readings': [], 'counts': {}}) == {'columns': READING_COLUMNS, 'locations': [], 'readings': [], 'counts': [0] * len(Emotions)}
+
+def test_emotion_counts_share_dates():
+    counts = {
+        'Happy': [{'date': '2024-09-01', 'count': 2}, {'date': '2024-09-02', 'count': 0}],
+        'Sad': [{'date': '2024-09-01', 'count': 1}, {'date': '2024-09-02', 'count': 4}],
+    }
+
+    assert encode_emotion_counts(counts) == {
+        'dates': ['2024-09-01', '2024-09-02'],
+        'emotions': [Emotions.HAPPY.value, Emotions.SAD.value],
+        'counts': [[2, 0], [1, 4]],
+    }
+    assert encode_emotion_counts({}) == {'dates': [], 'emotions': [], 'counts': []}
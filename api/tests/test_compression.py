@@ -0,0 +1,101 @@
+import gzip
+import json
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from services.executors import run_cpu_bound
+from services.compression import CompressionMiddleware, choose_encoding, get_available_encodings, parse_accept_encoding, parse_levels
+
+READINGS = [{'id': i, 'emotion': 'Happy', 'location': 'Home', 'datetime': '2024-09-01T12:00', 'note': None} for i in range(500)]
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, encodings='gzip', minimum_size=1024, offload_size=4096)
+
+    @app.get('/large')
+    async def large():
+        return JSONResponse(content={'readings': READINGS})
+
+    @app.get('/small')
+    async def small():
+        return JSONResponse(content={'readings': READINGS[:2]})
+
+    @app.get('/stream')
+    async def stream():
+        chunks = (json.dumps(reading).encode() + b'\n' for reading in READINGS)
+        return StreamingResponse(chunks, media_type='application/json')
+
+    @app.get('/gzipped')
+    async def gzipped():
+        return Response(gzip.compress(b'a' * 4096), media_type='application/gzip')
+
+    return TestClient(app)
+
+def get(client, path, accept_encoding='gzip'):
+    return client.get(path, headers={'Accept-Encoding': accept_encoding})
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip, br;q=0.5, zstd;q=0, *;q=0.1') == {'gzip': 1.0, 'br': 0.5, 'zstd': 0.0, '*': 0.1}
+    assert parse_accept_encoding('') == {}
+
+@pytest.mark.parametrize('header, encoding', [
+    ('gzip, deflate, br, zstd', 'zstd'),
+    ('gzip, br', 'br'),
+    ('gzip;q=1, br;q=0.5', 'gzip'),
+    ('zstd;q=0, gzip', 'gzip'),
+    ('*', 'zstd'),
+    ('identity', None),
+    ('', None),
+])
+def test_choose_encoding(header, encoding):
+    assert choose_encoding(header, ['zstd', 'br', 'gzip']) == encoding
+
+def test_available_encodings_need_their_package():
+    with patch('services.compression.importlib.util.find_spec', side_effect=lambda name: name == 'zlib'):
+        assert get_available_encodings('gzip,br,zstd') == ['gzip']
+    with pytest.raises(ValueError):
+        get_available_encodings('deflate')
+
+def test_parse_levels():
+    assert parse_levels('gzip=9, br=4') == {'gzip': 9, 'br': 4}
+    assert parse_levels('') == {}
+
+def test_large_response_compressed(client):
+    with patch('services.compression.run_cpu_bound', wraps=run_cpu_bound) as offloaded:
+        response = get(client, '/large')
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['vary']
+    assert int(response.headers['content-length']) < len(json.dumps({'readings': READINGS}).encode()) / 10
+    assert response.json() == {'readings': READINGS}
+    # over the offload size so it was compressed in the cpu pool
+    offloaded.assert_called_once()
+
+def test_small_response_not_compressed(client):
+    response = get(client, '/small')
+
+    assert 'content-encoding' not in response.headers
+    assert response.json() == {'readings': READINGS[:2]}
+
+def test_not_compressed_without_accept_encoding(client):
+    response = get(client, '/large', accept_encoding='identity')
+
+    assert 'content-encoding' not in response.headers
+    assert response.json() == {'readings': READINGS}
+
+def test_already_compressed_type_passed_through(client):
+    response = get(client, '/gzipped')
+
+    assert 'content-encoding' not in response.headers
+    assert gzip.decompress(response.content) == b'a' * 4096
+
+def test_streamed_response_compressed_as_it_goes(client):
+    response = get(client, '/stream')
+
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'content-length' not in response.headers
+    assert [json.loads(line) for line in response.text.splitlines()] == READINGS
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from services.executors import CPU_POOL, IO_POOL, POOL_SIZES, get_executor, run_cpu_bound, run_in_every_thread, run_io_bound, shutdown_executors
+from services.loop_monitor import EventLoopLagMonitor
+
+@pytest.fixture(autouse=True)
+def executors():
+    yield
+    shutdown_executors()
+
+def test_run_cpu_bound_runs_off_the_event_loop():
+    async def run():
+        return threading.get_ident(), await run_cpu_bound(threading.get_ident)
+
+    loop_thread, pool_thread = asyncio.run(run())
+
+    assert loop_thread != pool_thread
+
+def test_run_in_every_thread_runs_once_per_thread():
+    threads = run_in_every_thread(CPU_POOL, threading.get_ident)
+
+    assert len(threads) == POOL_SIZES[CPU_POOL]
+    assert len(set(threads)) == POOL_SIZES[CPU_POOL]
+
+# a busy thread can't reach the barrier, the others give up after the timeout rather than holding their threads
+def test_run_in_every_thread_gives_up_on_busy_pool():
+    busy = threading.Event()
+    with patch.dict(POOL_SIZES, {CPU_POOL: 2}):
+        blocked = get_executor(CPU_POOL).submit(busy.wait, 5)
+        started_at = time.perf_counter()
+        with pytest.raises(threading.BrokenBarrierError):
+            run_in_every_thread(CPU_POOL, threading.get_ident, timeout=0.2)
+        waited = time.perf_counter() - started_at
+        busy.set()
+        blocked.result()
+
+    assert waited < 1
+
+def test_pools_are_named_and_separate():
+    async def run():
+        cpu_thread = await run_cpu_bound(lambda: threading.current_thread().name)
+        io_thread = await run_io_bound(lambda: threading.current_thread().name)
+        return cpu_thread, io_thread
+
+    cpu_thread, io_thread = asyncio.run(run())
+
+    assert cpu_thread.startswith("cpu-pool")
+    assert io_thread.startswith("io-pool")
+    assert get_executor(CPU_POOL) is not get_executor(IO_POOL)
+
+def test_run_cpu_bound_passes_arguments_and_exceptions():
+    def divide(a, b=1):
+        return a / b
+
+    assert asyncio.run(run_cpu_bound(divide, 6, b=3)) == 2
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(run_cpu_bound(divide, 1, b=0))
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        get_executor("gpu")
+
+def test_offloaded_work_does_not_block_the_loop():
+    monitor = EventLoopLagMonitor(interval=0.01, threshold=0.1)
+
+    async def run():
+        monitor.start()
+        await run_cpu_bound(time.sleep, 0.3)
+        await monitor.stop()
+
+    asyncio.run(run())
+
+    assert monitor.blocked_count == 0
+
+def test_loop_monitor_reports_blocking_calls():
+    monitor = EventLoopLagMonitor(interval=0.01, threshold=0.1)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.3) # blocks the loop
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    asyncio.run(run())
+
+    assert monitor.blocked_count == 1
+    assert monitor.max_lag >= 0.2
@@ -0,0 +1,129 @@
+import asyncio
+import csv
+import gzip
+import io
+import sys
+import pytest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from db.queries import select_readings_for_export
+from services.export_readings import CsvGzipWriter, create_writer, get_available_formats, stream_export
+from main import app
+
+def make_rows(count: int, start: int = 0) -> list:
+    started_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        SimpleNamespace(
+            reading_id=i,
+            clerk_id='user_1',
+            datetime=started_at + timedelta(hours=8 * i),
+            emotion=['Happy', 'Sad', 'Neutral'][i % 3],
+            location=None if i % 2 else 'Home',
+            note=None,
+            # readings from before the probabilities were stored have neither
+            confidence=None if i % 4 == 0 else 0.7,
+            probabilities=None if i % 4 == 0 else [0.05, 0.05, 0.05, 0.7, 0.05, 0.05, 0.05],
+        )
+        for i in range(start, start + count)
+    ]
+
+# stands in for the session, the readings query is patched to yield these batches
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+@pytest.fixture
+def batches():
+    batches = [make_rows(100), make_rows(100, start=100), make_rows(50, start=200)]
+
+    async def stream_readings_for_export(session, clerk_id, batch_size):
+        for rows in batches:
+            yield rows
+
+    with patch('db.queries.stream_readings_for_export', stream_readings_for_export):
+        yield batches
+
+def export(name: str) -> list[bytes]:
+    async def collect():
+        return [chunk async for chunk in stream_export(FakeSession, create_writer(name))]
+    return asyncio.run(collect())
+
+
+def test_csv_export(batches):
+    data = b''.join(export('csv.gz'))
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(data).decode())))
+
+    assert len(rows) == 250
+    assert rows[1]['emotion'] == 'Sad'
+    assert rows[1]['Happy'] == '0.7'
+    assert rows[0]['confidence'] == rows[0]['Happy'] == ''
+    assert datetime.fromisoformat(rows[3]['datetime']) == datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+def test_export_is_streamed_a_batch_at_a_time(batches):
+    pytest.importorskip('pyarrow')
+
+    chunks = export('arrow')
+
+    # a record batch per batch and the end of stream marker, rather than the whole file at the end
+    assert len(chunks) == len(batches) + 1
+
+def test_empty_csv_export_has_header():
+    writer = CsvGzipWriter()
+
+    assert gzip.decompress(writer.close()).decode().startswith('reading_id,clerk_id,datetime')
+
+@pytest.mark.parametrize('name', ['parquet', 'arrow'])
+def test_columnar_export(batches, name):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    data = b''.join(export(name))
+    table = pq.read_table(io.BytesIO(data)) if name == 'parquet' else pa.ipc.open_stream(data).read_all()
+
+    assert table.num_rows == 250
+    assert table.schema.field('probabilities').type == pa.list_(pa.float32(), 7)
+    assert table.column('emotion').to_pylist()[:3] == ['Happy', 'Sad', 'Neutral']
+    assert table.column('probabilities').to_pylist()[0] is None
+    assert table.column('probabilities').to_pylist()[1][3] == pytest.approx(0.7)
+
+def test_columnar_formats_need_pyarrow():
+    with patch.dict(sys.modules, {'pyarrow': None}):
+        assert get_available_formats() == ['csv.gz']
+        with pytest.raises(ValueError):
+            create_writer('parquet')
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        create_writer('xlsx')
+
+def test_export_query():
+    user_query = str(select_readings_for_export('user_1'))
+    all_query = str(select_readings_for_export())
+
+    assert 'WHERE readings.clerk_id' in user_query
+    assert 'ORDER BY readings.datetime' in user_query
+    assert 'WHERE' not in all_query
+    assert 'ORDER BY readings.reading_id' in all_query
+
+@pytest.fixture
+def client():
+    with patch('endpoints.readings.read_session', lambda clerk_id: FakeSession()), \
+         patch('endpoints.readings.verify_token', return_value={'valid': True}):
+        yield TestClient(app)
+
+def test_export_endpoint(client, batches):
+    response = client.get('/api/readings/export', params={'clerk_id': 'user_1'}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 200
+    assert response.headers['content-disposition'] == 'attachment; filename="readings.csv.gz"'
+    assert len(gzip.decompress(response.content).decode().splitlines()) == 251
+
+def test_export_endpoint_unknown_format(client, batches):
+    response = client.get('/api/readings/export', params={'clerk_id': 'user_1', 'format': 'xlsx'}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 400
@@ -0,0 +1,116 @@
+import threading
+import cv2
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from benchmarks.harness import make_face_image
+from preprocessing.faceDetectors import DetectionCache, HaarCascadeDetector, YuNetDetector, create_face_detector, detect_faces
+
+@pytest.fixture
+def face_image():
+    return cv2.cvtColor(make_face_image(640, 480), cv2.COLOR_BGR2GRAY)
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = tmp_path / 'face_detection_yunet_2023mar.onnx'
+    path.write_bytes(b'')
+    return str(path)
+
+# stands in for cv2.FaceDetectorYN, returns the given rows (x, y, w, h, landmarks, score) for any input
+def fake_yunet(rows):
+    model = MagicMock()
+    model.detect.return_value = (1, None if rows is None else np.array(rows, dtype=np.float32))
+    return model
+
+
+def test_haar_detects_face(face_image):
+    faces = HaarCascadeDetector().detect(face_image)
+
+    assert len(faces) >= 1
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    assert x < 320 < x + w and y < 240 < y + h
+
+def test_haar_no_face():
+    assert HaarCascadeDetector().detect(np.zeros((200, 200), dtype=np.uint8)).shape == (0, 4)
+
+def test_haar_search_is_sized_to_the_image():
+    detector = HaarCascadeDetector()
+
+    assert detector.get_search_parameters(640, 480) == (1.1, (96, 96), (480, 480))
+    assert detector.get_search_parameters(4032, 3024) == (1.1, (604, 604), (3024, 3024))
+    # never below the original 60px minimum, or above the image
+    assert detector.get_search_parameters(200, 150)[1:] == ((60, 60), (150, 150))
+    assert detector.get_search_parameters(40, 40)[1:] == ((40, 40), (40, 40))
+
+def test_haar_scale_step_is_raised_for_wide_ranges():
+    scale_factor, min_size, max_size = HaarCascadeDetector(min_face_ratio=0, max_scales=10).get_search_parameters(4032, 3024)
+
+    assert scale_factor == pytest.approx((3024 / 60) ** (1 / 10))
+    assert min_size == (60, 60)
+
+def test_haar_cascade_is_loaded_once_per_thread():
+    detector = HaarCascadeDetector()
+    cascade = detector.load()
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(detector.load()))
+    thread.start()
+    thread.join()
+
+    assert detector.load() is cascade
+    assert other_thread[0] is not cascade
+
+def test_create_face_detector_from_config(model_path):
+    with patch.dict('os.environ', {'FACE_DETECTOR': 'yunet', 'YUNET_MODEL_PATH': model_path}):
+        assert isinstance(create_face_detector(), YuNetDetector)
+    with patch.dict('os.environ', {'FACE_DETECTOR': 'haar'}):
+        assert isinstance(create_face_detector(), HaarCascadeDetector)
+
+def test_create_face_detector_invalid_config():
+    with pytest.raises(ValueError):
+        create_face_detector('mtcnn')
+    with pytest.raises(ValueError):
+        create_face_detector('yunet') # no model path
+
+def test_yunet_boxes_are_scaled_back_and_clipped(model_path):
+    # a 1280x960 image is shrunk by half to fit max_side=640
+    rows = [[100, 50, 200, 250] + [0] * 10 + [0.9], [600, 400, 100, 100] + [0] * 10 + [0.8]]
+    with patch('preprocessing.faceDetectors.cv2.FaceDetectorYN.create', return_value=fake_yunet(rows)) as create:
+        faces = YuNetDetector(model_path, max_side=640).detect(np.zeros((960, 1280), dtype=np.uint8))
+
+    model = create.return_value
+    model.setInputSize.assert_called_once_with((640, 480))
+    assert model.detect.call_args[0][0].shape == (480, 640, 3)
+    np.testing.assert_array_equal(faces, [(200, 100, 400, 500), (1200, 800, 80, 160)])
+
+def test_yunet_no_face(model_path):
+    with patch('preprocessing.faceDetectors.cv2.FaceDetectorYN.create', return_value=fake_yunet(None)):
+        assert YuNetDetector(model_path).detect(np.zeros((100, 100), dtype=np.uint8)).shape == (0, 4)
+
+def test_detections_are_cached_by_key(face_image):
+    detector = MagicMock(wraps=HaarCascadeDetector())
+    detector.name = 'haar'
+    with patch('preprocessing.faceDetectors.get_face_detector', return_value=detector), \
+            patch('preprocessing.faceDetectors.detection_cache', DetectionCache()):
+        first = detect_faces(face_image, b'image-1')
+        second = detect_faces(face_image, b'image-1')
+        detect_faces(face_image, b'image-2')
+        detect_faces(face_image)
+
+    np.testing.assert_array_equal(first, second)
+    assert detector.detect.call_count == 3
+
+def test_detection_cache_evicts_least_recently_used():
+    cache = DetectionCache(max_size=2)
+    cache.add('a', [(0, 0, 1, 1)])
+    cache.add('b', [])
+    cache.get('a')
+    cache.add('c', [])
+
+    assert cache.get('a') == [(0, 0, 1, 1)]
+    assert cache.get('b') is None
+    assert cache.get('c') == []
+
+def test_detection_cache_disabled():
+    cache = DetectionCache(max_size=0)
+    cache.add('a', [])
+    assert cache.get('a') is None
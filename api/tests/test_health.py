@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from endpoints.health import router
+from preprocessing.faceDetectors import get_face_detector
+from services.executors import CPU_POOL, POOL_SIZES, run_in_every_thread, shutdown_executors
+from services.health import DATABASE, FACE_DETECTOR, SERVING, HealthChecker, warm_face_detector
+
+@pytest.fixture(autouse=True)
+def executors():
+    yield
+    shutdown_executors()
+
+@pytest.fixture
+def checker():
+    return HealthChecker(interval=60, timeout=0.5)
+
+@pytest.fixture
+def client(checker):
+    app = FastAPI()
+    app.include_router(router)
+    with patch('endpoints.health.health_checker', checker):
+        yield TestClient(app)
+
+async def passing_check():
+    pass
+
+async def failing_check():
+    raise ConnectionRefusedError("connection refused")
+
+async def slow_check():
+    await asyncio.sleep(5)
+
+
+def test_not_ready_before_warm_up(client):
+    response = client.get('/readyz')
+
+    assert response.status_code == 503
+    assert response.json()['warmed_up'] is False
+    assert client.get('/healthz').status_code == 200
+
+def test_warm_up_loads_everything(client, checker):
+    with patch('services.health.check_database', passing_check), patch('services.health.warm_serving') as warm_serving:
+        asyncio.run(checker.warm_up())
+
+    warm_serving.assert_called_once()
+    response = client.get('/readyz')
+    assert response.status_code == 200
+    assert all(state['ok'] for state in response.json()['dependencies'].values())
+
+def test_failing_dependency_is_not_ready(client, checker):
+    with patch('services.health.check_database', failing_check), patch('services.health.warm_serving'):
+        asyncio.run(checker.warm_up())
+
+    response = client.get('/readyz')
+    assert response.status_code == 503
+    assert response.json()['dependencies'][DATABASE]['error'] == 'connection refused'
+    assert response.json()['dependencies'][SERVING]['ok'] is True
+
+def test_slow_check_times_out(checker):
+    assert asyncio.run(checker.check(DATABASE, slow_check)) is False
+    assert checker.health.dependencies[DATABASE]['error'] == 'TimeoutError'
+
+def test_recovered_dependency_is_ready_again(checker):
+    with patch('services.health.check_database', failing_check), patch('services.health.warm_serving'):
+        asyncio.run(checker.warm_up())
+    assert not checker.health.is_ready()
+
+    with patch('services.health.check_database', passing_check), patch('services.health.check_serving'):
+        asyncio.run(checker.check_all())
+    assert checker.health.is_ready()
+
+# a face detector warm up that timed out at startup is tried again by the background checks, then left alone once loaded
+def test_face_detector_retried_until_loaded(checker):
+    with patch('services.health.warm_face_detector', side_effect=RuntimeError("busy")), \
+         patch('services.health.check_database', passing_check), patch('services.health.warm_serving'):
+        asyncio.run(checker.warm_up())
+    assert not checker.health.is_ready()
+
+    with patch('services.health.warm_face_detector') as warm, \
+         patch('services.health.check_database', passing_check), patch('services.health.check_serving'):
+        asyncio.run(checker.check_all())
+        assert checker.health.dependencies[FACE_DETECTOR]['ok']
+        assert checker.health.is_ready()
+
+        asyncio.run(checker.check_all())
+    assert warm.call_count == POOL_SIZES[CPU_POOL]
+
+# a round that outlives its check's timeout is waited on by the next check rather than another round being queued
+def test_face_detector_round_not_resubmitted_while_pending(checker):
+    loaded = threading.Event()
+
+    async def test():
+        first = await checker.check_face_detector()
+        second = await checker.check_face_detector()
+        calls_while_pending = warm.call_count
+        loaded.set()
+        await checker.face_detector_round
+        third = await checker.check_face_detector()
+        return first, second, calls_while_pending, third
+
+    with patch('services.health.warm_face_detector', side_effect=lambda: loaded.wait(5)) as warm:
+        first, second, calls_while_pending, third = asyncio.run(test())
+
+    assert (first, second) == (False, False)
+    assert calls_while_pending == POOL_SIZES[CPU_POOL]
+    # the next round starts once the last one has finished
+    assert third is True
+    assert warm.call_count == 2 * POOL_SIZES[CPU_POOL]
+
+def test_probes_dont_run_checks(client, checker):
+    with patch('services.health.check_database', passing_check), patch('services.health.warm_serving'):
+        asyncio.run(checker.warm_up())
+
+    with patch('services.health.check_database') as check_database, patch('services.health.check_serving') as check_serving:
+        for _ in range(20):
+            client.get('/readyz')
+            client.get('/healthz')
+
+    check_database.assert_not_called()
+    check_serving.assert_not_called()
+
+def test_face_detector_is_preloaded_in_every_cpu_thread():
+    run_in_every_thread(CPU_POOL, warm_face_detector)
+
+    models = run_in_every_thread(CPU_POOL, lambda: get_face_detector().local.haar_cascade)
+    assert len({id(model) for model in models}) == POOL_SIZES[CPU_POOL]
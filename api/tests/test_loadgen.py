@@ -0,0 +1,22 @@
+import asyncio
+import argparse
+from unittest.mock import patch
+import services.verifyToken as verify_token_module
+from benchmarks import loadgen
+
+# a short in process replay, every session's predict and readings POST should succeed against the fake serving and insert
+def test_in_process_replay_has_no_errors():
+    args = argparse.Namespace(
+        users=40, speedup=3600, start=None, end=None, response_rate=1.0, reaction_mean=30, think=5, resolution=(320, 240),
+        timeout=30, target=None, token=None, serving_latency=0.0, db_latency=0.0, seed=0,
+    )
+    # use_test_token swaps the verification key, put it back afterwards
+    with patch.object(verify_token_module, 'JWT_PUBLIC_KEY', verify_token_module.JWT_PUBLIC_KEY), \
+         patch.object(verify_token_module, 'ALGORITHM', verify_token_module.ALGORITHM):
+        report = asyncio.run(loadgen.main(args))
+
+    endpoints = report['endpoints']
+    assert set(endpoints) == {'POST /api/predict', 'POST /api/readings'}
+    assert endpoints['POST /api/readings']['n'] > 0
+    for summary in endpoints.values():
+        assert summary['error_rate'] == 0
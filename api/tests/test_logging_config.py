@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from endpoints.log_levels import router as log_levels_router
+from services.executors import run_cpu_bound
+import services.logging_config as logging_config
+from services.logging_config import CorrelationFilter, JsonFormatter, RequestIdMiddleware, SamplingFilter, StructuredQueueHandler, parse_log_levels, request_id_var, set_log_level, task_id_var
+
+@pytest.fixture
+def log_queue():
+    return queue.SimpleQueue()
+
+@pytest.fixture
+def logger(log_queue):
+    handler = StructuredQueueHandler(log_queue)
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(SamplingFilter())
+    logger = logging.getLogger('tests.structured')
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    yield logger
+    logger.handlers = []
+
+def get_entries(log_queue):
+    entries = []
+    while not log_queue.empty():
+        entries.append(json.loads(JsonFormatter().format(log_queue.get())))
+    return entries
+
+
+def test_records_are_json_with_extras(logger, log_queue):
+    logger.info("Sent %d notifications", 3, extra={'clerk_id': 'user_a'})
+
+    entry, = get_entries(log_queue)
+    assert entry['message'] == 'Sent 3 notifications'
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'tests.structured'
+    assert entry['clerk_id'] == 'user_a'
+
+def test_records_carry_correlation_ids(logger, log_queue):
+    request_token = request_id_var.set('request-1')
+    task_token = task_id_var.set('task-1')
+    try:
+        logger.info("With ids")
+    finally:
+        request_id_var.reset(request_token)
+        task_id_var.reset(task_token)
+    logger.info("Without ids")
+
+    with_ids, without_ids = get_entries(log_queue)
+    assert with_ids['request_id'] == 'request-1'
+    assert with_ids['task_id'] == 'task-1'
+    assert 'request_id' not in without_ids
+
+def test_exceptions_are_kept(logger, log_queue):
+    try:
+        raise ValueError("bad value")
+    except ValueError:
+        logger.exception("Failed")
+
+    entry, = get_entries(log_queue)
+    assert 'ValueError: bad value' in entry['exception']
+
+def test_sampled_records(logger, log_queue):
+    with patch('services.logging_config.random.random', return_value=0.5):
+        logger.info("dropped", extra={'sample_rate': 0.1})
+        logger.info("kept", extra={'sample_rate': 0.9})
+        logger.error("errors are never sampled", extra={'sample_rate': 0.1})
+        logger.info("not sampled")
+
+    assert [entry['message'] for entry in get_entries(log_queue)] == ['kept', 'errors are never sampled', 'not sampled']
+
+def test_logging_does_not_wait_for_slow_output(logger, log_queue):
+    class SlowStream:
+        def write(self, text):
+            time.sleep(0.01)
+        def flush(self):
+            pass
+
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(SlowStream()))
+    listener.start()
+    started_at = time.perf_counter()
+    for i in range(50):
+        logger.info("message %d", i)
+    elapsed = time.perf_counter() - started_at
+    listener.stop()
+
+    # writing 50 records takes at least 0.5s, logging them should not
+    assert elapsed < 0.1
+
+def test_parse_log_levels():
+    assert parse_log_levels("services.celery=debug, db=WARNING,") == {'services.celery': 'DEBUG', 'db': 'WARNING'}
+
+def test_set_log_level():
+    set_log_level('tests.levels', 'debug')
+    assert logging.getLogger('tests.levels').level == logging.DEBUG
+
+def test_request_id_middleware():
+    app = FastAPI()
+    app.add_middleware(RequestIdMiddleware)
+
+    @app.get('/')
+    async def root():
+        return {'request_id': request_id_var.get()}
+
+    client = TestClient(app)
+    generated = client.get('/')
+    provided = client.get('/', headers={'X-Request-ID': 'abc123'})
+
+    assert generated.headers['x-request-id'] == generated.json()['request_id']
+    assert provided.headers['x-request-id'] == 'abc123'
+    assert provided.json()['request_id'] == 'abc123'
+
+def test_request_id_is_kept_in_executor_threads():
+    async def run():
+        request_id_var.set('request-2')
+        return await run_cpu_bound(request_id_var.get)
+
+    assert asyncio.run(run()) == 'request-2'
+
+def test_log_level_endpoint():
+    app = FastAPI()
+    app.include_router(log_levels_router)
+    client = TestClient(app)
+
+    with patch.dict('os.environ', {'LOG_ADMIN_SECRET': 'secret'}):
+        assert client.put('/debug/log-levels', json={'logger': 'tests.endpoint', 'level': 'debug'}).status_code == 403
+        response = client.put('/debug/log-levels', json={'logger': 'tests.endpoint', 'level': 'debug'}, headers={'X-Log-Admin': 'secret'})
+        invalid = client.put('/debug/log-levels', json={'logger': 'tests.endpoint', 'level': 'loud'}, headers={'X-Log-Admin': 'secret'})
+
+    assert response.status_code == 200
+    assert response.json()['tests.endpoint'] == 'DEBUG'
+    assert invalid.status_code == 400
+
+@pytest.fixture
+def root_logging():
+    root = logging.getLogger()
+    handlers, level, listener = root.handlers, root.level, logging_config._listener
+    yield
+    root.handlers, logging_config._listener = handlers, listener
+    root.setLevel(level)
+
+# the celery prefork children inherit the parent's listener without its thread, their records have to reach the output
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+def test_forked_process_logs_through_its_own_listener(root_logging):
+    logging_config.configure_logging_after_fork('INFO', open(os.devnull, 'w'))
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            logging_config.configure_logging_after_fork('INFO', os.fdopen(write_fd, 'w'))
+            logging.getLogger('tests.fork').info("Logged from the child")
+            logging_config.stop_logging()
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as output:
+        lines = output.read().splitlines()
+    os.waitpid(pid, 0)
+    logging_config.stop_logging()
+
+    assert [json.loads(line)['message'] for line in lines] == ["Logged from the child"]
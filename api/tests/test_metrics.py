@@ -0,0 +1,70 @@
+import asyncio
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from preprocessing.preprocessImage import greyscale, resize
+from services.celery.task_metrics import record_task_duration, record_task_start
+from services.forward_to_serving import forward_to_serving
+from services.metrics import timed_query
+from main import app
+
+def get_count(name, **labels):
+    return REGISTRY.get_sample_value(f'{name}_count', labels) or 0
+
+def test_preprocess_stages_are_timed():
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    greyscale_before = get_count('preprocess_stage_seconds', stage='greyscale')
+    resize_before = get_count('preprocess_stage_seconds', stage='resize')
+
+    resize(greyscale(image))
+
+    assert get_count('preprocess_stage_seconds', stage='greyscale') == greyscale_before + 1
+    assert get_count('preprocess_stage_seconds', stage='resize') == resize_before + 1
+
+def test_serving_round_trip_is_timed():
+    before = get_count('serving_request_seconds', stage='round_trip')
+    with patch('services.forward_to_serving.get_serving_session') as mock_session:
+        mock_session.return_value.post.return_value.json.return_value = {"predictions": [[0.1, 0.1, 0.1, 0.4, 0.1, 0.1, 0.1]]}
+        forward_to_serving(np.zeros((48, 48, 1)))
+
+    assert get_count('serving_request_seconds', stage='round_trip') == before + 1
+
+def test_timed_query_uses_function_name():
+    @timed_query
+    async def select_something(session):
+        return 'result'
+
+    before = get_count('db_query_seconds', query='select_something')
+
+    assert asyncio.run(select_something(None)) == 'result'
+    assert select_something.__name__ == 'select_something'
+    assert get_count('db_query_seconds', query='select_something') == before + 1
+
+def test_timed_query_records_failures():
+    @timed_query
+    async def select_failing(session):
+        raise ValueError("query failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(select_failing(None))
+    assert get_count('db_query_seconds', query='select_failing') == 1
+
+def test_celery_task_duration_is_recorded():
+    task = MagicMock()
+    task.name = 'services.celery.tasks.dispatch_due_notifications'
+    before = get_count('celery_task_seconds', task=task.name, state='SUCCESS')
+
+    record_task_start(task_id='task-1')
+    record_task_duration(task_id='task-1', task=task, state='SUCCESS')
+
+    assert get_count('celery_task_seconds', task=task.name, state='SUCCESS') == before + 1
+
+def test_metrics_endpoint():
+    response = TestClient(app).get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'preprocess_stage_seconds' in response.text
+    assert 'db_query_seconds' in response.text
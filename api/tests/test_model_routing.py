@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from prometheus_client import REGISTRY
+import services.model_routing
+from services.model_routing import choose_model_version, get_model_versions, get_predict_url, run_shadow, submit_shadow
+
+PREDICT_URL = 'http://serving:8501/v1/models/emotion:predict'
+# two images, the shadow agrees on the first only
+PREDICTIONS = np.array([[0.1, 0.1, 0.1, 0.4, 0.1, 0.1, 0.1], [0.5, 0.1, 0.1, 0.1, 0.1, 0.05, 0.05]])
+SHADOW_PREDICTIONS = [[0.0, 0.0, 0.0, 0.9, 0.1, 0.0, 0.0], [0.1, 0.1, 0.1, 0.1, 0.1, 0.1, 0.4]]
+
+def shadow_count(result, model_version='canary'):
+    return REGISTRY.get_sample_value('shadow_predictions_total', {'model_version': model_version, 'result': result}) or 0
+
+@pytest.fixture
+def images():
+    return [np.zeros((48, 48, 1)) for _ in range(2)]
+
+
+def test_get_model_versions():
+    with patch.dict(os.environ, {'MODEL_VERSIONS': '1=90, 2=10,canary'}):
+        assert get_model_versions() == {'1': 90.0, '2': 10.0, 'canary': 1.0}
+    with patch.dict(os.environ, {'MODEL_VERSIONS': ''}):
+        assert get_model_versions() == {}
+        assert choose_model_version() is None
+
+def test_get_model_versions_invalid_weight():
+    with patch.dict(os.environ, {'MODEL_VERSIONS': '1=-1'}), pytest.raises(ValueError):
+        get_model_versions()
+
+def test_choose_model_version_by_weight():
+    with patch.dict(os.environ, {'MODEL_VERSIONS': '1=3,2=1'}):
+        chosen = [choose_model_version() for _ in range(4000)]
+
+    assert set(chosen) == {'1', '2'}
+    assert 0.7 < chosen.count('1') / len(chosen) < 0.8
+
+@pytest.mark.parametrize('model_version, url', [
+    (None, PREDICT_URL),
+    ('2', 'http://serving:8501/v1/models/emotion/versions/2:predict'),
+    ('canary', 'http://serving:8501/v1/models/emotion/labels/canary:predict'),
+])
+def test_get_predict_url(model_version, url):
+    with patch.dict(os.environ, {'MODEL_PREDICT_URL': PREDICT_URL}):
+        assert get_predict_url(model_version) == url
+
+def test_no_shadow_without_version(images):
+    with patch.dict(os.environ, {'MODEL_SHADOW_VERSION': ''}), patch('services.model_routing.get_executor') as get_executor:
+        assert not submit_shadow(images, PREDICTIONS)
+    get_executor.assert_not_called()
+
+def test_shadow_sampled_by_rate(images):
+    with patch.dict(os.environ, {'MODEL_SHADOW_VERSION': 'canary', 'MODEL_SHADOW_RATE': '0'}), \
+         patch('services.model_routing.get_executor') as get_executor:
+        assert not submit_shadow(images, PREDICTIONS)
+    get_executor.assert_not_called()
+
+# shadow requests past the limit are dropped, never queued behind the ones running
+def test_shadow_dropped_when_too_many_pending(images):
+    dropped_before = shadow_count('dropped')
+    with patch.dict(os.environ, {'MODEL_SHADOW_VERSION': 'canary'}), \
+         patch.object(services.model_routing, '_shadow_pending', services.model_routing.SHADOW_MAX_PENDING), \
+         patch('services.model_routing.get_executor') as get_executor:
+        assert not submit_shadow(images, PREDICTIONS)
+
+    get_executor.assert_not_called()
+    assert shadow_count('dropped') == dropped_before + 2
+
+def test_run_shadow_counts_agreement(images):
+    session = MagicMock()
+    session.post.return_value.json.return_value = {'predictions': SHADOW_PREDICTIONS}
+    agree_before, disagree_before = shadow_count('agree'), shadow_count('disagree')
+
+    with patch.dict(os.environ, {'MODEL_PREDICT_URL': PREDICT_URL}), \
+         patch('services.model_routing.get_shadow_session', return_value=session), \
+         patch.object(services.model_routing, '_shadow_pending', 1):
+        run_shadow('canary', images, PREDICTIONS)
+        assert services.model_routing._shadow_pending == 0
+
+    assert session.post.call_args.args[0] == 'http://serving:8501/v1/models/emotion/labels/canary:predict'
+    assert len(session.post.call_args.kwargs['json']['instances']) == 2
+    assert shadow_count('agree') == agree_before + 1
+    assert shadow_count('disagree') == disagree_before + 1
+
+def test_run_shadow_error(images):
+    session = MagicMock()
+    session.post.side_effect = ConnectionError('serving down')
+    errors_before = shadow_count('error')
+
+    with patch.dict(os.environ, {'MODEL_PREDICT_URL': PREDICT_URL}), \
+         patch('services.model_routing.get_shadow_session', return_value=session), \
+         patch.object(services.model_routing, '_shadow_pending', 1):
+        run_shadow('canary', images, PREDICTIONS)
+        assert services.model_routing._shadow_pending == 0
+
+    assert shadow_count('error') == errors_before + 2
@@ -0,0 +1,46 @@
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, MagicMock, patch
+from endpoints.models import accuracy_interval
+from main import app
+
+@pytest.fixture
+def accuracy():
+    session = MagicMock()
+    session.__aenter__.return_value = session
+    versions = [
+        {'model_version': None, 'readings': 40, 'accurate': 20},
+        {'model_version': '2', 'readings': 200, 'accurate': 150},
+    ]
+    with patch('endpoints.models.read_session', return_value=session), \
+         patch('endpoints.models.select_model_accuracy', AsyncMock(return_value=versions)) as select_model_accuracy, \
+         patch('endpoints.models.verify_token', return_value={'valid': True}):
+        yield select_model_accuracy
+
+def get_accuracy(**params):
+    return TestClient(app).get('/api/models/accuracy', params=params, headers={'Authorization': 'Bearer token'})
+
+
+def test_model_accuracy(accuracy):
+    response = get_accuracy(days=7)
+
+    assert response.status_code == 200
+    assert response.json()['days'] == 7
+    unversioned, version = response.json()['versions']
+    assert unversioned['model_version'] is None and unversioned['accuracy'] == 0.5
+    assert version['model_version'] == '2' and version['accuracy'] == 0.75
+    assert version['interval'][0] < 0.75 < version['interval'][1]
+
+def test_model_accuracy_invalid_days(accuracy):
+    assert get_accuracy(days=0).status_code == 422
+    accuracy.assert_not_called()
+
+# the interval narrows as a version gets more feedback and stays inside 0-1
+def test_accuracy_interval():
+    low, high = accuracy_interval(15, 20)
+    more_low, more_high = accuracy_interval(750, 1000)
+
+    assert low < more_low < 0.75 < more_high < high
+    assert accuracy_interval(0, 10)[0] == 0.0
+    assert accuracy_interval(10, 10)[1] == 1.0
+    assert accuracy_interval(0, 0) == [0.0, 1.0]
@@ -1,6 +1,11 @@
+import bisect
 import pytest
-from datetime import datetime, timezone, time
-from services.celery.notification_schedule_helpers import get_random_notification_times, iso_time_to_datetime_with_todays_date
+import random
+from datetime import date, datetime, timedelta, timezone, time
+from unittest.mock import MagicMock, patch
+from db.queries import claim_due_notification_slots
+from services.celery.tasks import DISPATCH_BATCH_SIZE, NOTIFICATION_BATCH_SIZE, dispatch_due_notifications
+from services.celery.notification_schedule_helpers import get_notification_window, get_random_notification_times, iso_time_to_datetime_with_todays_date, plan_notification_slots
 
 @pytest.fixture
 def today():
@@ -87,4 +92,103 @@ def test_get_random_notification_times_invalid_range():
         get_random_notification_times(start_datetime, end_datetime)
 
 
+def test_get_notification_window_same_day():
+    start_datetime, end_datetime = get_notification_window(date(2023, 1, 1), time(9, 0), time(17, 0))
+
+    assert start_datetime == datetime(2023, 1, 1, 9, 0, tzinfo=timezone.utc)
+    assert end_datetime == datetime(2023, 1, 1, 17, 0, tzinfo=timezone.utc)
+
+def test_get_notification_window_overnight():
+    start_datetime, end_datetime = get_notification_window(date(2023, 1, 1), time(22, 0), time(2, 0))
+
+    assert start_datetime == datetime(2023, 1, 1, 22, 0, tzinfo=timezone.utc)
+    assert end_datetime == datetime(2023, 1, 2, 2, 0, tzinfo=timezone.utc), "window should run over into the next day"
+
+def test_plan_notification_slots_skips_users_without_window():
+    users = [("user_a", time(9, 0), time(17, 0)), ("user_b", None, None)]
+
+    slots = plan_notification_slots(users, date(2023, 1, 1))
+
+    assert len(slots) == 3
+    assert {slot["clerk_id"] for slot in slots} == {"user_a"}
+    assert [slot["slot_index"] for slot in slots] == [0, 1, 2]
+
+def test_plan_notification_slots_not_before():
+    users = [("user_a", time(9, 0), time(17, 0))]
+    not_before = datetime(2023, 1, 1, 13, 0, tzinfo=timezone.utc)
+
+    slots = plan_notification_slots(users, date(2023, 1, 1), not_before=not_before)
+
+    assert all(slot["send_at"] > not_before for slot in slots), "slots before not_before should be dropped"
+
+# simulate a day of the minute by minute dispatcher for 100k users
+# dispatch_due_notifications runs every simulated minute, with run_query standing in for claim_due_notification_slots on a
+# list of the slots sorted by send_at like the partial index, and the fanned out batches collected instead of sent
+def test_dispatcher_simulation_100k_users():
+    random.seed(42)
+    day = date(2023, 1, 1)
+    users = []
+    for i in range(100_000):
+        start_hour = random.randint(0, 23)
+        length_hours = random.randint(1, 16)
+        users.append((f"user_{i}", time(start_hour, random.choice([0, 30])), time((start_hour + length_hours) % 24, 0)))
+
+    slots = plan_notification_slots(users, day)
+    assert len(slots) == 300_000
+
+    pending = sorted(slots, key=lambda slot: slot["send_at"])
+    send_times = [slot["send_at"] for slot in pending]
+    claimed = 0
+    claims_per_tick = []
+
+    def run_query(query, now, limit):
+        nonlocal claimed
+        assert query is claim_due_notification_slots
+        due = min(bisect.bisect_right(send_times, now, lo=claimed), claimed + limit)
+        clerk_ids = [slot["clerk_id"] for slot in pending[claimed:due]]
+        claimed = due
+        claims_per_tick[-1] += 1
+        return clerk_ids
+
+    clock = datetime.combine(day, time(0, 0), tzinfo=timezone.utc)
+
+    class SimulatedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock
+
+    # (clerk_ids, scheduled_for) of every send_notification_batch the dispatcher fans out
+    batches = []
+
+    def group(signatures):
+        batches.extend(signature.args for signature in signatures)
+        return MagicMock()
+
+    dispatched_per_tick = []
+    with patch('services.celery.tasks.run_query', side_effect=run_query), \
+         patch('services.celery.tasks.datetime', SimulatedDatetime), \
+         patch('services.celery.tasks.group', side_effect=group):
+        # overnight windows run into the next day so simulate up to two days of ticks
+        while claimed < len(pending):
+            clock += timedelta(minutes=1)
+            assert clock <= datetime.combine(day + timedelta(days=2), time(0, 0), tzinfo=timezone.utc)
+            claims_per_tick.append(0)
+            dispatched_per_tick.append(dispatch_due_notifications())
+
+    assert sum(dispatched_per_tick) == 300_000, "every slot should be dispatched exactly once"
+    sent = [clerk_id for batch, _ in batches for clerk_id in batch]
+    assert sorted(sent) == sorted(slot["clerk_id"] for slot in slots)
+    # one dispatcher run a minute, not one eta message per notification
+    assert len(dispatched_per_tick) <= 2 * 24 * 60
+    # each tick is at most a few hundred notifications, one claim and a few batches
+    assert max(dispatched_per_tick) < DISPATCH_BATCH_SIZE
+    assert max(claims_per_tick) == 1
+    assert all(len(batch) <= NOTIFICATION_BATCH_SIZE for batch, _ in batches)
+
+    per_user = {}
+    for slot in slots:
+        per_user.setdefault(slot["clerk_id"], []).append(slot["send_at"])
+    for clerk_id, start_time, end_time in users[:1000]:
+        start_datetime, end_datetime = get_notification_window(day, start_time, end_time)
+        assert all(start_datetime <= send_at <= end_datetime for send_at in per_user[clerk_id])
 
@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+import pytest
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.celery.notification_sender import NotificationSender, TokenBucket
+
+# local stand in for the Native Notify api, counts requests and the connections they arrive on
+class FakeNotificationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fail_first=0, status_code=201):
+        super().__init__(('127.0.0.1', 0), FakeNotificationHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.fail_first = fail_first
+        self.status_code = status_code
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/api/indie/notification'
+
+class FakeNotificationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep alive so connection reuse can be measured
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests.append(body['subID'])
+            status_code = 503 if len(self.server.requests) <= self.server.fail_first else self.server.status_code
+        self.send_response(status_code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def fake_server(request):
+    server = FakeNotificationServer(**getattr(request, 'param', {}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=200, capacity=10)
+    started_at = time.perf_counter()
+    for _ in range(110):
+        bucket.acquire()
+    elapsed = time.perf_counter() - started_at
+
+    # first 10 tokens are available straight away, the other 100 refill at 200/s
+    assert elapsed >= 0.45
+
+
+def test_send_batch_reuses_connections(fake_server):
+    sender = NotificationSender(url=fake_server.url, max_concurrency=4, rate_per_second=10_000)
+    clerk_ids = [f'user_{i}' for i in range(200)]
+
+    result = sender.send_batch(clerk_ids)
+
+    assert result['sent'] == 200
+    assert result['failed'] == []
+    assert sorted(fake_server.requests) == sorted(clerk_ids)
+    # a new connection per notification would mean 200 connections
+    assert fake_server.connections <= 4
+    print(f"\nThroughput: {result['sent'] / result['duration_seconds']:.0f} notifications/s")
+
+
+@pytest.mark.parametrize('fake_server', [{'fail_first': 2}], indirect=True)
+def test_send_batch_retries_transient_failures(fake_server):
+    sender = NotificationSender(url=fake_server.url, max_concurrency=1, rate_per_second=10_000, backoff_seconds=0.01)
+
+    result = sender.send_batch(['user_a'])
+
+    assert result['sent'] == 1
+    assert fake_server.requests == ['user_a', 'user_a', 'user_a'], "two 503s should be retried"
+
+
+@pytest.mark.parametrize('fake_server', [{'status_code': 400}], indirect=True)
+def test_send_batch_does_not_retry_permanent_failures(fake_server):
+    sender = NotificationSender(url=fake_server.url, max_concurrency=2, rate_per_second=10_000, backoff_seconds=0.01)
+
+    result = sender.send_batch(['user_a', 'user_b'])
+
+    assert result['sent'] == 0
+    assert sorted(result['failed']) == ['user_a', 'user_b']
+    assert len(fake_server.requests) == 2
+
+
+def test_send_batch_gives_up_when_server_is_down():
+    # nothing is listening on this port
+    sender = NotificationSender(url='http://127.0.0.1:9/notify', max_retries=1, backoff_seconds=0.01, timeout_seconds=1)
+
+    result = sender.send_batch(['user_a'])
+
+    assert result['failed'] == ['user_a']
+
+def test_backoff_is_capped():
+    sender = NotificationSender(backoff_seconds=1, max_backoff_seconds=30)
+
+    assert sender.get_backoff(0, SimpleNamespace(headers={'Retry-After': '5'})) == 5
+    assert sender.get_backoff(0, SimpleNamespace(headers={'Retry-After': '86400'})) == 30
+    assert sender.get_backoff(10) == 30
+
+
+def test_send_batch_leaves_users_unsent_after_deadline(fake_server):
+    sender = NotificationSender(url=fake_server.url, max_concurrency=2, rate_per_second=10_000)
+
+    result = sender.send_batch(['user_a', 'user_b'], deadline=time.monotonic() - 1)
+
+    assert result['sent'] == 0
+    assert result['failed'] == []
+    assert result['unsent'] == ['user_a', 'user_b']
+    assert fake_server.requests == []
+
+
+# a retry whose backoff would run past the deadline isn't waited for
+@pytest.mark.parametrize('fake_server', [{'fail_first': 100}], indirect=True)
+def test_send_stops_retrying_at_deadline(fake_server):
+    sender = NotificationSender(url=fake_server.url, max_concurrency=1, rate_per_second=10_000, backoff_seconds=5)
+
+    started_at = time.monotonic()
+    result = sender.send_batch(['user_a'], deadline=started_at + 1)
+
+    assert time.monotonic() - started_at < 1
+    assert result['failed'] == ['user_a']
+    assert fake_server.requests == ['user_a']
@@ -0,0 +1,121 @@
+import asyncio
+import gzip
+import os
+import pytest
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+from db.models import Reading
+from db.partitions import (
+    add_months, archive_partition, get_months_to_archive, get_months_to_create, get_partition_bounds, get_partition_name,
+    maintain_partitions, parse_partition_name,
+)
+from db.queries import select_readings_for_export
+
+def test_add_months_across_years():
+    assert add_months(date(2024, 11, 1), 3) == date(2025, 2, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+def test_partition_name_round_trip():
+    assert get_partition_name(date(2024, 3, 1)) == 'readings_2024_03'
+    assert parse_partition_name('readings_2024_03') == date(2024, 3, 1)
+    assert parse_partition_name('readings_default') is None
+
+def test_partition_bounds_are_utc_months():
+    start, end = get_partition_bounds(date(2024, 12, 1))
+
+    assert start == datetime(2024, 12, 1, tzinfo=timezone.utc)
+    assert end == datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+def test_months_to_create_skips_existing():
+    existing = {date(2024, 3, 1), date(2024, 4, 1)}
+
+    assert get_months_to_create(existing, date(2024, 3, 15), ahead=3) == [date(2024, 5, 1), date(2024, 6, 1)]
+
+def test_months_to_archive():
+    existing = {date(2023, 12, 1), date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)}
+
+    # this month and the two before it are kept
+    assert get_months_to_archive(existing, date(2024, 3, 15), retention_months=2) == [date(2023, 12, 1)]
+    assert get_months_to_archive(existing, date(2024, 3, 15), retention_months=1) == [date(2023, 12, 1), date(2024, 1, 1)]
+    assert get_months_to_archive(existing, date(2024, 3, 15), retention_months=0) == []
+
+def test_readings_table_is_partitioned():
+    ddl = str(CreateTable(Reading.__table__).compile(dialect=postgresql.dialect()))
+
+    assert 'PARTITION BY RANGE (datetime)' in ddl
+    assert 'PRIMARY KEY (reading_id, datetime)' in ddl
+
+def test_export_query_range():
+    query = str(select_readings_for_export(start=datetime(2024, 1, 1), end=datetime(2024, 2, 1)))
+
+    assert 'readings.datetime >=' in query
+    assert 'readings.datetime <' in query
+
+def test_maintain_partitions_moves_stray_months():
+    session = AsyncMock()
+    existing = {date(2024, 3, 1), date(2024, 4, 1), date(2024, 5, 1), date(2024, 6, 1)}
+    with patch('db.partitions.select_partition_months', AsyncMock(return_value=existing)), \
+         patch('db.partitions.select_default_partition_months', AsyncMock(return_value={date(2030, 1, 1)})), \
+         patch('db.partitions.create_partition', AsyncMock()) as mock_create, \
+         patch('db.partitions.archive_partition', AsyncMock()) as mock_archive, \
+         patch('db.partitions.RETENTION_MONTHS', 0):
+        result = asyncio.run(maintain_partitions(session, date(2024, 3, 15)))
+
+    # the coming months already exist, only the month a reading strayed into is created
+    assert result == {'created': ['readings_2030_01'], 'archived': []}
+    mock_create.assert_awaited_once_with(session, date(2030, 1, 1))
+    mock_archive.assert_not_awaited()
+
+# a session that counts the partition's rows and records the ddl it's sent
+class FakeSession:
+    def __init__(self, count: int):
+        self.count = count
+        self.statements = []
+        self.committed = self.rolled_back = False
+
+    async def execute(self, statement, *args):
+        self.statements.append(str(statement))
+        return MagicMock(scalar_one=MagicMock(return_value=self.count))
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        self.rolled_back = True
+
+def patch_readings(rows: list):
+    async def stream_readings_for_export(session, clerk_id, batch_size, start=None, end=None):
+        yield rows
+    return patch('db.queries.stream_readings_for_export', stream_readings_for_export)
+
+def make_rows(count: int) -> list:
+    return [
+        SimpleNamespace(
+            reading_id=i, clerk_id='user_1', datetime=datetime(2024, 1, 1, tzinfo=timezone.utc), emotion='Happy',
+            location=None, note=None, confidence=None, probabilities=None,
+        )
+        for i in range(count)
+    ]
+
+def test_archive_partition(tmp_path):
+    session = FakeSession(count=3)
+    with patch_readings(make_rows(3)):
+        result = asyncio.run(archive_partition(session, date(2024, 1, 1), str(tmp_path), 'csv.gz'))
+
+    assert result == {'partition': 'readings_2024_01', 'path': str(tmp_path / 'readings_2024_01.csv.gz'), 'rows': 3}
+    with gzip.open(result['path'], 'rt') as file:
+        assert len(file.read().splitlines()) == 4
+    assert 'DETACH PARTITION readings_2024_01' in session.statements[-2]
+    assert session.committed
+
+def test_archive_keeps_partition_when_rows_are_missing(tmp_path):
+    session = FakeSession(count=5)
+    with patch_readings(make_rows(3)), pytest.raises(RuntimeError):
+        asyncio.run(archive_partition(session, date(2024, 1, 1), str(tmp_path), 'csv.gz'))
+
+    assert session.rolled_back and not session.committed
+    assert not any('DROP TABLE' in statement for statement in session.statements)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from benchmarks.harness import FakeServingServer, make_face_image, to_base64_jpeg
+from main import app
+
+@pytest.fixture
+def serving():
+    with FakeServingServer() as serving, patch.dict(os.environ, {'MODEL_PREDICT_URL': serving.url}):
+        yield serving
+
+@pytest.fixture
+def client(serving):
+    with patch('endpoints.predict.verify_token', return_value={'valid': True}):
+        yield TestClient(app)
+
+@pytest.fixture
+def frames():
+    return [to_base64_jpeg(make_face_image(480, 640, seed=seed)) for seed in range(4)]
+
+@pytest.fixture
+def blank_frame():
+    return to_base64_jpeg(make_face_image(480, 640, face_ratio=0.0))
+
+def predict_burst(client, frames, **body):
+    return client.post('/api/predict/burst', json={'frames': frames, **body}, headers={'Authorization': 'Bearer token'})
+
+
+def test_predict(client, serving, frames):
+    response = client.post('/api/predict', json={'image': frames[0]}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 200
+    assert set(response.json()) == {'prediction', 'confidence', 'probabilities', 'model_version'}
+    assert response.json()['model_version'] is None
+    assert serving.paths == ['/v1/models/emotion:predict']
+    probabilities = response.json()['probabilities']
+    assert len(probabilities) == 7
+    assert max(probabilities) == response.json()['confidence']
+
+def test_predict_top_k(client, serving, frames):
+    response = client.post('/api/predict', json={'image': frames[0], 'top_k': 3}, headers={'Authorization': 'Bearer token'})
+
+    top = response.json()['top']
+    assert len(top) == 3
+    assert top[0] == {'emotion': response.json()['prediction'], 'probability': response.json()['confidence']}
+    assert top[0]['probability'] >= top[1]['probability'] >= top[2]['probability']
+    assert serving.request_count == 1
+
+def test_predict_invalid_top_k(client, serving, frames):
+    for top_k in (0, 8):
+        response = client.post('/api/predict', json={'image': frames[0], 'top_k': top_k}, headers={'Authorization': 'Bearer token'})
+        assert response.status_code == 422
+    assert serving.request_count == 0
+
+def test_predict_serving_error(client, frames):
+    with patch.dict(os.environ, {'MODEL_PREDICT_URL': 'http://127.0.0.1:1/v1/models/emotion:predict'}):
+        response = client.post('/api/predict', json={'image': frames[0]}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 500
+
+def test_burst_is_one_serving_request(client, serving, frames):
+    response = predict_burst(client, frames)
+
+    assert response.status_code == 200
+    assert response.json()['frames'] == 4
+    assert response.json()['frames_used'] == 4
+    assert 0 < response.json()['confidence'] <= 1
+    assert serving.request_count == 1
+
+def test_burst_majority(client, serving, frames):
+    response = predict_burst(client, frames, aggregation='majority')
+
+    assert response.status_code == 200
+    assert response.json()['agreement'] >= 0.25
+
+def test_burst_top_k(client, serving, frames):
+    response = predict_burst(client, frames, top_k=2)
+
+    assert response.status_code == 200
+    assert len(response.json()['probabilities']) == 7
+    assert [emotion['emotion'] for emotion in response.json()['top']][0] == response.json()['prediction']
+
+def test_burst_skips_frames_without_a_face(client, serving, frames, blank_frame):
+    response = predict_burst(client, [blank_frame, frames[0], 'not an image'])
+
+    assert response.status_code == 200
+    assert response.json()['frames'] == 3
+    assert response.json()['frames_used'] == 1
+
+def test_burst_without_any_face(client, serving, blank_frame):
+    response = predict_burst(client, [blank_frame, blank_frame])
+
+    assert response.status_code == 400
+    assert 'No face detected' in response.json()['error']
+    assert serving.request_count == 0
+
+def test_burst_frame_limit(client, serving, frames):
+    with patch('endpoints.predict.MAX_BURST_FRAMES', 3):
+        response = predict_burst(client, frames)
+
+    assert response.status_code == 400
+    assert serving.request_count == 0
+
+def test_burst_needs_frames(client, serving):
+    assert predict_burst(client, []).status_code == 422
+    assert predict_burst(client, ['frame'], aggregation='median').status_code == 422
+
+def test_burst_invalid_token(serving, frames):
+    with patch('endpoints.predict.verify_token', return_value={'valid': False, 'message': 'Invalid token'}):
+        response = predict_burst(TestClient(app), frames)
+
+    assert response.status_code == 401
+    assert serving.request_count == 0
+
+def test_burst_serving_error(client, frames):
+    with patch.dict(os.environ, {'MODEL_PREDICT_URL': 'http://127.0.0.1:1/v1/models/emotion:predict'}):
+        response = predict_burst(client, frames[:2])
+
+    assert response.status_code == 500
+
+def test_predict_routes_to_model_version(client, serving, frames):
+    with patch.dict(os.environ, {'MODEL_VERSIONS': '1=0,2=1'}):
+        response = client.post('/api/predict', json={'image': frames[0]}, headers={'Authorization': 'Bearer token'})
+        burst_response = predict_burst(client, frames)
+
+    assert response.json()['model_version'] == '2'
+    assert burst_response.json()['model_version'] == '2'
+    assert serving.paths == ['/v1/models/emotion/versions/2:predict'] * 2
+
+# the response is sent while the shadow request is still waiting to run
+def test_predict_does_not_wait_for_shadow(client, serving, frames):
+    release = threading.Event()
+    shadowed = []
+
+    def run_shadow(model_version, images, predictions):
+        release.wait(5)
+        shadowed.append((model_version, len(images), predictions.shape))
+
+    with patch.dict(os.environ, {'MODEL_SHADOW_VERSION': 'canary'}), patch('services.model_routing.run_shadow', run_shadow):
+        response = predict_burst(client, frames)
+        assert response.status_code == 200
+        assert shadowed == []
+        release.set()
+        for _ in range(50):
+            if shadowed:
+                break
+            time.sleep(0.01)
+
+    assert shadowed == [('canary', 4, (4, 7))]
+    assert serving.request_count == 1
@@ -2,7 +2,11 @@ import base64
 import cv2
 import pytest
 import numpy as np
-from preprocessing.preprocessImage import PreprocessingError, b64_to_numpy, detect_and_crop_to_face, find_largest_face, greyscale, resize
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from benchmarks.harness import make_face_image, to_base64_jpeg
+from preprocessing.faceDetectors import detect_faces
+from preprocessing.preprocessImage import PreprocessingError, b64_to_numpy, check_quality, detect_and_crop_to_face, find_largest_face, get_sharpness, greyscale, preprocess, resize
 
 @pytest.fixture
 def dummy_rgb_image():
@@ -53,6 +57,12 @@ def test_greyscale_invalid_input():
     
     
 
+def test_find_largest_face_array():
+    faces = np.array([[10, 10, 50, 50], [20, 20, 100, 100], [5, 5, 100, 100]], dtype=np.int32)
+    # the first of equally large faces is kept
+    assert find_largest_face(faces) == (20, 20, 100, 100)
+    assert find_largest_face(np.empty((0, 4), dtype=np.int32)) == None
+
 def test_find_largest_face():
     faces = [(10, 10, 50, 50), (20, 20, 100, 100), (30, 30, 30, 30)]
     assert find_largest_face(faces) == (20, 20, 100, 100)
@@ -61,7 +71,35 @@ def test_find_largest_face():
     assert find_largest_face(faces) == None
     
 
-# Valid test case not included for detect_and_crop_to_face as it requires a valid image to detect face
+# face box found by the search used before it was sized to the image, every scale from 60px up
+def full_search_box(image: np.ndarray) -> tuple:
+    haar_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    faces = haar_cascade.detectMultiScale(image, scaleFactor=1.1, minNeighbors=5, minSize=(60, 60))
+    return tuple(max(faces, key=lambda face: face[2] * face[3]))
+
+def full_search_crop(image: np.ndarray) -> np.ndarray:
+    x, y, w, h = full_search_box(image)
+    return image[y:y+h, x:x+w]
+
+@pytest.mark.parametrize('width, height, face_ratio', [
+    (480, 640, 0.3), (480, 640, 0.5), (480, 640, 0.7), (960, 1280, 0.5), (1440, 1920, 0.5), (3024, 4032, 0.3),
+])
+def test_detect_and_crop_to_face_matches_full_search(width, height, face_ratio):
+    grey_image = cv2.cvtColor(make_face_image(width, height, face_ratio=face_ratio), cv2.COLOR_BGR2GRAY)
+
+    np.testing.assert_array_equal(detect_and_crop_to_face(grey_image), full_search_crop(grey_image))
+
+# skipping the small scales leaves fewer overlapping windows to group, so on other images the box can move a few pixels
+@pytest.mark.parametrize('seed', [1, 2, 3])
+@pytest.mark.parametrize('width, height, face_ratio', [(1440, 1920, 0.3), (1440, 1920, 0.7), (3024, 4032, 0.5)])
+def test_detect_and_crop_to_face_close_to_full_search(width, height, face_ratio, seed):
+    grey_image = cv2.cvtColor(make_face_image(width, height, face_ratio=face_ratio, seed=seed), cv2.COLOR_BGR2GRAY)
+    x, y, w, h = find_largest_face(detect_faces(grey_image))
+    fx, fy, fw, fh = full_search_box(grey_image)
+
+    intersection = max(0, min(x + w, fx + fw) - max(x, fx)) * max(0, min(y + h, fy + fh) - max(y, fy))
+    assert intersection / (w * h + fw * fh - intersection) > 0.9
+
 def test_detect_and_crop_to_face_no_face(dummy_rgb_image):
     grey_image = cv2.cvtColor(dummy_rgb_image, cv2.COLOR_BGR2GRAY)
 
@@ -97,3 +135,88 @@ def test_resize_invalid_input():
     with pytest.raises(PreprocessingError) as e:
         resize(invalid_input)
     assert "Error in resizing image" in str(e.value)
+
+
+# the quality gate, the face cropped from a synthetic photo passes unless it's made dark, bright or blurry
+def quality_face(width=480, height=640, transform=lambda image: image, face_ratio=0.5):
+    grey_image = transform(cv2.cvtColor(make_face_image(width, height, face_ratio=face_ratio), cv2.COLOR_BGR2GRAY))
+    x, y, w, h = find_largest_face(detect_faces(grey_image))
+    return grey_image.shape, (x, y, w, h), grey_image[y:y+h, x:x+w]
+
+def quality_checks(check, result):
+    return REGISTRY.get_sample_value('preprocess_quality_checks_total', {'check': check, 'result': result}) or 0
+
+@pytest.mark.parametrize('width, height', [(480, 640), (1440, 1920), (3024, 4032)])
+def test_preprocess_passes_quality_gate(width, height):
+    image = to_base64_jpeg(make_face_image(width, height))
+
+    assert preprocess(image).shape == (48, 48, 1)
+
+@pytest.mark.parametrize('transform, message', [
+    (lambda image: (image * 0.2).astype(np.uint8), "too dark"),
+    (lambda image: cv2.add(image, 180), "too bright"),
+    (lambda image: cv2.GaussianBlur(image, (0, 0), 25), "blurry"),
+])
+def test_check_quality_rejects(transform, message):
+    image_shape, face_box, face = quality_face(transform=transform)
+
+    with pytest.raises(PreprocessingError) as e:
+        check_quality(image_shape, face_box, face)
+    assert message in e.value.user_message
+
+# a couple of pixels of shake in a high resolution close up, it's gone once the face is shrunk to 48x48
+@pytest.mark.parametrize('width, height, sigma', [(1440, 1920, 1.5), (3024, 4032, 1.5), (3024, 4032, 2)])
+def test_check_quality_rejects_mildly_blurred_large_face(width, height, sigma):
+    image_shape, face_box, face = quality_face(width, height, transform=lambda image: cv2.GaussianBlur(image, (0, 0), sigma))
+
+    # measured on the 48x48 face it looks sharp
+    assert cv2.Laplacian(resize(face), cv2.CV_64F).var() > 200
+    with pytest.raises(PreprocessingError) as e:
+        check_quality(image_shape, face_box, face)
+    assert "blurry" in e.value.user_message
+
+@pytest.mark.parametrize('width, height', [(240, 320), (480, 640), (1440, 1920), (3024, 4032)])
+def test_sharpness_of_sharp_face_similar_at_any_resolution(width, height):
+    _, _, face = quality_face(width, height)
+
+    assert 150 < get_sharpness(face) < 1000
+
+@pytest.mark.parametrize('image_shape, face_box', [
+    # smaller than the model's input
+    ((640, 480), (0, 0, 40, 40)),
+    # a large enough face far from the camera in a high resolution photo
+    ((4032, 3024), (0, 0, 200, 200)),
+])
+def test_check_quality_rejects_small_face(image_shape, face_box):
+    _, _, face = quality_face()
+
+    with pytest.raises(PreprocessingError) as e:
+        check_quality(image_shape, face_box, face)
+    assert "too small" in e.value.user_message
+
+# the detector finds faces down to a fifth of the short side, the gate asks for more
+def test_check_quality_rejects_detected_face_far_from_camera():
+    image_shape, face_box, face = quality_face(face_ratio=0.2)
+
+    with pytest.raises(PreprocessingError) as e:
+        check_quality(image_shape, face_box, face)
+    assert "too small" in e.value.user_message
+
+def test_check_quality_counts_every_check():
+    _, _, face = quality_face(transform=lambda image: (image * 0.2).astype(np.uint8))
+    before = {check: quality_checks(check, 'fail') for check in ('face_size', 'brightness')}
+    passed_before = quality_checks('face_ratio', 'pass')
+
+    with pytest.raises(PreprocessingError):
+        check_quality((150, 100), (0, 0, 40, 40), face)
+
+    # the face size is reported to the user, the brightness failure is still counted
+    assert quality_checks('face_size', 'fail') == before['face_size'] + 1
+    assert quality_checks('brightness', 'fail') == before['brightness'] + 1
+    assert quality_checks('face_ratio', 'pass') == passed_before + 1
+
+def test_check_quality_threshold_turned_off():
+    _, face_box, face = quality_face()
+
+    with patch('preprocessing.preprocessImage.QUALITY_MIN_FACE_RATIO', 0):
+        check_quality((4032, 3024), face_box, face)
@@ -0,0 +1,129 @@
+import time
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from services.profiling import ProfileStore, ProfilingMiddleware, SamplingProfiler, router
+
+SECRET = 'profile-secret'
+
+def busy_work(seconds):
+    finish_at = time.perf_counter() + seconds
+    while time.perf_counter() < finish_at:
+        sum(range(1000))
+
+@pytest.fixture
+def store():
+    return ProfileStore(max_per_route=2)
+
+@pytest.fixture
+def client(store):
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, sample_rate=0.0, secret=SECRET, store=store)
+    app.include_router(router)
+
+    @app.get('/items/{item_id}')
+    async def get_item(item_id: int):
+        busy_work(0.05)
+        return {'id': item_id}
+
+    with patch('services.profiling.profile_store', store), patch.dict('os.environ', {'PROFILING_SECRET': SECRET}):
+        yield TestClient(app)
+
+
+def test_requests_are_not_profiled_without_header(client, store):
+    assert client.get('/items/1').status_code == 200
+    assert store.summary() == {}
+
+def test_requests_with_wrong_secret_are_not_profiled(client, store):
+    client.get('/items/1', headers={'X-Profile': 'guess'})
+    assert store.summary() == {}
+
+def test_profiled_request_is_stored_by_route(client, store):
+    response = client.get('/items/1', headers={'X-Profile': SECRET})
+    client.get('/items/2', headers={'X-Profile': SECRET})
+
+    assert response.json() == {'id': 1}
+    summary = store.summary()
+    assert list(summary) == ['/items/{item_id}']
+    assert len(summary['/items/{item_id}']) == 2
+    assert summary['/items/{item_id}'][0]['samples'] > 0
+
+def test_store_keeps_most_recent_profiles(client, store):
+    for item_id in range(4):
+        client.get(f'/items/{item_id}', headers={'X-Profile': SECRET})
+
+    assert len(store.summary()['/items/{item_id}']) == 2
+
+def test_download_speedscope_profile(client, store):
+    client.get('/items/1', headers={'X-Profile': SECRET})
+    profile_id = store.summary()['/items/{item_id}'][0]['id']
+
+    response = client.get(f'/debug/profiles/{profile_id}', headers={'X-Profile': SECRET})
+
+    assert response.status_code == 200
+    profile = response.json()
+    assert profile['$schema'] == 'https://www.speedscope.app/file-format-schema.json'
+    frame_names = {frame['name'] for frame in profile['shared']['frames']}
+    assert 'busy_work' in frame_names
+    assert all(len(p['samples']) == len(p['weights']) for p in profile['profiles'])
+
+def test_download_collapsed_profile(client, store):
+    client.get('/items/1', headers={'X-Profile': SECRET})
+    profile_id = store.summary()['/items/{item_id}'][0]['id']
+
+    response = client.get(f'/debug/profiles/{profile_id}', params={'format': 'collapsed'}, headers={'X-Profile': SECRET})
+
+    assert 'busy_work' in response.text
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in response.text.splitlines())
+
+def test_profiles_require_secret(client):
+    assert client.get('/debug/profiles').status_code == 403
+    assert client.get('/debug/profiles', headers={'X-Profile': SECRET}).status_code == 200
+    assert client.get('/debug/profiles/missing', headers={'X-Profile': SECRET}).status_code == 404
+
+def test_sampling_profiler_skips_idle_threads():
+    import threading
+    event = threading.Event()
+    idle_thread = threading.Thread(target=event.wait, daemon=True)
+    idle_thread.start()
+    profiler = SamplingProfiler({idle_thread.ident}, interval=0.001)
+
+    profiler.start()
+    time.sleep(0.05)
+    profiler.stop()
+    profiler.join()
+    event.set()
+
+    assert profiler.samples == {}
+
+def test_sampling_profiler_picks_up_threads_started_later():
+    import threading
+    profiler = SamplingProfiler(set(), interval=0.001, thread_prefixes=('late-worker',))
+    profiler.start()
+    time.sleep(0.01)
+    worker = threading.Thread(target=busy_work, args=(0.05,), name='late-worker', daemon=True)
+    worker.start()
+    worker.join()
+    profiler.stop()
+    profiler.join()
+
+    assert list(profiler.samples) == ['late-worker']
+
+def test_profiles_are_rendered_in_the_cpu_pool_when_downloaded(client, store):
+    import threading
+    rendered_on = []
+    to_speedscope = SamplingProfiler.to_speedscope
+
+    def record_thread(profiler, name):
+        rendered_on.append(threading.current_thread().name)
+        return to_speedscope(profiler, name)
+
+    with patch.object(SamplingProfiler, 'to_speedscope', record_thread):
+        client.get('/items/1', headers={'X-Profile': SECRET})
+        assert rendered_on == []
+
+        profile_id = store.summary()['/items/{item_id}'][0]['id']
+        assert client.get(f'/debug/profiles/{profile_id}', headers={'X-Profile': SECRET}).status_code == 200
+
+    assert len(rendered_on) == 1 and rendered_on[0].startswith('cpu-pool')
@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import pytest
+from fastapi.testclient import TestClient
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from db.models import GlobalAccuracyCount
+from db.queries import select_reading_changes
+from main import app
+
+PROBABILITIES = [0.02, 0.01, 0.05, 0.7, 0.12, 0.08, 0.02]
+
+# stands in for the db session, records what the endpoint adds and returns the added reading
+class FakeSession:
+    def __init__(self):
+        self.added = []
+        self.statements = []
+        self.committed = False
+        self.accuracy_count = GlobalAccuracyCount(count_id=1, accurate_readings=0, failed_readings=0)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    async def get(self, model, key):
+        return self.accuracy_count
+
+    async def flush(self):
+        self.added[-1].reading_id = 1
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        pass
+
+    async def execute(self, query):
+        self.statements.append(query)
+        reading = self.added[-1]
+        row = SimpleNamespace(reading_id=1, label='Happy', name=None, datetime=datetime.datetime(2024, 9, 1, 12), note=reading.note)
+        return SimpleNamespace(fetchone=lambda: row)
+
+@pytest.fixture
+def session():
+    session = FakeSession()
+    with patch('endpoints.readings.Session', return_value=session), \
+         patch('endpoints.readings.verify_token', return_value={'valid': True}), \
+         patch('db.queries.select_emotion_id', return_value=4):
+        yield session
+
+def upload_reading(headers: dict = {}, **body):
+    reading = {'emotion': 'happy', 'is_accurate': True, 'timestamp': '2024-09-01T12:00', 'clerk_id': 'user_1', **body}
+    return TestClient(app).post('/api/readings', json=reading, headers={'Authorization': 'Bearer token', **headers})
+
+
+def test_reading_stores_probabilities(session):
+    response = upload_reading(probabilities=PROBABILITIES)
+
+    assert response.status_code == 201
+    reading = session.added[0]
+    assert reading.probabilities == PROBABILITIES
+    assert reading.confidence == 0.7
+
+def test_reading_without_probabilities(session):
+    response = upload_reading()
+
+    assert response.status_code == 201
+    assert session.added[0].probabilities is None
+    assert session.added[0].confidence is None
+
+def test_reading_stores_model_version_and_feedback(session):
+    response = upload_reading(is_accurate=False, model_version='2')
+
+    assert response.status_code == 201
+    assert session.added[0].model_version == '2'
+    assert session.added[0].is_accurate is False
+    assert session.accuracy_count.failed_readings == 1
+
+def test_reading_without_model_version(session):
+    assert upload_reading().status_code == 201
+    assert session.added[0].model_version is None
+    assert session.added[0].is_accurate is True
+
+@pytest.mark.parametrize('probabilities', [PROBABILITIES[:6], PROBABILITIES + [0.0], [1.5] + PROBABILITIES[1:]])
+def test_reading_rejects_invalid_probabilities(session, probabilities):
+    assert upload_reading(probabilities=probabilities).status_code == 422
+    assert session.added == []
+
+def test_reading_with_idempotency_key_stores_response(session):
+    with patch('db.queries.claim_idempotency_key', AsyncMock(return_value=True)) as claim:
+        response = upload_reading(headers={'Idempotency-Key': 'key-1'})
+
+    assert response.status_code == 201
+    claim.assert_awaited_once_with(session, 'user_1', 'key-1')
+    # the reselect, then the response stored with the key before the commit
+    stored = session.statements[-1].compile().params
+    assert stored['response'] == response.json()
+    assert stored['status_code'] == 201
+    assert session.committed
+    assert session.accuracy_count.accurate_readings == 1
+
+def test_retried_reading_returns_stored_response(session):
+    stored = {'id': 1, 'emotion': 'Happy', 'location': None, 'datetime': '2024-09-01T12:00', 'note': None}
+    with patch('db.queries.claim_idempotency_key', AsyncMock(return_value=False)), \
+         patch('db.queries.select_idempotent_response', AsyncMock(return_value=(stored, 201))), \
+         patch('db.queries.select_emotion_id') as select_emotion_id:
+        response = upload_reading(headers={'Idempotency-Key': 'key-1'})
+
+    assert response.status_code == 201
+    assert response.json() == stored
+    # a retry doesn't look anything up, add a reading or count its accuracy again
+    select_emotion_id.assert_not_called()
+    assert session.added == []
+    assert session.accuracy_count.accurate_readings == 0
+
+def test_empty_idempotency_key_is_rejected(session):
+    assert upload_reading(headers={'Idempotency-Key': ''}).status_code == 422
+
+def make_row(reading_id: int, sync_version: int):
+    return SimpleNamespace(reading_id=reading_id, sync_version=sync_version, label='Happy', name=None, datetime=datetime.datetime(2024, 9, 1, 12), note=None)
+
+# the readings query then the tombstones query, each already in sync_version order
+class ChangesSession:
+    def __init__(self, readings: list, tombstones: list):
+        self.results = [readings, tombstones]
+
+    async def execute(self, query):
+        rows = self.results.pop(0)
+        return SimpleNamespace(all=lambda: rows)
+
+def test_reading_changes_merge_deletions_in_version_order():
+    session = ChangesSession([make_row(1, 10), make_row(3, 12), make_row(4, 12)], [SimpleNamespace(reading_id=2, sync_version=11)])
+    with patch('db.queries.select_sync_horizon', AsyncMock(return_value=100)):
+        changes = asyncio.run(select_reading_changes(session, 'user_1', (-1, 0), 3))
+
+    assert [reading['id'] for reading in changes['readings']] == [1, 3]
+    assert changes['deleted'] == [2]
+    assert changes['cursor'] == (12, 3)
+    assert changes['has_more']
+
+def test_no_reading_changes_keeps_cursor():
+    with patch('db.queries.select_sync_horizon', AsyncMock(return_value=100)):
+        changes = asyncio.run(select_reading_changes(ChangesSession([], []), 'user_1', (12, 3), 500))
+
+    assert changes == {'readings': [], 'deleted': [], 'cursor': (12, 3), 'has_more': False}
+
+@pytest.fixture
+def authorised():
+    with patch('endpoints.readings.verify_token', return_value={'valid': True}), \
+         patch('endpoints.readings.read_session', lambda clerk_id: FakeSession()), \
+         patch('endpoints.readings.Session', FakeSession):
+        yield TestClient(app)
+
+def test_sync_endpoint_round_trips_cursor(authorised):
+    changes = {'readings': [], 'deleted': [7], 'cursor': (12, 7), 'has_more': False}
+    with patch('endpoints.readings.select_reading_changes', AsyncMock(return_value=changes)) as select_changes:
+        response = authorised.get('/api/readings/sync', params={'clerk_id': 'user_1', 'cursor': '10.2'}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 200
+    assert response.json() == {'readings': [], 'deleted': [7], 'cursor': '12.7', 'has_more': False}
+    assert select_changes.call_args.args[1:] == ('user_1', (10, 2), 500)
+
+@pytest.mark.parametrize('cursor', ['10', 'a.b', '1.2.3'])
+def test_sync_endpoint_rejects_invalid_cursor(authorised, cursor):
+    response = authorised.get('/api/readings/sync', params={'clerk_id': 'user_1', 'cursor': cursor}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 400
+
+def test_delete_missing_reading(authorised):
+    with patch('endpoints.readings.delete_reading', AsyncMock(return_value=False)):
+        response = authorised.delete('/api/readings/5', params={'clerk_id': 'user_1'}, headers={'Authorization': 'Bearer token'})
+
+    assert response.status_code == 404
+
+def test_readings_in_compact_encoding(authorised):
+    readings = {'readings': [{'id': 1, 'emotion': 'Happy', 'location': 'Home', 'datetime': '2024-09-01T12:00', 'note': None}], 'counts': {'Happy': 1}}
+    with patch('endpoints.readings.select_user_readings', AsyncMock(return_value=readings)):
+        response = authorised.get('/api/readings', params={'clerk_id': 'user_1'}, headers={'Authorization': 'Bearer token'})
+        compact = authorised.get('/api/readings', params={'clerk_id': 'user_1', 'compact': 'true'}, headers={'Authorization': 'Bearer token'})
+
+    assert response.json() == readings
+    assert compact.status_code == 200
+    assert compact.json()['locations'] == ['Home']
+    assert compact.json()['readings'] == [[1, 3, 0, '2024-09-01T12:00', None]]
@@ -0,0 +1,66 @@
+import pickle
+import pytest
+from datetime import datetime, timezone
+from kombu.serialization import dumps, loads
+from services.celery.celery_config import celery_app
+from services.celery.drain_pickle_messages import convert_message
+from services.celery.serializers import COMPACT_JSON, COMPACT_JSON_CONTENT_TYPE, from_epoch_seconds, to_compact_payload, to_epoch_seconds
+
+@pytest.fixture
+def clerk_id():
+    return 'user_2lQF4rzaQnsst56zUbVxfTnHuth'
+
+def test_compact_json_round_trip(clerk_id):
+    payload = ([[clerk_id, 'user_b'], 1700000000], {}, {'callbacks': None})
+
+    content_type, content_encoding, body = dumps(payload, serializer=COMPACT_JSON)
+
+    assert content_type == COMPACT_JSON_CONTENT_TYPE
+    assert b' ' not in body.encode('utf-8'), "compact json should not contain whitespace"
+    assert loads(body, content_type, content_encoding, accept={content_type}) == [[[clerk_id, 'user_b'], 1700000000], {}, {'callbacks': None}]
+
+def test_compact_json_encodes_datetimes_as_iso():
+    value = datetime(2023, 1, 1, 9, 30, tzinfo=timezone.utc)
+
+    content_type, content_encoding, body = dumps([value], serializer=COMPACT_JSON)
+
+    assert loads(body, content_type, content_encoding, accept={content_type}) == ['2023-01-01T09:30:00+00:00']
+
+def test_compact_json_rejects_unsupported_types():
+    with pytest.raises(Exception):
+        dumps([object()], serializer=COMPACT_JSON)
+
+def test_epoch_seconds_round_trip():
+    value = datetime(2023, 1, 1, 9, 30, tzinfo=timezone.utc)
+
+    assert to_epoch_seconds(value) == 1672565400
+    assert from_epoch_seconds(to_epoch_seconds(value)) == value
+
+def test_naive_datetimes_are_treated_as_utc():
+    assert to_epoch_seconds(datetime(2023, 1, 1, 9, 30)) == 1672565400
+
+def test_celery_does_not_use_pickle():
+    assert celery_app.conf.task_serializer == COMPACT_JSON
+    assert celery_app.conf.result_serializer == COMPACT_JSON
+    assert 'pickle' not in celery_app.conf.accept_content
+
+def test_to_compact_payload_converts_nested_datetimes(clerk_id):
+    value = datetime(2023, 1, 1, 9, 30, tzinfo=timezone.utc)
+
+    assert to_compact_payload(([clerk_id, value], {'eta': value})) == [[clerk_id, 1672565400], {'eta': 1672565400}]
+
+def test_drain_drops_legacy_pickle_messages(clerk_id):
+    body = pickle.dumps(([clerk_id, datetime.now(timezone.utc), datetime.now(timezone.utc)], {}, {}))
+
+    assert convert_message({'task': 'services.celery.tasks.daily_scheduler'}, 'application/x-python-serialize', 'binary', body) is None
+
+def test_drain_converts_other_pickle_messages(clerk_id):
+    body = pickle.dumps(([clerk_id], {}, {}))
+
+    converted_body, serializer = convert_message({'task': 'services.celery.tasks.send_notification'}, 'application/x-python-serialize', 'binary', body)
+
+    assert serializer == COMPACT_JSON
+    assert converted_body == [[clerk_id], {}, {}]
+
+def test_drain_leaves_new_messages_untouched():
+    assert convert_message({'task': 'services.celery.tasks.send_notification'}, COMPACT_JSON_CONTENT_TYPE, 'utf-8', b'[]') == (b'[]', None)
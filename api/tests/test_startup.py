@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+from unittest.mock import AsyncMock, patch
+from benchmarks.importtime import LAZY_MODULES, TARGETS
+from main import create_app
+
+API_DIR = os.path.dirname(os.path.dirname(__file__))
+
+# import a module in a fresh interpreter without the database settings, returns the lazy modules it pulled in
+def get_imported(module: str, lazy_modules: list[str]) -> list[str]:
+    env = {key: value for key, value in os.environ.items() if not key.startswith('DB_')}
+    result = subprocess.run(
+        [sys.executable, '-c', f'import sys, {module}; print(",".join(m for m in {lazy_modules!r} if m in sys.modules))'],
+        cwd=API_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return [name for name in result.stdout.strip().split(',') if name]
+
+
+def test_api_import_is_lazy():
+    assert get_imported(TARGETS['api'][0], LAZY_MODULES['api']) == []
+
+def test_worker_import_is_lazy():
+    assert get_imported(TARGETS['worker'][0], LAZY_MODULES['worker']) == []
+
+def test_create_app_builds_a_new_app():
+    app = create_app()
+    paths = {route.path for route in app.routes}
+
+    assert app is not create_app()
+    assert {'/', '/metrics', '/healthz', '/readyz', '/api/predict', '/api/users', '/api/readings'} <= paths
+
+def test_engine_is_built_and_disposed_with_the_app():
+    with patch('main.get_engine') as get_engine, patch('main.dispose_engine', new_callable=AsyncMock) as dispose_engine, \
+            patch('main.health_checker') as health_checker:
+        health_checker.stop = AsyncMock()
+        with TestClient(create_app()) as client:
+            get_engine.assert_called_once()
+            assert client.get('/').status_code == 200
+        dispose_engine.assert_awaited_once()
@@ -1,8 +1,13 @@
+import asyncio
 import os
 import pytest
-from datetime import datetime, timedelta
-from unittest.mock import patch
-from services.celery.tasks import daily_scheduler, send_notification, schedule_notifications
+from datetime import datetime, time, timedelta, timezone
+from time import monotonic
+from unittest.mock import AsyncMock, patch
+from db.queries import delete_expired_idempotency_keys, insert_notification_slots
+from services.celery.serializers import to_epoch_seconds
+from db.partitions import maintain_partitions
+from services.celery.tasks import IDEMPOTENCY_KEY_RETENTION, NOTIFY_TIMEOUT_SECONDS, daily_scheduler, dispatch_due_notifications, drain_notification_outbox, maintain_reading_partitions, plan_user_notifications, remove_expired_idempotency_keys, process_notification_outbox, send_notification, send_notification_batch, schedule_notifications
 
 @pytest.fixture
 def mock_requests_post(mocker):
@@ -37,48 +42,141 @@ def test_send_notification(mock_requests_post, clerk_id):
             'appToken': os.getenv('NATIVE_NOTIFY_TOKEN'),
             'title': 'How are you feeling?',
             'message': 'Time to check in on your mood!',
-        }
+        },
+        timeout=NOTIFY_TIMEOUT_SECONDS,
     )
 
 
 
-def test_schedule_notifications(mock_apply_async, clerk_id, start_datetime, end_datetime):
-    # get 3 test notification times
-    with patch('services.celery.tasks.get_random_notification_times') as mock_get_random_notification_times:
-        mock_get_random_notification_times.return_value = [
-            start_datetime + timedelta(hours=1),
-            start_datetime + timedelta(hours=2),
-            start_datetime + timedelta(hours=3)
-        ]
-        
-        schedule_notifications(clerk_id, start_datetime, end_datetime)
-
-        # verify 3 calls have been made and the arguments are correct
-        assert mock_apply_async.call_count == 3
-        for call in mock_apply_async.call_args_list:
-            args, kwargs = call
-            assert kwargs['args'] == [clerk_id]
-            assert 'eta' in kwargs
-            assert kwargs['eta'] in mock_get_random_notification_times.return_value
-            assert kwargs['serializer'] == 'pickle'
-
-
-
-def test_daily_scheduler(mock_apply_async, clerk_id, start_datetime, end_datetime):
-    
-    with patch('services.celery.tasks.schedule_notifications') as mock_schedule_notifications:
-        daily_scheduler(clerk_id, start_datetime, end_datetime)
-        
-        # mock the schedule_notifications and verify it was called with the correct arguments
-        mock_schedule_notifications.assert_called_once_with(clerk_id, start_datetime, end_datetime)
-
-        # get the arguments passed to the apply_async call
-        tomorrow_start_time = start_datetime + timedelta(days=1)
-        tomorrow_end_time = end_datetime + timedelta(days=1)
-
-        # verify that daily_scheduler was called again to start at start time with the correct arguments
-        mock_apply_async.assert_called_once()
-        args, kwargs = mock_apply_async.call_args
-        assert kwargs['args'] == [clerk_id, tomorrow_start_time, tomorrow_end_time]
-        assert kwargs['eta'] == tomorrow_start_time
-        assert kwargs['serializer'] == 'pickle'
\ No newline at end of file
+def test_dispatch_due_notifications_fans_out_in_bulk(clerk_id):
+    clerk_ids = [clerk_id, 'user_2lRbgolJz67jaNXPxu3oaEiCSmA']
+    with patch('services.celery.tasks.run_query', return_value=clerk_ids) as mock_run_query, \
+         patch('services.celery.tasks.group') as mock_group:
+        dispatched = dispatch_due_notifications()
+
+        # fewer than a full batch was claimed so only one claim is made
+        mock_run_query.assert_called_once()
+        mock_group.return_value.apply_async.assert_called_once()
+        # claimed users are sent as a single batch, with the time they were due as epoch seconds
+        signatures = list(mock_group.call_args.args[0])
+        assert len(signatures) == 1
+        batch, scheduled_for = signatures[0].args
+        assert batch == clerk_ids
+        assert isinstance(scheduled_for, int)
+        assert dispatched == 2
+
+
+def test_dispatch_due_notifications_claims_until_empty(clerk_id):
+    with patch('services.celery.tasks.DISPATCH_BATCH_SIZE', 2), \
+         patch('services.celery.tasks.run_query', side_effect=[[clerk_id, clerk_id], [clerk_id], []]) as mock_run_query, \
+         patch('services.celery.tasks.group') as mock_group:
+        dispatched = dispatch_due_notifications()
+
+        assert mock_run_query.call_count == 2
+        assert mock_group.return_value.apply_async.call_count == 2
+        assert dispatched == 3
+
+
+def test_dispatch_due_notifications_splits_into_batches(clerk_id):
+    clerk_ids = [f'user_{i}' for i in range(5)]
+    with patch('services.celery.tasks.NOTIFICATION_BATCH_SIZE', 2), \
+         patch('services.celery.tasks.run_query', return_value=clerk_ids), \
+         patch('services.celery.tasks.group') as mock_group:
+        dispatch_due_notifications()
+
+        signatures = list(mock_group.call_args.args[0])
+        assert [signature.args[0] for signature in signatures] == [clerk_ids[0:2], clerk_ids[2:4], clerk_ids[4:5]]
+
+
+def test_send_notification_batch_aggregates_results(clerk_id):
+    with patch('services.celery.tasks.get_notification_sender') as mock_get_sender:
+        mock_get_sender.return_value.send_batch.return_value = {'sent': 1, 'failed': ['user_b'], 'unsent': [], 'duration_seconds': 0.5}
+        result = send_notification_batch([clerk_id, 'user_b'])
+
+        clerk_ids, deadline = mock_get_sender.return_value.send_batch.call_args.args
+        assert clerk_ids == [clerk_id, 'user_b']
+        # the batch stops before the soft time limit
+        assert deadline < monotonic() + 240
+        assert result['sent'] == 1
+        assert result['failed'] == ['user_b']
+
+
+def test_send_notification_batch_reports_delay(clerk_id):
+    scheduled_for = to_epoch_seconds(datetime.now(timezone.utc) - timedelta(minutes=2))
+    with patch('services.celery.tasks.get_notification_sender') as mock_get_sender:
+        mock_get_sender.return_value.send_batch.return_value = {'sent': 1, 'failed': [], 'unsent': [], 'duration_seconds': 0.5}
+        result = send_notification_batch([clerk_id], scheduled_for)
+
+        assert 120 <= result['delay_seconds'] < 130
+
+
+def test_send_notification_batch_requeues_unsent(mock_apply_async, clerk_id):
+    scheduled_for = to_epoch_seconds(datetime.now(timezone.utc))
+    with patch('services.celery.tasks.get_notification_sender') as mock_get_sender:
+        mock_get_sender.return_value.send_batch.return_value = {'sent': 1, 'failed': [], 'unsent': ['user_b'], 'duration_seconds': 220}
+        send_notification_batch([clerk_id, 'user_b'], scheduled_for)
+
+        mock_apply_async.assert_called_once_with((['user_b'], scheduled_for))
+
+
+def test_plan_user_notifications_only_plans_future_slots(clerk_id):
+    with patch('services.celery.tasks.run_query') as mock_run_query:
+        planned = plan_user_notifications(clerk_id, '00:00', '23:59')
+
+        query, slots = mock_run_query.call_args.args
+        assert query is insert_notification_slots
+        assert len(slots) == planned
+        # tomorrow's 3 slots are always planned, today's depend on the time of day
+        assert 3 <= planned <= 6
+        assert all(slot['send_at'] > datetime.now(timezone.utc) for slot in slots)
+
+
+def test_legacy_daily_scheduler_does_not_reschedule(mock_apply_async, clerk_id, start_datetime, end_datetime):
+    daily_scheduler(clerk_id, start_datetime, end_datetime)
+    schedule_notifications(clerk_id, start_datetime, end_datetime)
+
+    # legacy tasks are dropped, nothing is scheduled
+    mock_apply_async.assert_not_called()
+
+
+def test_drain_notification_outbox_stops_when_outbox_is_empty():
+    with patch('services.celery.tasks.OUTBOX_BATCH_SIZE', 2), \
+         patch('services.celery.tasks.run_query', side_effect=[2, 1]) as mock_run_query:
+        planned = drain_notification_outbox()
+
+        assert mock_run_query.call_count == 2
+        assert planned == 3
+
+
+def test_process_notification_outbox_plans_and_commits(clerk_id):
+    session = AsyncMock()
+    now = datetime(2023, 1, 1, 12, 0, tzinfo=timezone.utc)
+    users = [(clerk_id, time(9, 0), time(17, 0)), ('user_b', time(13, 0), time(14, 0))]
+    with patch('services.celery.tasks.claim_notification_outbox', AsyncMock(return_value=users)), \
+         patch('services.celery.tasks.insert_notification_slots', AsyncMock()) as mock_insert:
+        processed = asyncio.run(process_notification_outbox(session, now, 10))
+
+        slots = mock_insert.call_args.args[1]
+        # user_b's window hasn't started yet so all of today's slots are kept, plus 3 each for tomorrow
+        assert len([slot for slot in slots if slot['clerk_id'] == 'user_b']) == 6
+        assert all(slot['send_at'] > now for slot in slots)
+        session.commit.assert_awaited()
+        assert processed == 2
+
+
+def test_maintain_reading_partitions():
+    archived = [{'partition': 'readings_2023_01', 'path': 'archive/readings_2023_01.parquet', 'rows': 10}]
+    with patch('services.celery.tasks.run_query', return_value={'created': ['readings_2024_04'], 'archived': archived}) as mock_run_query:
+        result = maintain_reading_partitions()
+
+        mock_run_query.assert_called_once_with(maintain_partitions)
+        assert result['created'] == ['readings_2024_04']
+
+
+def test_remove_expired_idempotency_keys():
+    with patch('services.celery.tasks.run_query', return_value=3) as mock_run_query:
+        assert remove_expired_idempotency_keys() == 3
+
+        query, before = mock_run_query.call_args.args
+        assert query is delete_expired_idempotency_keys
+        assert datetime.now(timezone.utc) - before >= IDEMPOTENCY_KEY_RETENTION
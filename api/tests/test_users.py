@@ -0,0 +1,84 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+from db.models import NotificationOutbox, User
+from main import app
+
+# stands in for the db session, records what the endpoint adds and commits
+class FakeSession:
+    def __init__(self):
+        self.added = []
+        self.commits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    async def commit(self):
+        self.commits += 1
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+@pytest.fixture
+def session():
+    session = FakeSession()
+    with patch('endpoints.users.Session', return_value=session), \
+         patch('endpoints.users.verify_token', return_value={'valid': True}):
+        yield session
+
+@pytest.fixture
+def broker_outage():
+    # any publish to the broker hangs for 2 seconds before failing, like an unreachable rabbitmq
+    def publish(*args, **kwargs):
+        time.sleep(2)
+        raise ConnectionError("broker unreachable")
+    with patch('celery.app.task.Task.apply_async', side_effect=publish) as mock_apply_async:
+        yield mock_apply_async
+
+def add_user(client):
+    return client.post(
+        '/api/users',
+        json={'id': 'user_2lQF4rzaQnsst56zUbVxfTnHuth', 'start_time': '09:00', 'end_time': '17:00'},
+        headers={'Authorization': 'Bearer token'}
+    )
+
+
+def test_add_user_writes_user_and_outbox_in_one_commit(client, session):
+    response = add_user(client)
+
+    assert response.status_code == 201
+    assert session.commits == 1
+    user, outbox = session.added
+    assert isinstance(user, User)
+    assert isinstance(outbox, NotificationOutbox)
+    assert outbox.clerk_id == user.clerk_id
+    assert outbox.notification_start_time == user.notification_start_time
+
+
+def test_add_user_latency_does_not_depend_on_broker(client, session, broker_outage):
+    started_at = time.perf_counter()
+    response = add_user(client)
+    elapsed = time.perf_counter() - started_at
+
+    assert response.status_code == 201
+    broker_outage.assert_not_called()
+    assert elapsed < 0.5, "signup should not wait on the broker"
+
+
+def test_add_user_invalid_times(client, session):
+    response = client.post(
+        '/api/users',
+        json={'id': 'user_2lQF4rzaQnsst56zUbVxfTnHuth', 'start_time': '9am', 'end_time': '17:00'},
+        headers={'Authorization': 'Bearer token'}
+    )
+
+    assert response.status_code == 400
+    assert session.added == []
@@ -142,8 +142,13 @@ export default function Camera(): React.JSX.Element {
             Alert.alert('Error', response.error); // api returns user friendly error messages
           }
         } else {
-          // navigate to results page with the emotion as a parameter
-          router.replace(`/results?emotion=${response.prediction}` as Href);
+          // navigate to results page with the emotion, probabilities and model version as parameters, they're saved with the reading
+          const modelVersion = response.model_version
+            ? `&model_version=${encodeURIComponent(response.model_version)}`
+            : '';
+          router.replace(
+            `/results?emotion=${response.prediction}&probabilities=${response.probabilities.join(',')}${modelVersion}` as Href
+          );
         }
       } catch (error) {
         console.error('Error taking photo:', error);
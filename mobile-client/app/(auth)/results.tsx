@@ -27,16 +27,27 @@ import Animated, {
 import EmojiCarousel from '@/components/ui/EmojiCarousel';
 import { useAuth } from '@clerk/clerk-expo';
 import { uploadReading, ReadingData } from '@/services/api/uploadReading';
+import uuid from 'react-native-uuid';
 import { useUserDataContext } from '@/contexts/RefreshDataContext';
 
 export default function Results(): React.JSX.Element {
-  const { emotion: initialEmotion } = useLocalSearchParams<{ emotion: string }>();
+  const {
+    emotion: initialEmotion,
+    probabilities,
+    model_version: modelVersion,
+  } = useLocalSearchParams<{
+    emotion: string;
+    probabilities?: string;
+    model_version?: string;
+  }>();
   const keyboard = useAnimatedKeyboard();
   const [emotion, setEmotion] = useState<string>(initialEmotion);
   const [isAccurate, setIsAccurate] = useState<boolean | null>(null);
   const [location, setLocation] = useState<string | null>(null);
   const [note, setNote] = useState<string | null>(null);
   const [showCarousel, setShowCarousel] = useState<boolean>(false);
+  // one key for this reading, kept if the upload fails so trying again can't save it twice
+  const [idempotencyKey] = useState<string>(() => uuid.v4() as string);
   const { getToken, userId } = useAuth();
   const { userData, setUserData } = useUserDataContext();
 
@@ -76,10 +87,12 @@ export default function Results(): React.JSX.Element {
     // only add optional values if they are not null
     if (location !== null) readingData.location = location;
     if (note !== null) readingData.note = note;
+    if (probabilities) readingData.probabilities = probabilities.split(',').map(Number);
+    if (modelVersion) readingData.model_version = modelVersion;
 
     // send the reading data to the server
     try {
-      const response = await uploadReading(readingData, token!);
+      const response = await uploadReading(readingData, token!, idempotencyKey);
       if ('error' in response) {
         Alert.alert('Error', response.error);
         return;
@@ -103,7 +116,18 @@ export default function Results(): React.JSX.Element {
       console.error('Error uploading reading', error);
       Alert.alert('Error', 'Failed to upload reading, please try again');
     }
-  }, [getToken, emotion, isAccurate, location, note, uploadReading, router]);
+  }, [
+    getToken,
+    emotion,
+    isAccurate,
+    location,
+    note,
+    probabilities,
+    modelVersion,
+    idempotencyKey,
+    uploadReading,
+    router,
+  ]);
 
   return (
     <Animated.View style={shiftScreenOnKeyboardInput} className="flex-1">
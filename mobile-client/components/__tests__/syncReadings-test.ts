@@ -0,0 +1,25 @@
+import { applySyncChanges } from '@/services/api/syncReadings';
+
+jest.mock('@react-native-async-storage/async-storage', () => ({}));
+
+describe('applySyncChanges', () => {
+  it('should add, update and remove readings keeping the most recent first', () => {
+    const readings = [
+      { id: 2, emotion: 'Sad', datetime: '2024-09-02T09:00' },
+      { id: 1, emotion: 'Happy', datetime: '2024-09-01T09:00' },
+    ];
+
+    const synced = applySyncChanges(readings, {
+      readings: [
+        { id: 3, emotion: 'Neutral', datetime: '2024-09-03T09:00' },
+        { id: 2, emotion: 'Angry', datetime: '2024-09-02T09:00' },
+      ],
+      deleted: [1],
+    });
+
+    expect(synced).toEqual([
+      { id: 3, emotion: 'Neutral', datetime: '2024-09-03T09:00' },
+      { id: 2, emotion: 'Angry', datetime: '2024-09-02T09:00' },
+    ]);
+  });
+});
@@ -1,7 +1,8 @@
 import React, { createContext, useState, useContext, useEffect } from 'react';
 import { EmotionReading, ReadingsResponse } from '@/services/api/fetchUserData';
 import { ErrorResponse } from '@/services/api/customFetch';
-import { fetchWeeklyData } from '@/services/api/userDataUtils';
+import { getWeeklyData } from '@/services/api/userDataUtils';
+import { syncReadings } from '@/services/api/syncReadings';
 import { Alert } from 'react-native';
 import { useAuth } from '@clerk/clerk-expo';
 import { format } from 'date-fns';
@@ -27,7 +28,8 @@ export const UserDataStateProvider: React.FC<{
   const [userData, setUserData] = useState<ReadingsResponse | null>(null);
   const [todaysReadings, setTodaysReadings] = useState<EmotionReading[]>([]);
 
-  // fetch user data initial mount on authenticated routes, set in state for bar chart and home screen
+  // sync user data initial mount on authenticated routes, set this week's in state for bar chart and home screen
+  // only the readings changed since the last time the app opened are downloaded
   useEffect(() => {
     console.log('refreshing data');
     const getUserData = async () => {
@@ -35,10 +37,7 @@ export const UserDataStateProvider: React.FC<{
       if (!userId || !token) {
         throw new Error('User ID or token is null');
       }
-      const response: ReadingsResponse | ErrorResponse = await fetchWeeklyData(
-        userId!,
-        token!
-      );
+      const response: EmotionReading[] | ErrorResponse = await syncReadings(userId!, token!);
       if ('error' in response) {
         if (typeof response.error === 'string') {
           Alert.alert('Error', response.error);
@@ -47,7 +46,7 @@ export const UserDataStateProvider: React.FC<{
         }
         return;
       }
-      setUserData(response);
+      setUserData(getWeeklyData(response));
     };
     getUserData();
   }, []);
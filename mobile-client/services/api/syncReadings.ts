@@ -0,0 +1,63 @@
+import AsyncStorage from '@react-native-async-storage/async-storage';
+import { customFetch, ErrorResponse } from './customFetch';
+import { EmotionReading } from './fetchUserData';
+
+// a page of changes from the sync endpoint, readings added or changed and the ids of readings deleted
+export interface SyncResponse {
+  readings: EmotionReading[];
+  deleted: number[];
+  cursor: string;
+  has_more: boolean;
+}
+
+// the user's history kept on the device with the cursor of the last change it has
+interface SyncedHistory {
+  cursor: string | null;
+  readings: EmotionReading[];
+}
+
+const storageKey = (clerk_id: string): string => `readings-sync:${clerk_id}`;
+
+// applies a page of changes to the local history, kept most recent first like GET /readings
+export const applySyncChanges = (
+  readings: EmotionReading[],
+  changes: Pick<SyncResponse, 'readings' | 'deleted'>
+): EmotionReading[] => {
+  const readingsById = new Map(readings.map(reading => [reading.id, reading]));
+  changes.deleted.forEach(id => readingsById.delete(id));
+  changes.readings.forEach(reading => readingsById.set(reading.id, reading));
+  return [...readingsById.values()].sort((a, b) => b.datetime.localeCompare(a.datetime));
+};
+
+// brings the local history up to date, only the changes since the last sync are downloaded
+// the first sync on a device downloads the whole history a page at a time
+export const syncReadings = async (
+  clerk_id: string,
+  token: string
+): Promise<EmotionReading[] | ErrorResponse> => {
+  const stored = await AsyncStorage.getItem(storageKey(clerk_id));
+  let history: SyncedHistory = stored ? JSON.parse(stored) : { cursor: null, readings: [] };
+  let hasMore = true;
+  while (hasMore) {
+    const queryParams = new URLSearchParams({ clerk_id });
+    if (history.cursor) queryParams.append('cursor', history.cursor);
+    const response = await customFetch<SyncResponse | ErrorResponse>(
+      `${process.env.EXPO_PUBLIC_API_DEV_URL}/readings/sync?${queryParams.toString()}`,
+      {
+        method: 'GET',
+        headers: {
+          'Content-Type': 'application/json',
+          Authorization: `Bearer ${token}`,
+        },
+      }
+    );
+    if ('error' in response) {
+      return response as ErrorResponse;
+    }
+    history = { cursor: response.cursor, readings: applySyncChanges(history.readings, response) };
+    // saved after each page so an interrupted first sync carries on from where it got to
+    await AsyncStorage.setItem(storageKey(clerk_id), JSON.stringify(history));
+    hasMore = response.has_more;
+  }
+  return history.readings;
+};
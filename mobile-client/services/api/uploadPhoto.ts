@@ -7,6 +7,8 @@ import { customFetch, ErrorResponse } from './customFetch';
 export interface PredictionResponse {
   prediction: string;
   confidence: number;
+  probabilities: number[]; // every emotion's probability, in the order ANGRY, DISGUSTED, SCARED, HAPPY, NEUTRAL, SAD, SURPRISED
+  model_version: string | null; // the model version that made the prediction, saved with the reading
 }
 
 export const uploadPhoto = async (
@@ -8,12 +8,16 @@ export interface ReadingData {
   note?: string;
   timestamp: string;
   clerk_id: string;
+  probabilities?: number[];
+  model_version?: string;
 }
 
 // uploads the reading data to the server
+// the idempotency key is unique to the reading and sent again on retries, so a retried upload isn't saved twice
 export const uploadReading = async (
   readingData: ReadingData,
-  token: string
+  token: string,
+  idempotencyKey: string
 ): Promise<EmotionReading | ErrorResponse> => {
   try {
     const response = await customFetch<EmotionReading | ErrorResponse>(
@@ -23,6 +27,7 @@ export const uploadReading = async (
         headers: {
           'Content-Type': 'application/json',
           Authorization: `Bearer ${token}`,
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify(readingData),
       }
@@ -7,8 +7,9 @@ import {
   endOfYear,
   format,
 } from 'date-fns';
-import { fetchReadings, ReadingsResponse, UserDataFilters } from './fetchUserData';
+import { EmotionReading, fetchReadings, ReadingsResponse, UserDataFilters } from './fetchUserData';
 import { ErrorResponse } from './customFetch';
+import { Emotions } from '@/constants/Emotions';
 
 export const fetchWeeklyData = async (
   clerk_id: string,
@@ -51,3 +52,17 @@ export const fetchYearlyData = async (
   const filters: UserDataFilters = { ...timeFrame, ...extraFilters };
   return await fetchReadings(clerk_id, token, filters);
 };
+
+// this week's readings and counts from the synced history, the same as fetchWeeklyData returns without the request
+export const getWeeklyData = (readings: EmotionReading[]): ReadingsResponse => {
+  const now = new Date();
+  const start = format(startOfWeek(now), 'yyyy-MM-dd');
+  const end = format(endOfWeek(now), 'yyyy-MM-dd');
+  const weeklyReadings = readings.filter(reading => {
+    const date = reading.datetime.slice(0, 10);
+    return date >= start && date <= end;
+  });
+  const counts = Object.fromEntries(Object.values(Emotions).map(emotion => [emotion, 0]));
+  weeklyReadings.forEach(reading => (counts[reading.emotion] += 1));
+  return { readings: weeklyReadings, counts };
+};